@@ -0,0 +1,71 @@
+import logging
+from scrapy import signals
+from scrapy.http import HtmlResponse
+from metadata_cache import MetadataCache, get_metadata_cache
+
+logger = logging.getLogger(__name__)
+
+class MetadataCacheMiddleware:
+    """Downloader middleware that serves and revalidates pages from the shared metadata cache.
+
+    Fresh cached bodies are returned without touching the network. Stale ones
+    are requested with If-None-Match/If-Modified-Since, and a 304 is answered
+    from the cached body so the spider still gets a full response.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        path = crawler.settings.get('METADATA_CACHE_PATH')
+        middleware = cls(MetadataCache(path) if path else get_metadata_cache())
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def process_request(self, request, spider):
+        if request.method != 'GET' or request.meta.get('skip_metadata_cache'):
+            return None
+        entry = self.cache.lookup(request.url)
+        if entry is None or entry.body is None:
+            return None
+        if entry.is_fresh():
+            return self._cached_response(request, entry, 'cached')
+        request.meta['metadata_cache_entry'] = entry
+        for header, value in entry.conditional_headers().items():
+            request.headers.setdefault(header, value)
+        return None
+
+    def process_response(self, request, response, spider):
+        if request.method != 'GET' or 'cached' in response.flags or 'revalidated' in response.flags:
+            return response
+        entry = request.meta.get('metadata_cache_entry')
+        if response.status == 304 and entry is not None:
+            self.cache.revalidated(entry, _header_dict(response))
+            return self._cached_response(request, entry, 'revalidated')
+        if response.status == 200 and isinstance(response, HtmlResponse):
+            self.cache.put(request.url, body=response.body, headers=_header_dict(response), final_url=response.url)
+        return response
+
+    def spider_closed(self, spider):
+        logger.info(f"Metadata cache stats: {self.cache.stats()}")
+
+    @staticmethod
+    def _cached_response(request, entry, flag):
+        # The stored Content-Type keeps the page's charset, and the final URL
+        # keeps relative links resolving against where the page really is
+        return HtmlResponse(
+            url=entry.final_url or request.url,
+            body=entry.body,
+            headers={'Content-Type': entry.content_type or 'text/html'},
+            request=request,
+            flags=[flag]
+        )
+
+def _header_dict(response):
+    headers = {}
+    for name in ('ETag', 'Last-Modified', 'Cache-Control', 'Content-Type'):
+        value = response.headers.get(name)
+        if value is not None:
+            headers[name] = value.decode('latin-1')
+    return headers
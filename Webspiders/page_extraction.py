@@ -0,0 +1,601 @@
+"""Single-pass page extraction for PageSummarizerSpider.
+
+The DOM is walked once. Every text node is routed, in document order, to
+whichever outputs it belongs to: the main-content candidates, paragraphs,
+headings, lists, quotes and tables. The item is then assembled from those
+buckets. The routing rules mirror the CSS queries the spider used to run
+one by one (`article *:not(script)::text`, `.content p::text`, `table tr`
+and so on), so the output matches the old item field for field.
+
+How much of that work is done is set by an ExtractionProfile, which names
+the item fields to build and the budgets that bound a single page.
+"""
+import re
+import time
+from metrics import counter, histogram
+from config import EXTRACT_PROFILE
+
+EXTRACT_SECONDS = histogram('edvise_extract_seconds', 'Time in each step of building a summarizer item', ['step'])
+EXTRACT_LIMITS = counter('edvise_extract_limits_total', 'Pages whose extraction hit a budget, by profile and limit',
+                         ['profile', 'limit'])
+
+# Candidate main-content containers, in order of preference
+MAIN_SELECTORS = [
+    'article',
+    'main',
+    '[role="main"]',
+    '.content',
+    '.main-content',
+    '.post-content',
+    '.entry-content',
+    '.article-content',
+    '#content',
+    '#main'
+]
+
+# Containers whose <p> descendants make up the article body, in order of preference
+ARTICLE_SELECTORS = [
+    'article',
+    '.post-body',
+    '.entry-content',
+    '.article-body',
+    '.content'
+]
+
+# Containers whose <ul> descendants are reported as important lists
+LIST_SCOPE_SELECTORS = ['article', 'main', '.content', '.post-content']
+
+# Elements whose own text never counts as main content
+NON_CONTENT_TAGS = frozenset(['script', 'style'])
+# Elements whose own text is skipped by the whole-body fallback
+NON_BODY_TEXT_TAGS = frozenset(['script', 'style', 'nav', 'header', 'footer'])
+HEADING_LEVELS = {'h1': 1, 'h2': 2, 'h3': 3, 'h4': 4, 'h5': 5, 'h6': 6}
+
+QUOTE_PATTERNS = [
+    r'"([^"]{30,200})"',  # Double quotes
+    r'\'([^\']{30,200})\'',  # Smart quotes
+]
+
+# Item fields a profile can turn on; title, meta description and thumbnail are always built
+SECTIONS = (
+    'main_content', 'image_urls', 'headings_hierarchy', 'key_paragraphs', 'article_content',
+    'important_lists', 'key_quotes', 'table_summaries', 'content_stats', 'ai_ready_text',
+)
+# Elements between wall-clock checks while walking
+DEADLINE_CHECK_INTERVAL = 256
+
+# Characters XPath's normalize-space() treats as whitespace, used to split class lists
+_CLASS_SEPARATOR = re.compile(r'[ \t\r\n]+')
+_HAS_LETTER = re.compile(r'[a-zA-Z]')
+
+class ExtractionProfile:
+    """Which item fields to build for a page, and the budgets that bound the work.
+
+    Bodies over max_body_bytes are cut before parsing; the walk stops after
+    max_nodes elements or once max_seconds have passed, and the item is built
+    from what it collected up to then. Tables, lists and images beyond their
+    caps are skipped. A profile with none of the body sections only walks
+    <head>. Each limit hit is recorded in the item's extraction field.
+    """
+
+    def __init__(self, name, sections, max_body_bytes, max_nodes, max_seconds,
+                 max_tables=0, max_lists=0, max_images=0):
+        unknown = set(sections) - set(SECTIONS)
+        if unknown:
+            raise ValueError(f"Unknown extraction sections: {', '.join(sorted(unknown))}")
+        self.name = name
+        self.sections = frozenset(sections)
+        self.max_body_bytes = max_body_bytes
+        self.max_nodes = max_nodes
+        self.max_seconds = max_seconds
+        self.max_tables = max_tables
+        self.max_lists = max_lists
+        self.max_images = max_images
+        self.walk_body = bool(self.sections)
+
+    def __repr__(self):
+        return f'ExtractionProfile({self.name!r})'
+
+EXTRACTION_PROFILES = {profile.name: profile for profile in (
+    # Title, description and og:image from <head>, for link previews
+    ExtractionProfile('metadata-only', (), max_body_bytes=512 * 1024, max_nodes=2000, max_seconds=0.5),
+    # Text for summarization, without lists, quotes, tables or images
+    ExtractionProfile('summary', ('main_content', 'headings_hierarchy', 'key_paragraphs', 'article_content',
+                                  'content_stats', 'ai_ready_text'),
+                      max_body_bytes=2 * 1024 * 1024, max_nodes=50000, max_seconds=2.0),
+    ExtractionProfile('full', SECTIONS, max_body_bytes=5 * 1024 * 1024, max_nodes=200000, max_seconds=5.0,
+                      max_tables=50, max_lists=100, max_images=200),
+)}
+
+def get_profile(profile=None):
+    """An ExtractionProfile, by name or as given; EXTRACT_PROFILE when None"""
+    if isinstance(profile, ExtractionProfile):
+        return profile
+    name = profile or EXTRACT_PROFILE
+    if name not in EXTRACTION_PROFILES:
+        raise ValueError(f"Unknown extraction profile: {name} (choose from {', '.join(EXTRACTION_PROFILES)})")
+    return EXTRACTION_PROFILES[name]
+
+def clean_text(text):
+    """Clean and normalize text"""
+    if not text:
+        return ""
+    return ' '.join(text.split()).strip()
+
+def _compile_selector(selector):
+    """Turn a simple selector (tag, .class, #id or [attr="value"]) into a predicate"""
+    if selector.startswith('.'):
+        name = selector[1:]
+        return lambda tag, attrib: 'class' in attrib and name in _CLASS_SEPARATOR.split(attrib['class'])
+    if selector.startswith('#'):
+        value = selector[1:]
+        return lambda tag, attrib: attrib.get('id') == value
+    if selector.startswith('['):
+        name, value = selector[1:-1].split('=', 1)
+        value = value.strip('"\'')
+        return lambda tag, attrib: attrib.get(name) == value
+    return lambda tag, attrib: tag == selector
+
+def _compile_mask(selectors):
+    """Build a function returning the bitmask of selectors an element matches"""
+    predicates = [(1 << i, _compile_selector(selector)) for i, selector in enumerate(selectors)]
+
+    def mask(tag, attrib):
+        bits = 0
+        for bit, predicate in predicates:
+            if predicate(tag, attrib):
+                bits |= bit
+        return bits
+    return mask
+
+_main_mask = _compile_mask(MAIN_SELECTORS)
+_article_mask = _compile_mask(ARTICLE_SELECTORS)
+_list_scope_mask = _compile_mask(LIST_SCOPE_SELECTORS)
+
+def _selected(nodes, index):
+    """Text nodes whose bitmask includes the selector at index"""
+    bit = 1 << index
+    return [text for bits, text in nodes if bits & bit]
+
+class _Collector:
+    """All descendant text of one element, for <li> and <blockquote>"""
+    __slots__ = ('parts',)
+
+    def __init__(self):
+        self.parts = []
+
+    def text(self):
+        return clean_text(' '.join(self.parts))
+
+class _Table:
+    __slots__ = ('caption', 'headers', 'row_count', 'sample_rows')
+
+    def __init__(self):
+        self.caption = None
+        self.headers = []
+        self.row_count = 0
+        self.sample_rows = []
+
+class _Frame:
+    """Walk state for one open element.
+
+    The *_scope fields describe the element's ancestors plus the element
+    itself, which is what its children inherit; main_bits, body_text and
+    article_bits say where the element's own text nodes go.
+    """
+    __slots__ = ('tag', 'main_scope', 'article_scope', 'list_scope', 'body_scope',
+                 'main_bits', 'body_text', 'article_bits', 'opened')
+
+class PageWalk:
+    """One traversal of an lxml tree, collecting everything the summarizer item needs"""
+
+    def __init__(self, profile=None):
+        self.profile = get_profile(profile)
+        self.started = time.perf_counter()
+        self.deadline = self.started + self.profile.max_seconds
+        self.nodes = 0
+        self.limits_hit = {}
+        sections = self.profile.sections
+        self._want_images = 'image_urls' in sections
+        self._want_lists = 'important_lists' in sections
+        self._want_quotes = 'key_quotes' in sections
+        self._want_tables = 'table_summaries' in sections
+        self.title = None
+        self._main_content = None
+        self.meta_description = None
+        self.thumbnail = None
+        self.image_urls = []
+        self.all_text = []
+        self.main_nodes = []  # (MAIN_SELECTORS bitmask, text)
+        self.body_nodes = []
+        self.paragraph_texts = []
+        self.article_nodes = []  # (ARTICLE_SELECTORS bitmask, text)
+        self.paragraph_count = 0
+        self.headings = []  # [level, first descendant text node]
+        self.lists = []  # one list of <li> collectors per in-scope <ul>
+        self.quotes = []
+        self.tables = []
+        self._awaiting_headings = []
+        self._open_lists = []
+        self._open_collectors = []
+        self._open_tables = []
+        self._open_rows = []
+
+    def walk(self, root):
+        if root is None:
+            return self
+        profile = self.profile
+        self.nodes = 1
+        stack = [(root, iter(root), self._enter(root, None))]
+        while stack:
+            element, children, frame = stack[-1]
+            child = next(children, None)
+            if child is None:
+                stack.pop()
+                self._leave(frame)
+                if stack and element.tail:
+                    self._text(stack[-1][2], element.tail)
+                continue
+            if not isinstance(child.tag, str):
+                # Comments and processing instructions: only their tail is text
+                if child.tail:
+                    self._text(frame, child.tail)
+                continue
+            if child.tag == 'body' and not profile.walk_body:
+                continue
+            self.nodes += 1
+            if self.nodes > profile.max_nodes:
+                self.hit('max_nodes')
+                break
+            if not self.nodes % DEADLINE_CHECK_INTERVAL and time.perf_counter() > self.deadline:
+                self.hit('max_seconds')
+                break
+            stack.append((child, iter(child), self._enter(child, frame)))
+        return self
+
+    def hit(self, limit):
+        """Note that a budget stopped or trimmed the extraction"""
+        if limit not in self.limits_hit:
+            self.limits_hit[limit] = None
+            EXTRACT_LIMITS.inc(profile=self.profile.name, limit=limit)
+
+    def build(self, section, func, empty, *args):
+        """One item field: func(*args), timed, or empty if the profile skips it"""
+        if section not in self.profile.sections:
+            return empty
+        with EXTRACT_SECONDS.time(step=section):
+            return func(*args)
+
+    def fingerprint_text(self):
+        """The text a recrawl compares to tell whether the page changed.
+
+        That is the main_content the item stores, or the head metadata for
+        profiles that build no main_content, so those still see a new title,
+        description or og:image.
+        """
+        if 'main_content' in self.profile.sections:
+            return self.main_content()
+        return '\n'.join(filter(None, (clean_text(self.title), self.meta_description, self.thumbnail)))
+
+    def report(self):
+        """The item's extraction field: profile, limits hit and work done"""
+        return {
+            'profile': self.profile.name,
+            'limits_hit': list(self.limits_hit),
+            'nodes': self.nodes,
+            'seconds': round(time.perf_counter() - self.started, 4),
+        }
+
+    def _enter(self, element, parent):
+        tag = element.tag
+        attrib = element.attrib
+        frame = _Frame()
+        frame.tag = tag
+        frame.opened = None
+        if parent is None:
+            main_inherited = article_inherited = 0
+            list_inherited = body_inherited = False
+        else:
+            main_inherited = parent.main_scope
+            article_inherited = parent.article_scope
+            list_inherited = parent.list_scope
+            body_inherited = parent.body_scope
+        # Selectors like "article *::text" only match strict descendants, so an
+        # element's own text sees its ancestors' matches, not its own
+        frame.main_bits = 0 if tag in NON_CONTENT_TAGS else main_inherited
+        frame.body_text = body_inherited and tag not in NON_BODY_TEXT_TAGS
+        frame.article_bits = article_inherited if tag == 'p' else 0
+        frame.main_scope = main_inherited | _main_mask(tag, attrib)
+        frame.article_scope = article_inherited | _article_mask(tag, attrib)
+        frame.list_scope = list_inherited or bool(_list_scope_mask(tag, attrib))
+        frame.body_scope = body_inherited or tag == 'body'
+
+        if tag == 'p':
+            self.paragraph_count += 1
+        elif tag in HEADING_LEVELS:
+            heading = [HEADING_LEVELS[tag], None]
+            self.headings.append(heading)
+            self._awaiting_headings.append(heading)
+            frame.opened = heading
+        elif tag == 'meta':
+            if self.meta_description is None and attrib.get('name') == 'description' and 'content' in attrib:
+                self.meta_description = attrib['content']
+            if self.thumbnail is None and attrib.get('property') == 'og:image' and 'content' in attrib:
+                self.thumbnail = attrib['content']
+        elif tag == 'img' and self._want_images:
+            src = attrib.get('src')
+            if src is not None:
+                if len(self.image_urls) < self.profile.max_images:
+                    self.image_urls.append(src)
+                else:
+                    self.hit('max_images')
+        elif tag == 'ul' and list_inherited and self._want_lists:
+            if len(self.lists) >= self.profile.max_lists:
+                self.hit('max_lists')
+                return self._open_text(element, frame)
+            items = []
+            self.lists.append(items)
+            self._open_lists.append(items)
+            frame.opened = items
+        elif tag == 'li' and self._open_lists:
+            # Counts as an item of every enclosing in-scope <ul>, nested ones included
+            item = _Collector()
+            for items in self._open_lists:
+                items.append(item)
+            self._open_collectors.append(item)
+            frame.opened = item
+        elif tag == 'blockquote' and self._want_quotes:
+            quote = _Collector()
+            self.quotes.append(quote)
+            self._open_collectors.append(quote)
+            frame.opened = quote
+        elif tag == 'table' and self._want_tables:
+            if len(self.tables) >= self.profile.max_tables:
+                self.hit('max_tables')
+                return self._open_text(element, frame)
+            table = _Table()
+            self.tables.append(table)
+            self._open_tables.append(table)
+            frame.opened = table
+        elif tag == 'tr':
+            row = []
+            sampled = False
+            for table in self._open_tables:
+                # Rows 1-3 of each enclosing table are its sample data rows
+                if 1 <= table.row_count <= 3:
+                    table.sample_rows.append(row)
+                    sampled = True
+                table.row_count += 1
+            if sampled:
+                self._open_rows.append(row)
+                frame.opened = row
+
+        return self._open_text(element, frame)
+
+    def _open_text(self, element, frame):
+        if element.text:
+            self._text(frame, element.text)
+        return frame
+
+    def _leave(self, frame):
+        opened = frame.opened
+        if opened is None:
+            return
+        tag = frame.tag
+        if tag in HEADING_LEVELS:
+            if opened in self._awaiting_headings:
+                self._awaiting_headings.remove(opened)
+        elif tag == 'ul':
+            self._open_lists.pop()
+        elif tag in ('li', 'blockquote'):
+            self._open_collectors.pop()
+        elif tag == 'table':
+            self._open_tables.pop()
+        elif tag == 'tr':
+            self._open_rows.pop()
+
+    def _text(self, frame, text):
+        """Route one text node, whose parent element is described by frame"""
+        if self._want_quotes:
+            self.all_text.append(text)
+        if frame.main_bits:
+            self.main_nodes.append((frame.main_bits, text))
+        if frame.body_text:
+            self.body_nodes.append(text)
+        if self._awaiting_headings:
+            for heading in self._awaiting_headings:
+                heading[1] = text
+            self._awaiting_headings = []
+        for collector in self._open_collectors:
+            collector.parts.append(text)
+
+        tag = frame.tag
+        if tag == 'p':
+            self.paragraph_texts.append(text)
+            if frame.article_bits:
+                self.article_nodes.append((frame.article_bits, text))
+        elif tag == 'title':
+            if self.title is None:
+                self.title = text
+        elif tag == 'caption':
+            for table in self._open_tables:
+                if table.caption is None:
+                    table.caption = text
+        elif tag == 'th':
+            for table in self._open_tables:
+                table.headers.append(text)
+        elif tag == 'td':
+            for row in self._open_rows:
+                row.append(text)
+
+    def main_content(self):
+        if self._main_content is not None:
+            return self._main_content
+        main_content = ""
+        for i in range(len(MAIN_SELECTORS)):
+            content = _selected(self.main_nodes, i)
+            if content:
+                main_content = ' '.join([text for text in map(clean_text, content) if text])
+                if len(main_content) > 100:  # Ensure we have substantial content
+                    break
+
+        # Fallback to body content if no main content found
+        if not main_content or len(main_content) < 100:
+            main_content = ' '.join([text for text in map(clean_text, self.body_nodes) if text and len(text) > 3])
+
+        self._main_content = main_content
+        return main_content
+
+    def headings_hierarchy(self):
+        """Headings grouped by level, each level in document order"""
+        headings = []
+        for level, text in sorted(self.headings, key=lambda heading: heading[0]):
+            text = clean_text(text)
+            if text:
+                headings.append({
+                    'level': level,
+                    'text': text
+                })
+        return headings
+
+    def key_paragraphs(self):
+        key_paragraphs = []
+        for text in map(clean_text, self.paragraph_texts):
+            # Filter paragraphs with meaningful content (length > 50 chars, contains letters)
+            if len(text) > 50 and _HAS_LETTER.search(text):
+                key_paragraphs.append(text)
+        return key_paragraphs
+
+    def article_content(self):
+        for i in range(len(ARTICLE_SELECTORS)):
+            paragraphs = _selected(self.article_nodes, i)
+            if paragraphs:
+                cleaned_paragraphs = [text for text in map(clean_text, paragraphs) if len(text) > 30]
+                if len(cleaned_paragraphs) > 2:  # Ensure it's substantial
+                    return cleaned_paragraphs
+        return []
+
+    def important_lists(self):
+        important_lists = []
+        for items in self.lists:
+            texts = [text for text in (item.text() for item in items) if text and len(text) > 10]
+            if texts and len(texts) >= 2:  # Only include substantial lists
+                important_lists.append({
+                    'type': 'unordered',
+                    'items': texts
+                })
+        return important_lists
+
+    def key_quotes(self):
+        quotes = []
+        for quote in self.quotes:
+            quote_text = quote.text()
+            if quote_text and len(quote_text) > 20:
+                quotes.append({
+                    'type': 'blockquote',
+                    'text': quote_text
+                })
+
+        all_text = ' '.join(self.all_text)
+        for pattern in QUOTE_PATTERNS:
+            for match in re.findall(pattern, all_text)[:5]:  # Limit to first 5 matches
+                quotes.append({
+                    'type': 'quoted_text',
+                    'text': clean_text(match)
+                })
+        return quotes
+
+    def table_summaries(self):
+        table_summaries = []
+        for table in self.tables:
+            headers = [text for text in map(clean_text, table.headers) if text]
+            sample_data = [[clean_text(cell) for cell in row] for row in table.sample_rows if row]
+            if headers or sample_data:
+                table_summaries.append({
+                    'caption': clean_text(table.caption),
+                    'headers': headers,
+                    'row_count': table.row_count,
+                    'sample_data': sample_data
+                })
+        return table_summaries
+
+def content_stats(main_content, paragraph_count, heading_count):
+    words = main_content.split() if main_content else []
+    return {
+        'word_count': len(words),
+        'character_count': len(main_content),
+        'paragraph_count': paragraph_count,
+        'heading_count': heading_count,
+        'estimated_reading_time': max(1, len(words) // 200)  # ~200 words per minute
+    }
+
+def prepare_ai_text(title, main_content, headings):
+    """Prepare clean, structured text ready for AI summarization"""
+    ai_text_parts = []
+
+    if title:
+        ai_text_parts.append(f"Title: {title}")
+
+    # Add main headings for structure
+    main_headings = [h['text'] for h in headings if h['level'] <= 3][:5]
+    if main_headings:
+        ai_text_parts.append(f"Main sections: {', '.join(main_headings)}")
+
+    if main_content:
+        # Truncate if too long (most AI models have token limits)
+        if len(main_content) > 4000:
+            main_content = main_content[:4000] + "..."
+        ai_text_parts.append(f"Content: {main_content}")
+
+    return "\n\n".join(ai_text_parts)
+
+def walk_response(response, profile=None):
+    """Walk a response's DOM under an extraction profile, parsing at most max_body_bytes of it"""
+    page = PageWalk(profile)
+    with EXTRACT_SECONDS.time(step='walk'):
+        max_bytes = page.profile.max_body_bytes
+        if len(response.body) > max_bytes:
+            page.hit('max_body_bytes')
+            response = response.replace(body=response.body[:max_bytes])
+        return page.walk(response.selector.root)
+
+def extract_page(response, page=None, profile=None):
+    """Build the summarizer item for a response from a single walk of its DOM.
+
+    Fields the profile leaves out are empty; page, when given, must come
+    from walk_response and carries its own profile.
+    """
+    page = page or walk_response(response, profile)
+    title = clean_text(page.title)
+    main_content = page.build('main_content', page.main_content, '')
+    headings = page.build('headings_hierarchy', page.headings_hierarchy, [])
+
+    return {
+        # Essential metadata
+        'url': response.url,
+        'title': title,
+        'meta_description': page.meta_description,
+        'thumbnail': page.thumbnail,
+        # Main content for summarization
+        'main_content': main_content,
+        'image_urls': page.image_urls,
+        # Structured content
+        'headings_hierarchy': headings,
+        'key_paragraphs': page.build('key_paragraphs', page.key_paragraphs, []),
+        'article_content': page.build('article_content', page.article_content, []),
+
+        # Additional context
+        'important_lists': page.build('important_lists', page.important_lists, []),
+        'key_quotes': page.build('key_quotes', page.key_quotes, []),
+        'table_summaries': page.build('table_summaries', page.table_summaries, []),
+
+        # Content statistics for AI context
+        'content_stats': page.build('content_stats', content_stats, {},
+                                    main_content, page.paragraph_count, len(page.headings)),
+
+        # Content for AI prompt
+        'ai_ready_text': page.build('ai_ready_text', prepare_ai_text, '', title, main_content, headings),
+
+        # Profile and budgets this item was built under
+        'extraction': page.report(),
+    }
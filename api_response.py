@@ -0,0 +1,88 @@
+import datetime
+import decimal
+import gzip
+import json
+import uuid
+from flask import Response
+from config import API_COMPRESS_MIN_BYTES, API_GZIP_LEVEL, API_BROTLI_QUALITY
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+JSON_MIMETYPE = 'application/json'
+
+def _default(value):
+    """Serialize the values psycopg2 returns that JSON has no type for"""
+    if isinstance(value, datetime.datetime):
+        # Timestamps are stored as naive UTC, like Flask's jsonify assumes
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=datetime.timezone.utc)
+        return value.isoformat()
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+if orjson is not None:
+    def dumps(payload):
+        """Compact JSON bytes, with orjson when it is installed"""
+        return orjson.dumps(payload, default=_default, option=orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS)
+else:
+    def dumps(payload):
+        """Compact JSON bytes, with orjson when it is installed"""
+        return json.dumps(payload, default=_default, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+def json_response(payload, status=200):
+    """A JSON response serialized with dumps() instead of jsonify"""
+    return Response(dumps(payload), status=status, mimetype=JSON_MIMETYPE)
+
+def columnar(rows, fields):
+    """Rows as one array per field, which repeats no keys and compresses better"""
+    return {field: [row.get(field) for row in rows] for field in fields}
+
+def negotiate_encoding(accept_encodings):
+    """The best content coding the client accepts: br, then gzip, else None"""
+    if brotli is not None and accept_encodings.quality('br') > 0:
+        return 'br'
+    if accept_encodings.quality('gzip') > 0:
+        return 'gzip'
+    return None
+
+def compress_response(response, accept_encodings, min_bytes=API_COMPRESS_MIN_BYTES):
+    """Compress a buffered JSON response in place with the client's preferred coding.
+
+    Small bodies aren't worth the CPU and headers, and streamed or already
+    encoded responses are left alone. A strong ETag is made weak, since the
+    compressed bytes differ from the identity representation it names.
+    """
+    if (response.mimetype != JSON_MIMETYPE or response.direct_passthrough or response.is_streamed
+            or response.status_code < 200 or response.status_code in (204, 304)
+            or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding(accept_encodings)
+    if encoding is None:
+        return response
+    body = response.get_data()
+    if len(body) < min_bytes:
+        return response
+    if encoding == 'br':
+        body = brotli.compress(body, mode=brotli.MODE_TEXT, quality=API_BROTLI_QUALITY)
+    else:
+        body = gzip.compress(body, compresslevel=API_GZIP_LEVEL, mtime=0)
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
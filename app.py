@@ -1,19 +1,71 @@
-from flask import Flask, render_template, jsonify, request, url_for
-from models import URL, Settings
-from config import get_db_connection
+from flask import Flask, Response, g, render_template, jsonify, redirect, request, send_file, stream_with_context, url_for
+from models import URL, select_fields
+from config import get_db_pool
+from notifications import get_change_notifier
 from clipboard_monitor import clip_monitor
+from ingestion import get_ingestion_pipeline
+from metadata_cache import get_metadata_cache
+from url_index import get_url_index
+from visit_buffer import get_visit_buffer
+from bulk_import import get_bulk_importer
+from settings_cache import get_settings_cache
+from related import get_related_index
+from thumbnails import get_thumbnail_cache
+from metrics import REGISTRY, CONTENT_TYPE as METRICS_CONTENT_TYPE, histogram
+from profiler import get_profiler
+from api_response import json_response, columnar, compress_response
+from export import EXPORT_FORMATS, export_urls, get_scraped_pages
+from link_health import get_link_checker
+from datetime import datetime, timezone
+import hashlib
+import json
+import os
+import queue
 import threading
+import time
 
 app = Flask(__name__, static_url_path='/static', static_folder='static')
-conn = get_db_connection()
+
+# Seconds between keep-alive comments on idle event streams
+SSE_HEARTBEAT_INTERVAL = 15
+# Browser cache lifetime of /thumb/<id> answers, which change when a thumbnail is edited
+THUMB_LOOKUP_MAX_AGE = 300
+# Content-addressed thumbnail files never change, so browsers may keep them for a year
+THUMB_FILE_MAX_AGE = 365 * 24 * 60 * 60
 
 _is_tables_created = False
 
+REQUEST_SECONDS = histogram('edvise_http_request_duration_seconds', 'Time to build each response, by route',
+                            ['method', 'route', 'status'])
+
+REGISTRY.add_collector('edvise_db_pool', lambda: get_db_pool().stats())
+REGISTRY.add_collector('edvise_ingestion', lambda: get_ingestion_pipeline().stats())
+REGISTRY.add_collector('edvise_metadata_cache', lambda: get_metadata_cache().stats())
+REGISTRY.add_collector('edvise_visits', lambda: get_visit_buffer().stats())
+REGISTRY.add_collector('edvise_profiler', lambda: get_profiler().stats())
+REGISTRY.add_collector('edvise_link_health', lambda: get_link_checker().stats())
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.profile = get_profiler().begin()
+
+@app.after_request
+def record_request_time(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        elapsed = time.perf_counter() - started
+        # The URL rule, not the path, so ids and query strings don't multiply series
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        REQUEST_SECONDS.observe(elapsed, method=request.method, route=route, status=response.status_code)
+        get_profiler().end(g.pop('profile', None), f'{request.method} {route}', elapsed)
+    return response
+
 @app.before_request
 def create_tables():
     global _is_tables_created
     if not _is_tables_created:
-        URL.create_table(conn)
+        URL.create_table()
         _is_tables_created = True
 
 @app.route('/')
@@ -27,49 +79,304 @@ def add_cors_headers(response):
     response.headers['Access-Control-Allow-Origin'] = '*'
     response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
     response.headers['Access-Control-Allow-Methods'] = 'GET, PUT, POST, DELETE'
-    # Prevent caching of API responses
-    if request.path.startswith('/api/'):
+    # Prevent caching of API responses; validated responses (ETag) may be
+    # stored but must be revalidated on every use
+    if request.path.startswith('/api/') and response.headers.get('ETag'):
+        response.headers['Cache-Control'] = 'no-cache'
+    elif request.path.startswith('/api/'):
         response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
         response.headers['Pragma'] = 'no-cache'
         response.headers['Expires'] = '0'
     return response
 
+@app.after_request
+def compress_api_response(response):
+    """Compress large JSON API responses for clients that accept gzip or brotli"""
+    if request.path.startswith('/api/'):
+        compress_response(response, request.accept_encodings)
+    return response
+
+def parse_iso_datetime(value):
+    """Parse an ISO-8601 query parameter into a naive UTC datetime"""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
 @app.route('/api/urls', methods=['GET'])
 def get_urls():
     try:
-        app.logger.info("Fetching URLs from database")
-        urls = URL.get_all(conn)
-        app.logger.info(f"Successfully fetched {len(urls)} URLs")
-        # Add proper content type header and ensure serializable response
-        return jsonify(urls), 200, {'Content-Type': 'application/json'}
+        args = request.args
+        query = {
+            'search': args.get('search', '').strip() or None,
+            'sort': args.get('sort', 'date_desc'),
+            'date_from': parse_iso_datetime(args.get('date_from')),
+            'date_to': parse_iso_datetime(args.get('date_to')),
+            'page_size': int(args.get('page_size', 20)),
+            'cursor': args.get('cursor') or None,
+            'group_duplicates': args.get('group_duplicates', '').lower() in ('1', 'true'),
+            'fields': select_fields([field.strip() for field in args.get('fields', '').split(',') if field.strip()]),
+            'link_status': [status.strip() for status in args.get('link_status', '').split(',') if status.strip()],
+        }
+        layout = args.get('format', 'rows')
+        if layout not in ('rows', 'columns'):
+            raise ValueError(f"Unsupported format: {layout}")
+    except ValueError as e:
+        return jsonify({'error': 'Invalid query parameters', 'details': str(e)}), 400
+
+    try:
+        # Any row change bumps the latest version (and a late commit the feed
+        # version), so the versions + query identify the page; the visit buffer
+        # generation covers clicks not yet flushed, and the last link-health
+        # check results kept outside row_version
+        latest, version = URL.current_version()
+        visits = get_visit_buffer()
+        link_health = URL.link_health_version()
+        etag = hashlib.sha1(
+            f"{latest}:{version}:{visits.generation}:{link_health}:{request.query_string.decode()}".encode()
+        ).hexdigest()
+        # Weak comparison, since compression turns the ETag weak
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+
+        app.logger.info("Fetching URL page from database")
+        page = URL.get_page(**query)
+        page['version'] = version
+        visits.apply(page['items'])
+        app.logger.info(f"Successfully fetched {len(page['items'])} of {page['total']} URLs")
+        if layout == 'columns':
+            page['fields'] = query['fields']
+            page['columns'] = columnar(page.pop('items'), query['fields'])
+        response = json_response(page)
+        response.set_etag(etag)
+        return response
+    except ValueError as e:
+        return jsonify({'error': 'Invalid query parameters', 'details': str(e)}), 400
     except Exception as e:
         app.logger.error(f"Error fetching URLs: {str(e)}")
         return jsonify({'error': 'Failed to fetch URLs', 'details': str(e)}), 500
 
+@app.route('/api/urls/<int:id>/duplicates', methods=['GET'])
+def get_url_duplicates(id):
+    try:
+        return jsonify({'id': id, 'duplicates': URL.get_duplicates(id)})
+    except Exception as e:
+        app.logger.error(f"Error fetching duplicates: {str(e)}")
+        return jsonify({'error': 'Failed to fetch duplicates', 'details': str(e)}), 500
+
+@app.route('/api/urls/<int:id>/related', methods=['GET'])
+def get_related_urls(id):
+    try:
+        k = max(1, min(int(request.args.get('k', 10)), 50))
+    except ValueError as e:
+        return jsonify({'error': 'Invalid query parameters', 'details': str(e)}), 400
+
+    try:
+        # Ask for extra matches, since some may have been deleted since the last build
+        matches = get_related_index().related(id, k * 2)
+        if matches is None:
+            return jsonify({'id': id, 'indexed': False, 'related': []})
+        scores = dict(matches)
+        related = URL.get_by_ids([match_id for match_id, _ in matches])[:k]
+        for row in related:
+            row['score'] = round(scores[row['id']], 4)
+        return jsonify({'id': id, 'indexed': True, 'related': related})
+    except Exception as e:
+        app.logger.error(f"Error fetching related URLs: {str(e)}")
+        return jsonify({'error': 'Failed to fetch related URLs', 'details': str(e)}), 500
+
+@app.route('/api/search', methods=['GET'])
+def search_urls():
+    try:
+        args = request.args
+        query = args.get('q', '').strip()
+        if not query:
+            return jsonify({'error': 'Search query is required'}), 400
+        options = {
+            'date_from': parse_iso_datetime(args.get('date_from')),
+            'date_to': parse_iso_datetime(args.get('date_to')),
+            'page_size': int(args.get('page_size', 20)),
+            'cursor': args.get('cursor') or None,
+        }
+    except ValueError as e:
+        return jsonify({'error': 'Invalid query parameters', 'details': str(e)}), 400
+
+    try:
+        _, version = URL.current_version()
+        results = URL.search(query, **options)
+        results['version'] = version
+        get_visit_buffer().apply(results['items'])
+        return json_response(results)
+    except ValueError as e:
+        return jsonify({'error': 'Invalid query parameters', 'details': str(e)}), 400
+    except Exception as e:
+        app.logger.error(f"Error searching URLs: {str(e)}")
+        return jsonify({'error': 'Failed to search URLs', 'details': str(e)}), 500
+
+@app.route('/thumb/<int:id>', methods=['GET'])
+def get_thumbnail(id):
+    """Redirect to the cached, downscaled copy of a URL's thumbnail, fetching it on first use"""
+    try:
+        source = URL.get_thumbnail(id)
+        digest = get_thumbnail_cache().get(source) if source else None
+    except Exception as e:
+        app.logger.error(f"Error fetching thumbnail: {str(e)}")
+        return jsonify({'error': 'Failed to fetch thumbnail', 'details': str(e)}), 500
+    if digest is None:
+        response = jsonify({'error': 'Thumbnail not available'})
+        response.status_code = 404
+    else:
+        response = redirect(url_for('get_thumbnail_file', digest=digest))
+        response.cache_control.public = True
+    response.cache_control.max_age = THUMB_LOOKUP_MAX_AGE
+    return response
+
+@app.route('/thumb/c/<digest>.webp', methods=['GET'])
+def get_thumbnail_file(digest):
+    cache = get_thumbnail_cache()
+    path = cache.path(digest)
+    if path is None or not os.path.exists(path):
+        return jsonify({'error': 'Thumbnail not found'}), 404
+    cache.touch(digest)
+    response = send_file(path, mimetype='image/webp', max_age=THUMB_FILE_MAX_AGE)
+    response.headers['Cache-Control'] = f'public, max-age={THUMB_FILE_MAX_AGE}, immutable'
+    return response
+
+@app.route('/api/urls/changes', methods=['GET'])
+def get_url_changes():
+    try:
+        since = int(request.args.get('since', 0))
+        limit = max(1, min(int(request.args.get('limit', 500)), 1000))
+    except ValueError as e:
+        return jsonify({'error': 'Invalid query parameters', 'details': str(e)}), 400
+
+    try:
+        changes = URL.get_changes(since, limit)
+        get_visit_buffer().apply(changes['changes'])
+        return json_response(changes)
+    except Exception as e:
+        app.logger.error(f"Error fetching URL changes: {str(e)}")
+        return jsonify({'error': 'Failed to fetch URL changes', 'details': str(e)}), 500
+
+@app.route('/api/urls/export', methods=['GET'])
+def export_url_collection():
+    """Stream every saved URL as NDJSON, CSV or a Netscape bookmarks file"""
+    try:
+        args = request.args
+        fmt = args.get('format', 'ndjson')
+        fields = [field.strip() for field in args.get('fields', '').split(',') if field.strip()] or None
+        pages = get_scraped_pages() if args.get('pages', '').lower() in ('1', 'true') else None
+        chunks = export_urls(fmt, fields, pages=pages, visits=get_visit_buffer())
+    except ValueError as e:
+        return jsonify({'error': 'Invalid query parameters', 'details': str(e)}), 400
+    except Exception as e:
+        app.logger.error(f"Error starting URL export: {str(e)}")
+        return jsonify({'error': 'Failed to export URLs', 'details': str(e)}), 500
+
+    mimetype, extension = EXPORT_FORMATS[fmt]
+    filename = f"edvise-urls-{datetime.now(timezone.utc):%Y%m%d-%H%M%S}.{extension}"
+    return Response(chunks, content_type=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+@app.route('/api/events', methods=['GET'])
+def stream_events():
+    """Server-Sent Events stream that announces row changes as they are committed"""
+    notifier = get_change_notifier()
+    events = notifier.subscribe()
+
+    def generate():
+        try:
+            while True:
+                try:
+                    channel, payload = events.get(timeout=SSE_HEARTBEAT_INTERVAL)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: {channel}\ndata: {json.dumps({'payload': payload})}\n\n"
+        finally:
+            notifier.unsubscribe(events)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/api/urls', methods=['DELETE'])
 def delete_url():
     id = request.json.get('id')
     if id:
-        success = URL.delete(conn, id)
+        success = URL.delete(id)
         return jsonify({'success': success})
     return jsonify({'success': False}), 400
 
 @app.route('/api/urls', methods=['PUT'])
 def update_url():
     data = request.json
-    URL.update(conn, data['id'], data['title'], data['thumbnail'])
+    URL.update(data['id'], data['title'], data['thumbnail'])
     return jsonify({'status': 'success'})
 
+# Request content types that imply an import format
+BULK_CONTENT_TYPES = {
+    'text/plain': 'text',
+    'text/csv': 'csv',
+    'text/html': 'netscape',
+}
+
+@app.route('/api/urls/bulk', methods=['POST'])
+def bulk_import_urls():
+    """Start a bulk import from a JSON list, a CSV file or a bookmarks export; returns a job to poll"""
+    fmt = request.args.get('format')
+    enrich = request.args.get('enrich', 'true').lower() != 'false'
+    if 'file' in request.files:
+        text = request.files['file'].read().decode('utf-8', errors='replace')
+    elif request.is_json:
+        data = request.get_json()
+        if isinstance(data, list):
+            data = {'urls': data}
+        enrich = data.get('enrich', enrich)
+        if 'urls' in data:
+            text, fmt = '\n'.join(str(url) for url in data['urls']), 'text'
+        else:
+            text, fmt = data.get('data', ''), data.get('format', fmt)
+    else:
+        text = request.get_data(as_text=True)
+        fmt = fmt or BULK_CONTENT_TYPES.get(request.mimetype)
+
+    if not text.strip():
+        return jsonify({'error': 'Nothing to import'}), 400
+    try:
+        job = get_bulk_importer().submit(text, fmt, enrich=bool(enrich))
+    except ValueError as e:
+        return jsonify({'error': 'Invalid import', 'details': str(e)}), 400
+    except Exception as e:
+        app.logger.error(f"Error starting bulk import: {str(e)}")
+        return jsonify({'error': 'Failed to start import', 'details': str(e)}), 500
+    status_url = url_for('get_bulk_import', job_id=job.id)
+    return jsonify(dict(job.to_dict(), status_url=status_url)), 202, {'Location': status_url}
+
+@app.route('/api/urls/bulk/<job_id>', methods=['GET'])
+def get_bulk_import(job_id):
+    job = get_bulk_importer().get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown import job'}), 404
+    return jsonify(job.to_dict())
+
 @app.route('/api/updateVisit', methods=['POST'])
 def update_visit():
     data = request.json
-    URL.update_visit(conn, data['id'])
-    return jsonify({'status': 'success'})
+    # Counted in memory and written in batches by the visit buffer
+    pending = get_visit_buffer().record(int(data['id']))
+    return jsonify({'status': 'success', 'pending': pending})
 
 @app.route('/api/settings', methods=['GET'])
 def get_settings():
     try:
-        settings = Settings.get_all(conn)
+        settings = get_settings_cache().get_all()
         return jsonify(settings), 200, {'Content-Type': 'application/json'}
     except Exception as e:
         app.logger.error(f"Error fetching settings: {str(e)}")
@@ -79,17 +386,94 @@ def get_settings():
 def update_settings():
     try:
         data = request.json
-        for key, value in data.items():
-            Settings.update(conn, key, str(value))
+        # One transaction for the whole form, so readers never see half a save
+        get_settings_cache().update(data)
         return jsonify({'status': 'success'})
     except Exception as e:
         app.logger.error(f"Error updating settings: {str(e)}")
         return jsonify({'error': 'Failed to update settings', 'details': str(e)}), 500
 
+@app.route('/api/stats/db', methods=['GET'])
+def get_db_stats():
+    return jsonify(get_db_pool().stats())
+
+@app.route('/api/stats/ingestion', methods=['GET'])
+def get_ingestion_stats():
+    return jsonify(get_ingestion_pipeline().stats())
+
+@app.route('/api/stats/cache', methods=['GET'])
+def get_cache_stats():
+    return jsonify(get_metadata_cache().stats())
+
+@app.route('/api/stats/url-index', methods=['GET'])
+def get_url_index_stats():
+    return jsonify(get_url_index().stats())
+
+@app.route('/api/stats/settings', methods=['GET'])
+def get_settings_stats():
+    return jsonify(get_settings_cache().stats())
+
+@app.route('/api/stats/related', methods=['GET'])
+def get_related_stats():
+    return jsonify(get_related_index().stats())
+
+@app.route('/api/stats/thumbnails', methods=['GET'])
+def get_thumbnail_stats():
+    return jsonify(get_thumbnail_cache().stats())
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(REGISTRY.render(), content_type=METRICS_CONTENT_TYPE)
+
+@app.route('/api/profiler', methods=['GET'])
+def get_profiler_status():
+    profiler = get_profiler()
+    return jsonify({**profiler.stats(), 'directory': profiler.directory, 'dumps': profiler.dumps()[:20]})
+
+@app.route('/api/profiler', methods=['PUT'])
+def update_profiler():
+    """Turn slow-request profiling on with {"threshold": seconds}, or off with a threshold of 0"""
+    data = request.get_json(silent=True) or {}
+    try:
+        threshold = data.get('threshold')
+        interval = data.get('interval')
+        if threshold is not None and float(threshold) < 0:
+            raise ValueError("threshold must be zero or positive")
+        if interval is not None and float(interval) <= 0:
+            raise ValueError("interval must be positive")
+        get_profiler().configure(threshold=threshold, interval=interval)
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': 'Invalid profiler settings', 'details': str(e)}), 400
+    return get_profiler_status()
+
+@app.route('/api/stats/visits', methods=['GET'])
+def get_visit_stats():
+    return jsonify(get_visit_buffer().stats())
+
+@app.route('/api/stats/link-health', methods=['GET'])
+def get_link_health_stats():
+    try:
+        return jsonify({**get_link_checker().stats(), 'links': URL.link_health_summary()})
+    except Exception as e:
+        app.logger.error(f"Error fetching link health: {str(e)}")
+        return jsonify({'error': 'Failed to fetch link health', 'details': str(e)}), 500
+
+@app.route('/api/link-health/sweep', methods=['POST'])
+def start_link_health_sweep():
+    """Check stale links now instead of waiting for the next scheduled sweep"""
+    if not get_link_checker().sweep_in_background():
+        return jsonify({'status': 'running'}), 409
+    return jsonify({'status': 'started'}), 202
+
 def run_clip_monitor():
     clip_monitor()
 
 if __name__ == '__main__':
     monitor_thread = threading.Thread(target=run_clip_monitor, daemon=True)
     monitor_thread.start()
-    app.run(debug=True)
+    debug = True
+    # The debug reloader runs this block in a watching parent as well as the
+    # serving child; one sweeper only, or hosts would get twice the requests
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        get_link_checker().start()
+    app.run(debug=debug)
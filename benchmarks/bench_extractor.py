@@ -0,0 +1,76 @@
+"""Compare the single-pass page extractor with the old multi-pass spider methods.
+
+Runs offline over the HTML fixtures in benchmarks/fixtures, checks that both
+produce identical items and prints per-page timings:
+
+    python benchmarks/bench_extractor.py [--repeat N]
+"""
+import argparse
+import os
+import sys
+import time
+from scrapy.http import HtmlResponse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Webspiders.page_extraction import extract_page
+from legacy_extractor import LegacyPageSummarizerSpider
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+def load_fixtures():
+    fixtures = {}
+    for name in sorted(os.listdir(FIXTURES_DIR)):
+        if name.endswith('.html'):
+            with open(os.path.join(FIXTURES_DIR, name), 'rb') as f:
+                fixtures[name] = f.read()
+    return fixtures
+
+def make_response(name, body):
+    # A fresh response each run, so HTML parsing is timed for both extractors
+    return HtmlResponse(url=f'https://fixtures.test/{name}', body=body)
+
+def legacy_item(spider, name, body):
+    return next(spider.parse(make_response(name, body)))
+
+def single_pass_item(name, body):
+    item = extract_page(make_response(name, body), profile='full')
+    # Budget bookkeeping the legacy spider had no equivalent of
+    del item['extraction']
+    return item
+
+def best_of(func, repeat, *args):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    spider = LegacyPageSummarizerSpider()
+    print(f"{'fixture':<22}{'size':>9}{'legacy ms':>11}{'single ms':>11}{'speedup':>9}  same")
+    total_legacy = total_single = 0.0
+    mismatches = 0
+    for name, body in load_fixtures().items():
+        legacy_time, legacy = best_of(legacy_item, args.repeat, spider, name, body)
+        single_time, single = best_of(single_pass_item, args.repeat, name, body)
+        total_legacy += legacy_time
+        total_single += single_time
+        same = legacy == single
+        if not same:
+            mismatches += 1
+            fields = [key for key in legacy if legacy[key] != single.get(key)]
+            print(f"  {name}: fields differ: {', '.join(fields)}")
+        print(f"{name:<22}{len(body):>9}{legacy_time * 1000:>11.2f}{single_time * 1000:>11.2f}"
+              f"{legacy_time / single_time:>8.1f}x  {'yes' if same else 'NO'}")
+    print(f"{'total':<22}{'':>9}{total_legacy * 1000:>11.2f}{total_single * 1000:>11.2f}"
+          f"{total_legacy / total_single:>8.1f}x")
+    return 1 if mismatches else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,71 @@
+"""Compare the streaming <head> extractor with the old full-body BeautifulSoup path.
+
+Runs offline over the HTML fixtures in benchmarks/fixtures:
+
+    python benchmarks/bench_metadata.py [--repeat N]
+"""
+import argparse
+import os
+import sys
+import time
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from head_metadata import extract_head_metadata, sniff_charset
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+CHUNK_SIZE = 16384
+MAX_BYTES = 512 * 1024
+
+def load_fixtures():
+    fixtures = {}
+    for name in sorted(os.listdir(FIXTURES_DIR)):
+        if name.endswith('.html'):
+            with open(os.path.join(FIXTURES_DIR, name), 'rb') as f:
+                fixtures[name] = f.read()
+    return fixtures
+
+def chunked(body):
+    for i in range(0, len(body), CHUNK_SIZE):
+        yield body[i:i + CHUNK_SIZE]
+
+def beautifulsoup_metadata(body):
+    """The pre-streaming get_url_metadata parse: whole body, full tree"""
+    soup = BeautifulSoup(body.decode(sniff_charset(body) or 'utf-8', errors='replace'), 'html.parser')
+    title = soup.title.string if soup.title else None
+    thumbnail = soup.find('meta', property='og:image')
+    return title, thumbnail['content'] if thumbnail else None, len(body)
+
+def streaming_metadata(body):
+    metadata = extract_head_metadata(chunked(body), MAX_BYTES)
+    return metadata['title'], metadata['og_image'], metadata['bytes_read']
+
+def best_of(func, body, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(body)
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'fixture':<22}{'size':>9}{'bs4 ms':>10}{'stream ms':>11}{'read':>9}{'speedup':>9}  same")
+    total_bs4 = total_stream = 0.0
+    for name, body in load_fixtures().items():
+        bs4_time, (bs4_title, bs4_image, _) = best_of(beautifulsoup_metadata, body, args.repeat)
+        stream_time, (title, image, bytes_read) = best_of(streaming_metadata, body, args.repeat)
+        total_bs4 += bs4_time
+        total_stream += stream_time
+        same = (' '.join((bs4_title or '').split()) or None, bs4_image) == (title, image)
+        print(f"{name:<22}{len(body):>9}{bs4_time * 1000:>10.2f}{stream_time * 1000:>11.2f}"
+              f"{bytes_read:>9}{bs4_time / stream_time:>8.1f}x  {'yes' if same else 'NO'}")
+    print(f"{'total':<22}{'':>9}{total_bs4 * 1000:>10.2f}{total_stream * 1000:>11.2f}"
+          f"{'':>9}{total_bs4 / total_stream:>8.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""Measure related-links index build time and top-k query latency.
+
+Builds the TF-IDF index over synthetic pages (topic words plus a Zipf-distributed
+shared vocabulary, about the length of a capped ai_ready_text) and times queries
+against the memory-mapped build and the in-memory delta:
+
+    python benchmarks/bench_related.py [--sizes 10000 100000] [--queries 500]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from related import RelatedIndex, build_index, term_counts, tfidf, _Build, _Delta
+
+VOCABULARY = 50000
+TOPICS = 200
+WORDS_PER_PAGE = 600
+
+def synthetic_pages(count, seed=0):
+    rng = np.random.RandomState(seed)
+    words = np.array([f'w{i}' for i in range(VOCABULARY)])
+    topic_words = rng.randint(0, VOCABULARY, size=(TOPICS, 60))
+    now = datetime.now()
+    for id in range(1, count + 1):
+        topic = topic_words[rng.randint(TOPICS)]
+        shared = np.minimum(rng.zipf(1.2, size=WORDS_PER_PAGE * 2 // 3), VOCABULARY) - 1
+        chosen = np.concatenate([rng.choice(topic, size=WORDS_PER_PAGE // 3), shared])
+        yield id, f'page {id}', ' '.join(words[chosen]), now
+
+def percentile_ms(samples, q):
+    return float(np.percentile(samples, q)) * 1000
+
+def bench(size, queries, delta_size):
+    directory = tempfile.mkdtemp(prefix='bench-related-')
+    try:
+        pages = list(synthetic_pages(size))
+        started = time.perf_counter()
+        meta = build_index(pages, directory)
+        del pages
+        build_seconds = time.perf_counter() - started
+        disk = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+        index = RelatedIndex(directory=directory)
+        index._build = build = _Build(directory)
+        # Newly crawled pages waiting for the next rebuild
+        vectors = {}
+        for id, title, text, updated_at in synthetic_pages(delta_size, seed=1):
+            terms, weights = tfidf(*term_counts(title, text), build.idf)
+            vectors[size + id] = (terms, weights, updated_at.timestamp())
+        index._delta = _Delta(vectors, build)
+        index._last_refresh = float('inf')  # no Postgres here
+
+        rng = np.random.RandomState(2)
+        latencies = []
+        for id in rng.randint(1, size + 1, size=queries):
+            started = time.perf_counter()
+            index.related(int(id), 10)
+            latencies.append(time.perf_counter() - started)
+
+        print(f"{size:>8}{build_seconds:>10.1f}{meta['vectorize_seconds']:>11.1f}"
+              f"{disk / 2 ** 20:>9.0f}{percentile_ms(latencies, 50):>9.2f}"
+              f"{percentile_ms(latencies, 95):>9.2f}{percentile_ms(latencies, 99):>9.2f}")
+    finally:
+        shutil.rmtree(directory)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--delta', type=int, default=1000, help='pages in the in-memory delta')
+    args = parser.parse_args()
+
+    print(f"{'pages':>8}{'build s':>10}{'tokenize s':>11}{'disk MB':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for size in args.sizes:
+        bench(size, args.queries, args.delta)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,304 @@
+"""Offline benchmark suite for extraction, metadata fetching, the URL model and /api/urls.
+
+Everything runs locally:
+- extract   PageSummarizerSpider.parse over the HTML fixtures, as Scrapy HtmlResponses
+- metadata  get_url_metadata against a local HTTP stand-in serving the same fixtures
+- db        URL.get_all, URL.add and URL.update_visit on a dedicated Postgres database
+            seeded with each --sizes row count
+- api       GET /api/urls through Flask's test client on the same seeded database
+
+The db and api groups use the DB_USER/DB_PASSWORD/DB_HOST connection settings but
+always drop and recreate --db-name (default edvise_bench), never DB_NAME itself.
+
+Each benchmark reports throughput and p50/p95/p99 latency. --save writes the
+results as a JSON baseline; --baseline compares against one and exits 1 if a
+benchmark's throughput, p50 or p95 is more than --threshold worse:
+
+    python benchmarks/bench_suite.py --save benchmarks/baseline.json
+    python benchmarks/bench_suite.py --baseline benchmarks/baseline.json [--only extract metadata]
+"""
+import argparse
+import functools
+import http.server
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+GROUPS = ('extract', 'metadata', 'db', 'api')
+# Regressions are flagged on these; p99 is reported but too noisy to gate on
+GATED_METRICS = ('ops_per_sec', 'p50_ms', 'p95_ms')
+
+# The dashboard tables are managed outside models.URL.create_table, so the
+# benchmark database creates them itself, with the columns the app relies on
+DASHBOARD_SCHEMA = """
+    CREATE TABLE tbl_urlmanagement (
+        id SERIAL PRIMARY KEY,
+        url VARCHAR(500) NOT NULL,
+        title VARCHAR(200),
+        thumbnail VARCHAR(500),
+        enable INT DEFAULT 1,
+        created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE tbl_maintainvisit (
+        id SERIAL PRIMARY KEY,
+        url_id INT REFERENCES tbl_urlmanagement(id),
+        visit INT DEFAULT 0
+    );
+    CREATE TABLE settings (key TEXT PRIMARY KEY, value TEXT, updated_at TIMESTAMP DEFAULT NOW());
+"""
+
+SEED_SQL = """
+    TRUNCATE url, tbl_maintainvisit, tbl_urlmanagement, tbl_urlcontent RESTART IDENTITY;
+    INSERT INTO tbl_urlmanagement (url, title, thumbnail, created_date)
+    SELECT 'https://site' || (g %% 500) || '.example/articles/' || g,
+           'Article ' || g || ' about ' || (ARRAY['python', 'postgres', 'crawling', 'search', 'caching'])[g %% 5 + 1],
+           CASE WHEN g %% 3 = 0 THEN 'https://img.example/' || g || '.jpg' END,
+           TIMESTAMP '2024-01-01' + (g || ' minutes')::interval
+    FROM generate_series(1, %(rows)s) g;
+    INSERT INTO tbl_maintainvisit (url_id, visit) SELECT id, id %% 97 FROM tbl_urlmanagement;
+    INSERT INTO url (url, title, canonical_url, url_hash)
+    SELECT url, title, url, id FROM tbl_urlmanagement;
+    ANALYZE;
+"""
+
+def load_fixtures():
+    fixtures = {}
+    for name in sorted(os.listdir(FIXTURES_DIR)):
+        if name.endswith('.html'):
+            with open(os.path.join(FIXTURES_DIR, name), 'rb') as f:
+                fixtures[name] = f.read()
+    return fixtures
+
+def percentile(sorted_values, pct):
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def measure(func, iterations, warmup=3):
+    """Call func(i) iterations times; throughput and latency percentiles in ms"""
+    for i in range(warmup):
+        func(i)
+    latencies = []
+    started = time.perf_counter()
+    for i in range(iterations):
+        call_started = time.perf_counter()
+        func(i)
+        latencies.append(time.perf_counter() - call_started)
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'iterations': iterations,
+        'ops_per_sec': iterations / elapsed,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+    }
+
+def bench_extract(args):
+    from scrapy.http import HtmlResponse
+    from Webspiders.extractor import PageSummarizerSpider
+
+    spider = PageSummarizerSpider()
+    fixtures = list(load_fixtures().items())
+
+    def parse(i):
+        name, body = fixtures[i % len(fixtures)]
+        # A fresh response each call, so HTML parsing is part of the timing
+        list(spider.parse(HtmlResponse(url=f'https://fixtures.test/{name}', body=body)))
+
+    yield 'extract.parse', measure(parse, len(fixtures) * args.repeat * 4, warmup=len(fixtures))
+
+class _FixtureHandler(http.server.SimpleHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+class _FixtureServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # The metadata fetcher hangs up once it has read </head>
+        pass
+
+def bench_metadata(args):
+    import ingestion
+    from clipboard_monitor import get_url_metadata
+
+    handler = functools.partial(_FixtureHandler, directory=FIXTURES_DIR)
+    server = _FixtureServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    # Bypass the shared metadata cache, or every call after the first is a cache hit
+    ingestion._fetcher = ingestion.MetadataFetcher(use_cache=False)
+    try:
+        urls = [f'http://127.0.0.1:{server.server_port}/{name}' for name in load_fixtures()]
+        yield 'metadata.get_url_metadata', measure(lambda i: get_url_metadata(urls[i % len(urls)]),
+                                                   len(urls) * args.repeat * 4, warmup=len(urls))
+    finally:
+        server.shutdown()
+
+def prepare_database(db_name):
+    """Recreate the benchmark database and point config at it; must run before models is imported"""
+    import psycopg2
+
+    connect = dict(user=os.getenv('DB_USER'), password=os.getenv('DB_PASSWORD'), host=os.getenv('DB_HOST'))
+    admin = psycopg2.connect(dbname='postgres', **connect)
+    admin.autocommit = True
+    with admin.cursor() as cur:
+        cur.execute(f'DROP DATABASE IF EXISTS "{db_name}"')
+        cur.execute(f'CREATE DATABASE "{db_name}"')
+    admin.close()
+    conn = psycopg2.connect(dbname=db_name, **connect)
+    with conn, conn.cursor() as cur:
+        cur.execute(DASHBOARD_SCHEMA)
+    conn.close()
+    os.environ['DB_NAME'] = db_name
+
+def seed(rows):
+    from config import db_connection
+
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(SEED_SQL, {'rows': rows})
+        conn.commit()
+
+def bench_db(args, rows):
+    from models import URL
+
+    rng = random.Random(rows)
+    added = itertools.count()
+    yield f'db.get_all[{rows}]', measure(lambda i: URL.get_all(), max(5, args.repeat * 20000 // rows))
+    yield f'db.add[{rows}]', measure(
+        lambda i: URL.add(f'https://bench.example/added/{rows}/{next(added)}', f'Added {i}', None),
+        args.repeat * 100
+    )
+    yield f'db.update_visit[{rows}]', measure(lambda i: URL.update_visit(rng.randint(1, rows)), args.repeat * 100)
+
+def bench_api(args, rows):
+    from app import app
+
+    client = app.test_client()
+    queries = {
+        'first_page': '/api/urls',
+        'title_sort': '/api/urls?sort=title&page_size=50',
+        'search': '/api/urls?search=postgres',
+        # What the dashboard requests: projected, columnar and compressed
+        'list_columns': '/api/urls?fields=id,url,title,thumbnail,created_date,visit&format=columns',
+    }
+    for label, path in queries.items():
+        def get(i, path=path):
+            response = client.get(path, headers={'Accept-Encoding': 'gzip, br'})
+            if response.status_code != 200:
+                raise RuntimeError(f"{path} returned {response.status_code}: {response.get_data(as_text=True)[:200]}")
+        yield f'api.{label}[{rows}]', measure(get, args.repeat * 40)
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'commit': commit,
+    }
+
+def compare(results, baseline, threshold):
+    """Names of benchmarks whose gated metrics are worse than the baseline by more than threshold"""
+    regressions = {}
+    for name, metrics in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        worse = []
+        for metric in GATED_METRICS:
+            if not base[metric] or not metrics[metric]:
+                continue
+            if metric == 'ops_per_sec':
+                slowdown = base[metric] / metrics[metric] - 1
+            else:
+                slowdown = metrics[metric] / base[metric] - 1
+            if slowdown > threshold:
+                worse.append(f"{metric} {base[metric]:.2f} -> {metrics[metric]:.2f}")
+        if worse:
+            regressions[name] = worse
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--only', nargs='+', choices=GROUPS, default=list(GROUPS))
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='seeded row counts for the db and api groups')
+    parser.add_argument('--repeat', type=int, default=5, help='scales the iterations of every benchmark')
+    parser.add_argument('--db-name', default='edvise_bench')
+    parser.add_argument('--save', metavar='FILE', help='write the results to FILE as a baseline')
+    parser.add_argument('--baseline', metavar='FILE', help='compare against a saved baseline')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='fractional slowdown that counts as a regression (default 0.2)')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+
+    results = {}
+    print(f"{'benchmark':<34}{'ops/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'vs p50':>9}")
+
+    def report(run):
+        for name, metrics in run:
+            results[name] = metrics
+            vs = ''
+            if baseline and name in baseline and baseline[name]['p50_ms']:
+                vs = f"{metrics['p50_ms'] / baseline[name]['p50_ms'] - 1:+.0%}"
+            print(f"{name:<34}{metrics['ops_per_sec']:>10.1f}{metrics['p50_ms']:>10.2f}"
+                  f"{metrics['p95_ms']:>10.2f}{metrics['p99_ms']:>10.2f}{vs:>9}", flush=True)
+
+    if 'extract' in args.only:
+        report(bench_extract(args))
+    if 'metadata' in args.only:
+        report(bench_metadata(args))
+    if 'db' in args.only or 'api' in args.only:
+        prepare_database(args.db_name)
+        from models import URL
+        URL.create_table()
+        for rows in args.sizes:
+            seed(rows)
+            if 'db' in args.only:
+                report(bench_db(args, rows))
+            if 'api' in args.only:
+                report(bench_api(args, rows))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({
+                'created': datetime.now(timezone.utc).isoformat(),
+                'environment': environment(),
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"Saved baseline to {args.save}")
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        for name, worse in regressions.items():
+            print(f"REGRESSION {name}: {', '.join(worse)}")
+        if regressions:
+            return 1
+        print(f"No regressions beyond {args.threshold:.0%}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
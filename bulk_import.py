@@ -0,0 +1,325 @@
+import argparse
+import csv
+import io
+import logging
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from html.parser import HTMLParser
+from canonical import InvalidURL, canonical_key
+from clipboard_monitor import is_valid_url
+from ingestion import MetadataFetcher
+from models import URL, MAX_URL_LENGTH, fit_metadata
+from url_index import get_url_index
+from thumbnails import get_thumbnail_cache
+from config import BULK_IMPORT_MAX_URLS, BULK_ENRICH_WORKERS, INGEST_BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+IMPORT_FORMATS = ('text', 'csv', 'netscape')
+# Finished jobs kept for the status endpoint
+MAX_FINISHED_JOBS = 100
+
+class _BookmarkParser(HTMLParser):
+    """Collect (href, title) pairs from a Netscape bookmarks export"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.links = []
+        self._href = None
+        self._text = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'a':
+            self._href = dict(attrs).get('href')
+            self._text = []
+
+    def handle_data(self, data):
+        if self._href is not None:
+            self._text.append(data)
+
+    def handle_endtag(self, tag):
+        if tag == 'a' and self._href is not None:
+            title = ' '.join(''.join(self._text).split())
+            self.links.append((self._href.strip(), title or None))
+            self._href = None
+
+def detect_format(text):
+    """Guess the import format from the document's first bytes"""
+    head = text.lstrip()[:1024].lower()
+    if head.startswith('<!doctype netscape-bookmark') or '<a ' in head or '<dl' in head:
+        return 'netscape'
+    first_line = head.split('\n', 1)[0]
+    if ',' in first_line or '\t' in first_line:
+        return 'csv'
+    return 'text'
+
+def parse_import(text, fmt=None):
+    """Parse an import document into (url, title) pairs; title is None when the source has none"""
+    fmt = fmt or detect_format(text)
+    if fmt not in IMPORT_FORMATS:
+        raise ValueError(f"Unsupported import format: {fmt}")
+
+    if fmt == 'netscape':
+        parser = _BookmarkParser()
+        parser.feed(text)
+        parser.close()
+        return parser.links
+
+    if fmt == 'csv':
+        dialect = csv.excel_tab if '\t' in text.split('\n', 1)[0] else csv.excel
+        rows = [row for row in csv.reader(io.StringIO(text), dialect) if row]
+        if not rows:
+            return []
+        header = [cell.strip().lower() for cell in rows[0]]
+        if 'url' in header:
+            url_col = header.index('url')
+            title_col = next((header.index(name) for name in ('title', 'name') if name in header), None)
+            rows = rows[1:]
+        else:
+            url_col, title_col = 0, 1 if len(header) > 1 else None
+        return [
+            (row[url_col].strip(), (row[title_col].strip() or None) if title_col is not None and title_col < len(row) else None)
+            for row in rows if url_col < len(row)
+        ]
+
+    return [(line.strip(), None) for line in text.splitlines() if line.strip() and not line.lstrip().startswith('#')]
+
+class ImportJob:
+    """Progress of one bulk import, as reported by the job status endpoint"""
+
+    def __init__(self, enrich=True):
+        self.id = uuid.uuid4().hex
+        self.enrich = enrich
+        self.status = 'queued'
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.counts = {
+            'parsed': 0,
+            'invalid': 0,
+            'duplicates': 0,
+            'inserted': 0,
+            'failed': 0,
+            'enriched': 0,
+            'enrich_failed': 0,
+        }
+        self.lock = threading.Lock()
+
+    def update(self, status=None, **counts):
+        with self.lock:
+            if status:
+                self.status = status
+            for name, value in counts.items():
+                self.counts[name] += value
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                'id': self.id,
+                'status': self.status,
+                'error': self.error,
+                'enrich': self.enrich,
+                'created_at': self.created_at,
+                'finished_at': self.finished_at,
+                'counts': dict(self.counts),
+                'pending_enrichment': (
+                    self.counts['inserted'] - self.counts['enriched'] - self.counts['enrich_failed']
+                    if self.enrich else 0
+                ),
+            }
+
+class BulkImporter:
+    """Import many URLs at once: batched deduplicating inserts, then parallel metadata enrichment.
+
+    Rows go in immediately with the bookmark title (or the URL) so they are
+    usable right away; titles and thumbnails are then fetched on a worker
+    pool and written back in batched UPDATEs. A batch the database rejects
+    is retried row by row, so one bad entry costs only itself.
+    """
+
+    def __init__(self, workers=BULK_ENRICH_WORKERS, batch_size=INGEST_BATCH_SIZE,
+                 max_urls=BULK_IMPORT_MAX_URLS, fetcher=None, index=None, thumbnails=None):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_urls = max_urls
+        self.fetcher = fetcher or MetadataFetcher(pool_size=workers)
+        self.index = index
+        self.thumbnails = thumbnails
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bulk-enrich')
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, text, fmt=None, enrich=True):
+        """Parse synchronously (so bad input fails fast), then run the import in the background"""
+        entries = parse_import(text, fmt)
+        if len(entries) > self.max_urls:
+            raise ValueError(f"Import has {len(entries)} URLs; the limit is {self.max_urls}")
+        job = ImportJob(enrich=enrich)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        threading.Thread(target=self.run, args=(job, entries), name=f'bulk-import-{job.id[:8]}', daemon=True).start()
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def run(self, job, entries):
+        """Insert and enrich parsed entries, recording progress on job"""
+        try:
+            rows = self._dedup(job, entries)
+            job.update('inserting')
+            inserted = set()
+            for start in range(0, len(rows), self.batch_size):
+                inserted.update(self._insert(job, rows[start:start + self.batch_size]))
+            if self.index is not None:
+                for url in inserted:
+                    self.index.add(url)
+            job.update(inserted=len(inserted), duplicates=len(rows) - len(inserted) - job.counts['failed'])
+            logger.info(f"Bulk import {job.id}: inserted {len(inserted)} of {job.counts['parsed']} URLs")
+            if job.enrich and inserted:
+                job.update('enriching')
+                self._enrich(job, [row for row in rows if row[0] in inserted])
+            job.update('done')
+        except Exception as e:
+            logger.error(f"Bulk import {job.id} failed: {e}")
+            with job.lock:
+                job.status = 'failed'
+                job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+
+    def _dedup(self, job, entries):
+        """Drop invalid URLs, repeats within the import and URLs already known to the index"""
+        rows = []
+        seen = set()
+        invalid = duplicates = 0
+        for url, title in entries:
+            if not url or len(url) > MAX_URL_LENGTH or not is_valid_url(url):
+                invalid += 1
+                continue
+            try:
+                _, hashed = canonical_key(url)
+            except InvalidURL:
+                invalid += 1
+                continue
+            if hashed in seen or (self.index is not None and self.index.contains(url)):
+                duplicates += 1
+                continue
+            seen.add(hashed)
+            rows.append((url, fit_metadata(title or url, None)[0], None))
+        job.update(parsed=len(entries), invalid=invalid, duplicates=duplicates)
+        return rows
+
+    def _enrich(self, job, rows):
+        """Fetch metadata on the worker pool and write it back in batches"""
+        imported_titles = {url: title for url, title, _ in rows}
+        # Rows were stored with the URL clipped to fit when the entry had no title
+        untitled = {url for url, title, _ in rows if title == fit_metadata(url, None)[0]}
+        futures = {self._executor.submit(self.fetcher.fetch_metadata, url): url for url, _, _ in rows}
+        batch = []
+        for future in as_completed(futures):
+            url = futures[future]
+            try:
+                metadata = future.result()
+            except Exception as e:
+                logger.warning(f"Enrichment failed for {url}: {e}")
+                metadata = None
+            if metadata is None:
+                job.update(enrich_failed=1)
+                continue
+            # A title from the bookmark file wins over the page's own
+            title = imported_titles[url]
+            if url in untitled:
+                title = metadata['title'] or metadata['og_title'] or title
+            batch.append((url, *fit_metadata(title, metadata['og_image'])))
+            if len(batch) >= self.batch_size:
+                self._write(job, batch)
+                batch = []
+        self._write(job, batch)
+
+    def _insert(self, job, rows):
+        """Insert a batch, falling back to one row at a time if the database rejects it; the URLs inserted"""
+        try:
+            return URL.add_many(rows, returning=True)
+        except Exception as e:
+            logger.warning(f"Insert batch for import {job.id} failed, retrying row by row: {e}")
+        inserted = []
+        for row in rows:
+            try:
+                inserted.extend(URL.add_many([row], returning=True))
+            except Exception as e:
+                logger.error(f"Could not import {row[0]}: {e}")
+                job.update(failed=1)
+        return inserted
+
+    def _write(self, job, batch):
+        if not batch:
+            return
+        try:
+            URL.update_metadata_many(batch)
+        except Exception as e:
+            logger.warning(f"Enrichment batch for import {job.id} failed, retrying row by row: {e}")
+            written = []
+            for row in batch:
+                try:
+                    URL.update_metadata_many([row])
+                    written.append(row)
+                except Exception as e:
+                    logger.error(f"Could not write enrichment for {row[0]}: {e}")
+                    job.update(enrich_failed=1)
+            batch = written
+        job.update(enriched=len(batch))
+        if self.thumbnails is not None:
+            self.thumbnails.prefetch(thumbnail for _, _, thumbnail in batch)
+
+    def _prune(self):
+        finished = sorted(
+            (job for job in self._jobs.values() if job.finished_at is not None),
+            key=lambda job: job.finished_at
+        )
+        for job in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job.id]
+
+_importer = None
+_importer_lock = threading.Lock()
+
+def get_bulk_importer():
+    """Return the process-wide bulk importer"""
+    global _importer
+    if _importer is None:
+        with _importer_lock:
+            if _importer is None:
+                _importer = BulkImporter(index=get_url_index(), thumbnails=get_thumbnail_cache())
+    return _importer
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Import URLs from a text list, CSV file or bookmarks export')
+    parser.add_argument('file', help='file to import, or - for stdin')
+    parser.add_argument('--format', choices=IMPORT_FORMATS, help='input format (detected when omitted)')
+    parser.add_argument('--no-enrich', action='store_true', help='skip fetching titles and thumbnails')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    if args.file == '-':
+        text = sys.stdin.read()
+    else:
+        with open(args.file, encoding='utf-8', errors='replace') as f:
+            text = f.read()
+
+    importer = BulkImporter(index=get_url_index())
+    job = ImportJob(enrich=not args.no_enrich)
+    progress = threading.Thread(target=importer.run, args=(job, parse_import(text, args.format)), daemon=True)
+    progress.start()
+    while progress.is_alive():
+        progress.join(timeout=2)
+        state = job.to_dict()
+        print(f"{state['status']}: {state['counts']}")
+    return 0 if job.status == 'done' else 1
+
+if __name__ == '__main__':
+    raise SystemExit(main())
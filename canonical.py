@@ -0,0 +1,82 @@
+import hashlib
+import posixpath
+import re
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode, quote
+
+# Query parameters that only track where a click came from
+TRACKING_PARAMS = {
+    'ref', 'ref_src', 'ref_url', 'referrer',
+    'fbclid', 'gclid', 'dclid', 'gclsrc', 'msclkid', 'yclid', 'igshid', 'twclid', 'li_fat_id',
+    'mc_cid', 'mc_eid', '_hsenc', '_hsmi', 'mkt_tok', 'oly_anon_id', 'oly_enc_id',
+    'vero_id', 'wickedid', 'spm', 'si', 's_cid',
+}
+TRACKING_PREFIXES = ('utm_', 'pk_', 'hsa_', 'itm_')
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+# Characters that never need percent-encoding in a path
+_PATH_SAFE = "/:@!$&'()*+,;=-._~%"
+_UNRESERVED = set('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-._~')
+_PERCENT_ESCAPE = re.compile(r'%([0-9A-Fa-f]{2})')
+_MULTIPLE_SLASHES = re.compile(r'/{2,}')
+
+class InvalidURL(ValueError):
+    """A URL that has no canonical form, such as one whose port is out of range"""
+
+def _normalize_escape(match):
+    char = chr(int(match.group(1), 16))
+    return char if char in _UNRESERVED else '%' + match.group(1).upper()
+
+def is_tracking_param(name):
+    name = name.lower()
+    return name in TRACKING_PARAMS or name.startswith(TRACKING_PREFIXES)
+
+def canonicalize_url(url):
+    """Reduce a URL to the form used for deduplication.
+
+    Lowercases scheme and host, drops default ports, fragments and tracking
+    parameters, normalizes path encoding, dot segments and trailing slashes,
+    and sorts the remaining query parameters. Raises InvalidURL for URLs
+    that don't parse, which callers skip rather than store.
+    """
+    try:
+        parts = urlsplit(url.strip())
+        port = parts.port
+    except ValueError as e:
+        raise InvalidURL(f"Invalid URL {url!r}: {e}") from None
+    scheme = parts.scheme.lower()
+
+    host = (parts.hostname or '').rstrip('.')
+    try:
+        host = host.encode('idna').decode('ascii').lower()
+    except UnicodeError:
+        host = host.lower()
+    if port and port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{port}"
+
+    # Decode needlessly escaped characters, uppercase the rest, escape raw unsafe ones
+    path = quote(_PERCENT_ESCAPE.sub(_normalize_escape, parts.path), safe=_PATH_SAFE)
+    path = _MULTIPLE_SLASHES.sub('/', path)
+    if path:
+        normalized = posixpath.normpath(path)
+        path = '/' if normalized in ('.', '/') else normalized
+    else:
+        path = '/'
+
+    query = [
+        (name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not is_tracking_param(name)
+    ]
+    query.sort()
+
+    return urlunsplit((scheme, host, path, urlencode(query), ''))
+
+def url_hash(canonical_url):
+    """Signed 64-bit hash of a canonical URL, sized for a BIGINT column and a compact in-memory set"""
+    digest = hashlib.sha1(canonical_url.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big', signed=True)
+
+def canonical_key(url):
+    """Return (canonical_url, url_hash) for a raw URL; InvalidURL if it has no canonical form"""
+    canonical = canonicalize_url(url)
+    return canonical, url_hash(canonical)
@@ -1,48 +1,216 @@
-import pyperclip
-import time
-import requests
-from bs4 import BeautifulSoup
-from models import URL
-from config import get_db_connection
+import abc
+import argparse
+import hashlib
+import logging
+import queue
 import re
+import sys
+import threading
+import time
+import pyperclip
+from ingestion import get_ingestion_pipeline, get_metadata_fetcher
+from metrics import counter, histogram
+from config import CLIPBOARD_POLL_INTERVAL, CLIPBOARD_DEBOUNCE, INGEST_BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+_HOST = (
+    r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+[A-Z]{2,63}\.?'
+    r'|localhost'
+    r'|\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})'
+    r'(?::\d+)?'
+)
+VALID_URL = re.compile(r'^https?://' + _HOST + r'(?:/?|[/?]\S+)$', re.IGNORECASE)
+# An http(s) URL starting at a given position, scheme in any case; trailing punctuation
+# is trimmed afterwards. extract_urls only tries it where str.find locates a "://",
+# which is over 10x faster on long text than letting an IGNORECASE regex scan it all
+URL_SCANNER = re.compile(r'(?i:https?)://(?i:' + _HOST + r')(?![A-Za-z0-9-])(?:[/?#][^\s<>"`]*)?')
+
+POLL_SECONDS = histogram('edvise_clipboard_poll_seconds', 'Clipboard monitor loop time by phase, excluding the sleep',
+                         ['phase'])
+CLIPBOARD_URLS = counter('edvise_clipboard_urls_total', 'URLs found in clipboard text and handed to ingestion')
+
+_TRAILING = '.,;:!?\'"'
+_BRACKETS = {')': '(', ']': '[', '}': '{'}
 
 def is_valid_url(url):
-    url_pattern = re.compile(
-        r'^https?://'
-        r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+[A-Z]{2,6}\.?|'
-        r'localhost|'
-        r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})'
-        r'(?::\d+)?'
-        r'(?:/?|[/?]\S+)$', re.IGNORECASE)
-    return url_pattern.match(url) is not None
+    return VALID_URL.match(url) is not None
+
+def extract_urls(text):
+    """All distinct http(s) URLs in text, in order of appearance"""
+    urls = {}
+    end = 0
+    separator = text.find('://')
+    while separator != -1:
+        if separator >= 5 and text[separator - 5:separator].lower() == 'https':
+            start = separator - 5
+        elif separator >= 4 and text[separator - 4:separator].lower() == 'http':
+            start = separator - 4
+        else:
+            start = None
+        # Not inside the previous URL, nor part of a longer word such as nothttp://
+        if start is not None and start >= end and not (start and text[start - 1].isalnum()):
+            match = URL_SCANNER.match(text, start)
+            if match:
+                urls[_trim(match.group())] = None
+                end = match.end()
+        separator = text.find('://', max(separator + 3, end))
+    return list(urls)
+
+def _trim(url):
+    """Drop sentence punctuation and unbalanced closing brackets glued to the end of a URL"""
+    while url:
+        last = url[-1]
+        if last in _TRAILING:
+            url = url[:-1]
+        elif last in _BRACKETS and url.count(last) > url.count(_BRACKETS[last]):
+            url = url[:-1]
+        else:
+            break
+    return url
 
 def get_url_metadata(url):
-    try:
-        response = requests.get(url)
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        title = soup.title.string if soup.title else url
-        thumbnail = soup.find('meta', property='og:image')
-        thumbnail_url = thumbnail['content'] if thumbnail else None
-        
-        return title, thumbnail_url
-    except:
-        return url, None
-
-def clip_monitor():
-    last_url = ''
-    conn = get_db_connection()
-    
+    return get_metadata_fetcher().fetch(url)
+
+class ClipboardSource(abc.ABC):
+    """Text for the monitor to watch.
+
+    read() returns the current text, or None once the source is exhausted;
+    the monitor sleeps poll_interval seconds between reads.
+    """
+    poll_interval = CLIPBOARD_POLL_INTERVAL
+
+    @abc.abstractmethod
+    def read(self):
+        """The current text, or None once the source is exhausted"""
+
+class SystemClipboard(ClipboardSource):
+    """The desktop clipboard, via pyperclip"""
+
+    def read(self):
+        try:
+            return pyperclip.paste() or ''
+        except pyperclip.PyperclipException as e:
+            logger.warning(f"Clipboard unavailable: {e}")
+            return ''
+
+class FeedSource(ClipboardSource):
+    """Lines from a text stream such as stdin or a file, read on a background thread.
+
+    Each read() returns every line that arrived since the previous one,
+    waiting up to timeout seconds for the first, so a fast feed is scanned
+    in chunks rather than line by line.
+    """
+    poll_interval = 0
+
+    def __init__(self, stream, timeout=CLIPBOARD_POLL_INTERVAL):
+        self.timeout = timeout
+        self._lines = queue.Queue()
+        self._done = False
+        threading.Thread(target=self._pump, args=(stream,), name='clipboard-feed', daemon=True).start()
+
+    def read(self):
+        if self._done:
+            return None
+        try:
+            lines = [self._lines.get(timeout=self.timeout)]
+        except queue.Empty:
+            return ''
+        while True:
+            try:
+                lines.append(self._lines.get_nowait())
+            except queue.Empty:
+                break
+        if lines[-1] is None:
+            self._done = True
+            lines.pop()
+        return ''.join(lines)
+
+    def _pump(self, stream):
+        for line in stream:
+            self._lines.put(line)
+        self._lines.put(None)
+
+class FakeClipboard(ClipboardSource):
+    """Replays a list of clipboard contents, one per read, then reports exhaustion; for tests"""
+    poll_interval = 0
+
+    def __init__(self, texts):
+        self._texts = list(texts)
+
+    def read(self):
+        return self._texts.pop(0) if self._texts else None
+
+def clip_monitor(pipeline=None, source=None, debounce=CLIPBOARD_DEBOUNCE, batch_size=INGEST_BATCH_SIZE):
+    """Watch a clipboard source and hand the URLs in it to the ingestion pipeline.
+
+    Unchanged text is recognised by its hash and never rescanned. URLs from
+    a burst of copies are collected until the source has been quiet for
+    debounce seconds (or batch_size URLs are waiting) and submitted as one
+    batch. Metadata fetching and database writes happen on the pipeline's
+    worker threads so a slow site can't stall polling. Returns once the
+    source is exhausted.
+    """
+    pipeline = pipeline or get_ingestion_pipeline()
+    source = source or SystemClipboard()
+    last_digest = None
+    pending = {}
+    last_found = 0.0
+
     while True:
-        current_url = pyperclip.paste().strip()
-        
-        if current_url != last_url and is_valid_url(current_url):
-            title, thumbnail = get_url_metadata(current_url)
-            
-            if not URL.find_by_url(conn, current_url):
-                URL.add(conn, current_url, title, thumbnail)
-                print(f"Added new URL: {current_url}")
-            
-            last_url = current_url
-        
-        time.sleep(1)
+        with POLL_SECONDS.time(phase='read'):
+            text = source.read()
+        if text is None:
+            break
+        with POLL_SECONDS.time(phase='scan'):
+            digest = hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+            if digest != last_digest:
+                last_digest = digest
+                try:
+                    for url in extract_urls(text):
+                        pending.setdefault(url, None)
+                        last_found = time.monotonic()
+                except Exception as e:
+                    logger.error(f"Could not scan clipboard text for URLs: {e}")
+        if pending and (len(pending) >= batch_size or time.monotonic() - last_found >= debounce):
+            with POLL_SECONDS.time(phase='submit'):
+                _submit_quietly(pipeline, pending)
+            pending = {}
+        if source.poll_interval:
+            time.sleep(source.poll_interval)
+
+    if pending:
+        _submit_quietly(pipeline, pending)
+
+def _submit_quietly(pipeline, urls):
+    """_submit, logging failures so one bad batch can't end the monitor"""
+    try:
+        _submit(pipeline, urls)
+    except Exception as e:
+        logger.error(f"Could not queue {len(urls)} clipboard URLs: {e}")
+
+def _submit(pipeline, urls):
+    CLIPBOARD_URLS.inc(len(urls))
+    for url in pipeline.submit_many(list(urls)):
+        print(f"Queued URL: {url}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Ingest URLs from the clipboard, or from a text feed')
+    parser.add_argument('--feed', metavar='FILE', help='read text from FILE (- for stdin) instead of the clipboard')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    pipeline = get_ingestion_pipeline()
+    if args.feed is None:
+        clip_monitor(pipeline)
+    elif args.feed == '-':
+        clip_monitor(pipeline, FeedSource(sys.stdin))
+    else:
+        with open(args.feed, encoding='utf-8', errors='replace') as f:
+            clip_monitor(pipeline, FeedSource(f))
+    pipeline.stop()
+    print(pipeline.stats())
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
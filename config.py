@@ -1,14 +1,150 @@
 from dotenv import load_dotenv
+from collections import deque
+from contextlib import contextmanager
 import os
+import threading
+import time
+import logging
 import psycopg2
+import psycopg2.extensions
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 DB_USER = os.getenv('DB_USER')
 DB_PASSWORD = os.getenv('DB_PASSWORD')
 DB_HOST = os.getenv('DB_HOST')
 DB_NAME = os.getenv('DB_NAME')
 
+# Connection pool sizing and health checks
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', 1))
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', 10))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))
+DB_POOL_HEALTHCHECK_IDLE = float(os.getenv('DB_POOL_HEALTHCHECK_IDLE', 30))
+
+# Clipboard ingestion pipeline
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', 4))
+INGEST_QUEUE_SIZE = int(os.getenv('INGEST_QUEUE_SIZE', 1000))
+INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', 50))
+INGEST_FLUSH_INTERVAL = float(os.getenv('INGEST_FLUSH_INTERVAL', 2))
+# Clipboard monitor: seconds between clipboard reads, and how long a burst of copies
+# must go quiet before its URLs are submitted together
+CLIPBOARD_POLL_INTERVAL = float(os.getenv('CLIPBOARD_POLL_INTERVAL', 1))
+CLIPBOARD_DEBOUNCE = float(os.getenv('CLIPBOARD_DEBOUNCE', 2))
+FETCH_CONNECT_TIMEOUT = float(os.getenv('FETCH_CONNECT_TIMEOUT', 3.05))
+FETCH_READ_TIMEOUT = float(os.getenv('FETCH_READ_TIMEOUT', 10))
+# Byte budget for reading a page's <head>; the fetch stops at </head> or this limit
+FETCH_MAX_BYTES = int(os.getenv('FETCH_MAX_BYTES', 512 * 1024))
+FETCH_RETRIES = int(os.getenv('FETCH_RETRIES', 2))
+FETCH_BACKOFF = float(os.getenv('FETCH_BACKOFF', 0.5))
+
+# Shared on-disk metadata/response cache (SQLite)
+METADATA_CACHE_PATH = os.getenv('METADATA_CACHE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'metadata.sqlite3'))
+METADATA_CACHE_MAX_ENTRIES = int(os.getenv('METADATA_CACHE_MAX_ENTRIES', 50000))
+METADATA_CACHE_TTL = int(os.getenv('METADATA_CACHE_TTL', 6 * 60 * 60))
+
+# Thumbnail proxy: og:images cropped to THUMB_WIDTH x THUMB_HEIGHT WebP files in a
+# content-addressed on-disk cache, evicted least-recently-served first past THUMB_CACHE_MAX_BYTES
+THUMB_CACHE_DIR = os.getenv('THUMB_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'thumbnails'))
+THUMB_CACHE_MAX_BYTES = int(os.getenv('THUMB_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+THUMB_WIDTH = int(os.getenv('THUMB_WIDTH', 160))
+THUMB_HEIGHT = int(os.getenv('THUMB_HEIGHT', 100))
+THUMB_QUALITY = int(os.getenv('THUMB_QUALITY', 75))
+# Source images larger than this are not downloaded
+THUMB_SOURCE_MAX_BYTES = int(os.getenv('THUMB_SOURCE_MAX_BYTES', 10 * 1024 * 1024))
+# Seconds before an image that failed to fetch or decode is tried again
+THUMB_FAILURE_TTL = int(os.getenv('THUMB_FAILURE_TTL', 6 * 60 * 60))
+THUMB_PREFETCH_WORKERS = int(os.getenv('THUMB_PREFETCH_WORKERS', 2))
+
+# Write-behind visit counters: flushed every interval or once this many clicks are pending
+VISIT_FLUSH_INTERVAL = float(os.getenv('VISIT_FLUSH_INTERVAL', 5))
+VISIT_FLUSH_THRESHOLD = int(os.getenv('VISIT_FLUSH_THRESHOLD', 500))
+
+# Bulk URL import
+BULK_IMPORT_MAX_URLS = int(os.getenv('BULK_IMPORT_MAX_URLS', 50000))
+BULK_ENRICH_WORKERS = int(os.getenv('BULK_ENRICH_WORKERS', 8))
+
+# Batch crawl service (Scrapy), fed from the url table
+CRAWL_CONCURRENCY = int(os.getenv('CRAWL_CONCURRENCY', 16))
+CRAWL_CONCURRENCY_PER_DOMAIN = int(os.getenv('CRAWL_CONCURRENCY_PER_DOMAIN', 2))
+CRAWL_DOWNLOAD_DELAY = float(os.getenv('CRAWL_DOWNLOAD_DELAY', 1.0))
+CRAWL_MAX_ATTEMPTS = int(os.getenv('CRAWL_MAX_ATTEMPTS', 3))
+CRAWL_RETRY_BACKOFF = float(os.getenv('CRAWL_RETRY_BACKOFF', 300))
+CRAWL_BATCH_SIZE = int(os.getenv('CRAWL_BATCH_SIZE', 50))
+CRAWL_POLL_INTERVAL = float(os.getenv('CRAWL_POLL_INTERVAL', 5))
+# Seconds before a claimed URL that was never reported back may be claimed again
+CRAWL_LEASE = int(os.getenv('CRAWL_LEASE', 600))
+# Adaptive recrawl spacing, in seconds
+RECRAWL_MIN_INTERVAL = float(os.getenv('RECRAWL_MIN_INTERVAL', 60 * 60))
+RECRAWL_MAX_INTERVAL = float(os.getenv('RECRAWL_MAX_INTERVAL', 30 * 24 * 60 * 60))
+RECRAWL_DEFAULT_INTERVAL = float(os.getenv('RECRAWL_DEFAULT_INTERVAL', 24 * 60 * 60))
+
+# Near-duplicate page detection: MinHash over word shingles of main_content,
+# banded LSH (NEAR_DUP_NUM_PERM must be divisible by NEAR_DUP_BANDS)
+NEAR_DUP_SHINGLE_SIZE = int(os.getenv('NEAR_DUP_SHINGLE_SIZE', 5))
+NEAR_DUP_NUM_PERM = int(os.getenv('NEAR_DUP_NUM_PERM', 128))
+NEAR_DUP_BANDS = int(os.getenv('NEAR_DUP_BANDS', 16))
+# Estimated Jaccard similarity at which two pages count as the same content
+NEAR_DUP_THRESHOLD = float(os.getenv('NEAR_DUP_THRESHOLD', 0.8))
+
+# "Related links": TF-IDF vectors of crawled page text in memory-mapped files
+RELATED_INDEX_DIR = os.getenv('RELATED_INDEX_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'related'))
+# Hashed term space; 2**18 keeps collisions rare at this corpus size
+RELATED_FEATURES = int(os.getenv('RELATED_FEATURES', 2 ** 18))
+# Terms in more than this share of pages are dropped as stop words
+RELATED_MAX_DF = float(os.getenv('RELATED_MAX_DF', 0.5))
+# Seconds between checks for newly crawled pages to add to the index
+RELATED_REFRESH_INTERVAL = float(os.getenv('RELATED_REFRESH_INTERVAL', 30))
+# Full rebuild once the index is this old (seconds) or pages added since exceed this share
+RELATED_REBUILD_INTERVAL = float(os.getenv('RELATED_REBUILD_INTERVAL', 24 * 60 * 60))
+RELATED_REBUILD_GROWTH = float(os.getenv('RELATED_REBUILD_GROWTH', 0.2))
+
+# Scraped page writes to MongoDB: batched upserts flushed on size or age
+MONGO_BATCH_SIZE = int(os.getenv('MONGO_BATCH_SIZE', 100))
+MONGO_FLUSH_INTERVAL = float(os.getenv('MONGO_FLUSH_INTERVAL', 5))
+# Items kept for retry while MongoDB is unreachable; the oldest beyond this are dropped
+MONGO_MAX_BUFFER = int(os.getenv('MONGO_MAX_BUFFER', 10000))
+
+# Instrumentation: the web app serves /metrics; the crawl service serves its own
+# /metrics on this port when it is non-zero
+CRAWL_METRICS_PORT = int(os.getenv('CRAWL_METRICS_PORT', 0))
+# Sampling profiler for slow web requests: stacks of requests taking at least this many
+# seconds are written to PROFILE_DIR as collapsed flame graph input; 0 turns it off
+PROFILE_SLOW_REQUEST_SECONDS = float(os.getenv('PROFILE_SLOW_REQUEST_SECONDS', 0))
+PROFILE_SAMPLE_INTERVAL = float(os.getenv('PROFILE_SAMPLE_INTERVAL', 0.005))
+PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'profiles'))
+PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', 200))
+
+# JSON API responses of at least this many bytes are gzip/brotli compressed when the
+# client accepts it; the levels favour speed, since responses are compressed per request
+API_COMPRESS_MIN_BYTES = int(os.getenv('API_COMPRESS_MIN_BYTES', 1024))
+API_GZIP_LEVEL = int(os.getenv('API_GZIP_LEVEL', 5))
+API_BROTLI_QUALITY = int(os.getenv('API_BROTLI_QUALITY', 4))
+
+# Streaming export: rows per server-side cursor round trip (and per scraped_pages
+# lookup), and bytes buffered before each chunk is written to the client
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', 2000))
+EXPORT_CHUNK_BYTES = int(os.getenv('EXPORT_CHUNK_BYTES', 64 * 1024))
+
+# Extraction profile crawls use unless told otherwise: metadata-only, summary or full
+# (see Webspiders/page_extraction.py for each profile's fields and budgets)
+EXTRACT_PROFILE = os.getenv('EXTRACT_PROFILE', 'full')
+
+# Link-health sweeps: total and per-host concurrent checks, seconds between request
+# starts on one host (robots.txt Crawl-delay can raise it), and per-check timeout
+LINK_CHECK_CONCURRENCY = int(os.getenv('LINK_CHECK_CONCURRENCY', 100))
+LINK_CHECK_PER_HOST = int(os.getenv('LINK_CHECK_PER_HOST', 2))
+LINK_CHECK_HOST_DELAY = float(os.getenv('LINK_CHECK_HOST_DELAY', 0.5))
+LINK_CHECK_TIMEOUT = float(os.getenv('LINK_CHECK_TIMEOUT', 15))
+# Seconds before a check is stale; unavailable links are retried sooner
+LINK_CHECK_MAX_AGE = float(os.getenv('LINK_CHECK_MAX_AGE', 7 * 24 * 60 * 60))
+LINK_CHECK_RETRY_AGE = float(os.getenv('LINK_CHECK_RETRY_AGE', 6 * 60 * 60))
+# Stale rows fetched, checked and written per round of a sweep
+LINK_CHECK_BATCH_SIZE = int(os.getenv('LINK_CHECK_BATCH_SIZE', 2000))
+# Seconds between background sweeps in the web app; 0 leaves sweeps to link_health.py
+LINK_CHECK_INTERVAL = float(os.getenv('LINK_CHECK_INTERVAL', 60 * 60))
+
 def get_db_connection():
     return psycopg2.connect(
         dbname=DB_NAME,
@@ -16,3 +152,182 @@ def get_db_connection():
         password=DB_PASSWORD,
         host=DB_HOST
     )
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection becomes available in time"""
+
+class ConnectionPool:
+    """Thread-safe PostgreSQL connection pool with health checks and usage stats"""
+
+    def __init__(self, minconn=DB_POOL_MIN, maxconn=DB_POOL_MAX, timeout=DB_POOL_TIMEOUT,
+                 healthcheck_idle=DB_POOL_HEALTHCHECK_IDLE, connect=get_db_connection):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError("Invalid pool size: need 0 <= minconn <= maxconn and maxconn >= 1")
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.healthcheck_idle = healthcheck_idle
+        self._connect = connect
+        self._idle = deque()  # (connection, returned_at)
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._stats = {
+            'checkouts': 0,
+            'waits': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+            'timeouts': 0,
+            'reconnects': 0,
+            'discarded': 0,
+        }
+        for _ in range(minconn):
+            self._idle.append((connect(), time.monotonic()))
+            self._size += 1
+
+    def getconn(self, timeout=None):
+        """Check out a healthy connection, waiting up to timeout seconds for one to free up"""
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        waited = False
+        conn = None
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolTimeout("Connection pool is closed")
+                if self._idle:
+                    conn, returned_at = self._idle.pop()
+                    break
+                if self._size < self.maxconn:
+                    # Reserve a slot; the connection is opened outside the lock
+                    self._size += 1
+                    returned_at = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolTimeout(f"No database connection available after {timeout}s")
+                waited = True
+                self._cond.wait(remaining)
+
+            wait_time = time.monotonic() - started
+            self._stats['checkouts'] += 1
+            if waited:
+                self._stats['waits'] += 1
+            self._stats['wait_time_total'] += wait_time
+            self._stats['wait_time_max'] = max(self._stats['wait_time_max'], wait_time)
+
+        try:
+            if conn is None:
+                return self._connect()
+            if not self._is_healthy(conn, returned_at):
+                self._close_quietly(conn)
+                with self._cond:
+                    self._stats['reconnects'] += 1
+                return self._connect()
+            return conn
+        except Exception:
+            self._release_slot()
+            raise
+
+    def putconn(self, conn, discard=False):
+        """Return a connection to the pool, rolling back any open transaction"""
+        if not discard and not conn.closed:
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                discard = True
+        if discard or conn.closed or self._closed:
+            self._close_quietly(conn)
+            with self._cond:
+                self._stats['discarded'] += 1
+            self._release_slot()
+            return
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """Check out a connection for the duration of a with-block"""
+        conn = self.getconn(timeout)
+        discard = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            # The socket is likely dead; never hand this connection out again
+            discard = True
+            raise
+        finally:
+            self.putconn(conn, discard=discard)
+
+    def stats(self):
+        """Snapshot of pool usage and wait statistics"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'min': self.minconn,
+                'max': self.maxconn,
+            })
+        checkouts = stats['checkouts']
+        stats['wait_time_avg'] = stats['wait_time_total'] / checkouts if checkouts else 0.0
+        return stats
+
+    def closeall(self):
+        """Close every idle connection and refuse further checkouts"""
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+    def _is_healthy(self, conn, returned_at):
+        if conn.closed:
+            return False
+        if time.monotonic() - returned_at < self.healthcheck_idle:
+            return True
+        # Connection sat idle long enough that the server or a proxy may have dropped it
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _release_slot(self):
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+_db_pool = None
+_db_pool_lock = threading.Lock()
+
+def get_db_pool():
+    """Return the process-wide connection pool, creating it on first use"""
+    global _db_pool
+    if _db_pool is None:
+        with _db_pool_lock:
+            if _db_pool is None:
+                _db_pool = ConnectionPool()
+                logger.info(f"Created database pool (min={DB_POOL_MIN}, max={DB_POOL_MAX})")
+    return _db_pool
+
+def db_connection(timeout=None):
+    """Context manager that checks a pooled connection out and returns it afterwards"""
+    return get_db_pool().connection(timeout)
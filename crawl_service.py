@@ -0,0 +1,414 @@
+import logging
+import os
+import time
+from collections import deque
+import scrapy
+from scrapy import signals
+from scrapy.crawler import CrawlerProcess
+from scrapy.exceptions import DontCloseSpider, IgnoreRequest
+from scrapy.spidermiddlewares.httperror import HttpError
+from scrapy.utils.project import get_project_settings
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+from twisted.internet import task, threads
+from Webspiders.extractor import PageSummarizerSpider
+from Webspiders.page_extraction import extract_page, get_profile, walk_response
+from models import URL
+from recrawl import RecrawlScheduler, content_fingerprint
+from near_duplicates import MinHasher, NearDuplicateIndex, rebuild_from_pages
+import metrics
+from config import (
+    CRAWL_CONCURRENCY, CRAWL_CONCURRENCY_PER_DOMAIN, CRAWL_DOWNLOAD_DELAY, CRAWL_MAX_ATTEMPTS,
+    CRAWL_RETRY_BACKOFF, CRAWL_BATCH_SIZE, CRAWL_POLL_INTERVAL, CRAWL_LEASE, CRAWL_METRICS_PORT, EXTRACT_PROFILE
+)
+
+logger = logging.getLogger(__name__)
+
+# HTTP statuses that will not improve with retries
+PERMANENT_FAILURE_STATUSES = {400, 401, 403, 404, 405, 410, 451}
+# Window for the rolling pages/second figure
+RATE_WINDOW = 60
+# Seconds between throughput log lines
+STATS_LOG_INTERVAL = 30
+
+class CrawlQueueSpider(PageSummarizerSpider):
+    """PageSummarizerSpider that keeps running and takes its URLs from the crawl service"""
+
+    def __init__(self, service=None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.service = service
+        self.start_urls = []
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        crawler.signals.connect(spider.spider_idle, signal=signals.spider_idle)
+        return spider
+
+    def start_requests(self):
+        # Everything is scheduled by the service as it claims rows
+        return iter(())
+
+    def spider_idle(self, spider):
+        self.service.poll()
+        raise DontCloseSpider()
+
+    def parse_claimed(self, response):
+        meta = response.meta
+        url_id = meta['url_id']
+        previous = meta['previous_fingerprint']
+        etag = _header(response, 'ETag')
+        last_modified = _header(response, 'Last-Modified')
+        if previous and response.status == 304:
+            self.service.unchanged(url_id, previous, etag, last_modified, not_modified=True)
+            return
+        try:
+            page = walk_response(response, self.profile)
+            fingerprint = content_fingerprint(page.fingerprint_text())
+            if fingerprint == previous:
+                # Same text: no item, so nothing is rewritten downstream
+                self.service.unchanged(url_id, fingerprint, etag, last_modified)
+                return
+            item = extract_page(response, page)
+            signature, duplicate_of = self.service.near_duplicate(url_id, item['main_content'])
+        except Exception as e:
+            self.logger.error(f"Extraction failed for {response.url}: {e}")
+            self.service.failed(url_id, meta['crawl_attempt'], f"Extraction failed: {e}")
+            return
+        item['content_fingerprint'] = fingerprint
+        item['etag'] = etag
+        item['last_modified'] = last_modified
+        if signature is not None:
+            item['minhash'] = signature.tobytes()
+        if duplicate_of is None:
+            # Near-duplicates of a stored page aren't stored (or summarized) again
+            yield item
+        self.service.changed(url_id, fingerprint, etag, last_modified,
+                             item['meta_description'], item['ai_ready_text'], duplicate_of)
+
+    def claimed_failed(self, failure):
+        meta = failure.request.meta
+        # An HTTP status that retrying won't fix, or a request dropped as disallowed
+        # (HttpError is itself an IgnoreRequest, so it is checked first)
+        if failure.check(HttpError):
+            status = failure.value.response.status
+            permanent, error = status in PERMANENT_FAILURE_STATUSES, f"HTTP {status}"
+        else:
+            permanent, error = bool(failure.check(IgnoreRequest)), failure.getErrorMessage()
+        self.service.failed(meta['url_id'], meta['crawl_attempt'], error, permanent)
+
+class CrawlService:
+    """One long-running Scrapy crawl fed from the url table.
+
+    Due URLs are claimed in batches (FOR UPDATE SKIP LOCKED) and scheduled
+    into a single PageSummarizerSpider. Scrapy enforces total and per-domain
+    concurrency and download delays; failures get up to max_attempts tries
+    with exponential backoff before a row is marked failed. Outcomes are
+    written back in batches off the reactor thread.
+
+    Recrawls are incremental: requests carry the stored ETag/Last-Modified,
+    and a page whose fingerprint (its main text, or head metadata under a
+    profile that skips the body) is unchanged yields no item. Each
+    outcome feeds the RecrawlScheduler, which sets when the URL is next due.
+
+    Changed pages are checked against a MinHash LSH index of stored pages,
+    seeded from scraped_pages at startup. A near-duplicate yields no item and
+    leaves the queue with status 'duplicate', pointing at the page it copies.
+
+    Pages are extracted under profile (an ExtractionProfile or its name),
+    whose budgets bound the work any one huge or hostile page can cause.
+    """
+
+    def __init__(self, settings=None, concurrency=CRAWL_CONCURRENCY,
+                 per_domain=CRAWL_CONCURRENCY_PER_DOMAIN, download_delay=CRAWL_DOWNLOAD_DELAY,
+                 max_attempts=CRAWL_MAX_ATTEMPTS, retry_backoff=CRAWL_RETRY_BACKOFF,
+                 batch_size=CRAWL_BATCH_SIZE, poll_interval=CRAWL_POLL_INTERVAL, lease=CRAWL_LEASE,
+                 scheduler=None, near_duplicates=None, metrics_port=CRAWL_METRICS_PORT, profile=EXTRACT_PROFILE):
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.scheduler = scheduler or RecrawlScheduler()
+        self.hasher = MinHasher()
+        # A given index is used as is; otherwise one is built from scraped_pages in run()
+        self._seed_near_duplicates = near_duplicates is None
+        self.near_duplicates = near_duplicates if near_duplicates is not None else NearDuplicateIndex()
+        # Keep at most this many claimed URLs in Scrapy's scheduler at once
+        self.max_in_flight = max(batch_size, concurrency * 2)
+        self.settings = settings or crawl_settings()
+        self.settings.set('CONCURRENT_REQUESTS', concurrency)
+        self.settings.set('CONCURRENT_REQUESTS_PER_DOMAIN', per_domain)
+        self.settings.set('DOWNLOAD_DELAY', download_delay)
+        # AutoThrottle adapts each domain's delay to its latency, starting from ours
+        self.settings.set('AUTOTHROTTLE_START_DELAY', download_delay)
+        self.settings.set('AUTOTHROTTLE_TARGET_CONCURRENCY', float(per_domain))
+        self.metrics_port = metrics_port
+        self.profile = get_profile(profile)
+        self._metrics_server = None
+        self.process = None
+        self.spider = None
+        self._in_flight = {}  # url id -> claimed row
+        self._results = []
+        self._content = []
+        self._claiming = False
+        self._flushing = False
+        self._closed_spider = False
+        self._loops = []
+        self._completed = deque()
+        self._started_at = None
+        self._stats = {
+            'claimed': 0,
+            'crawled': 0,
+            'changed': 0,
+            'unchanged': 0,
+            'not_modified': 0,
+            'near_duplicates': 0,
+            'retried': 0,
+            'failed': 0,
+        }
+
+    def run(self):
+        """Crawl until interrupted (Ctrl+C stops gracefully, releasing unfinished claims)"""
+        if self._seed_near_duplicates:
+            self._seed_near_duplicates = False
+            self._load_near_duplicates()
+        metrics.REGISTRY.add_collector('edvise_crawl', self._stats_from_reactor)
+        if self.metrics_port and self._metrics_server is None:
+            # Model, extraction and Mongo timings from this process, plus the crawl stats
+            self._metrics_server = metrics.serve(self.metrics_port)
+        self.process = CrawlerProcess(self.settings)
+        crawler = self.process.create_crawler(CrawlQueueSpider)
+        crawler.signals.connect(self._opened, signal=signals.spider_opened)
+        crawler.signals.connect(self._closed, signal=signals.spider_closed)
+        self.process.crawl(crawler, service=self, profile=self.profile)
+        self.process.start()
+
+    def stop(self):
+        self._closed_spider = True
+        if self.process is not None:
+            self.process.stop()
+
+    def near_duplicate(self, url_id, main_content):
+        """MinHash signature of a changed page and the stored page it duplicates, if any"""
+        signature = self.hasher.signature(main_content)
+        row = self._in_flight.get(url_id)
+        if signature is None or row is None:
+            return signature, None
+        duplicate_of = self.near_duplicates.best_match(signature, exclude=row['url'])
+        if duplicate_of is None:
+            self.near_duplicates.add(row['url'], signature)
+        else:
+            # It may have been distinct before; it no longer represents a group
+            self.near_duplicates.remove(row['url'])
+        return signature, duplicate_of
+
+    def poll(self):
+        """Flush outcomes and top up the scheduler with newly due URLs"""
+        self._flush()
+        room = self.max_in_flight - len(self._in_flight)
+        if self._closed_spider or self._claiming or room < min(self.batch_size, self.max_in_flight):
+            return
+        self._claiming = True
+        d = threads.deferToThread(URL.claim_for_crawl, min(room, self.batch_size * 2), self.lease)
+        d.addCallbacks(self._schedule, self._claim_failed)
+
+    def changed(self, url_id, fingerprint, etag, last_modified, description=None, text=None,
+                duplicate_of=None):
+        self._stats['changed'] += 1
+        row = self._in_flight.get(url_id)
+        if row is not None:
+            # Indexed for search under the address the dashboard stores
+            self._content.append((row['url'], description, text, duplicate_of))
+        if duplicate_of is not None:
+            self._stats['near_duplicates'] += 1
+            logger.info(f"URL {url_id} is a near-duplicate of {duplicate_of}")
+        self._succeeded(url_id, True, fingerprint, etag, last_modified, duplicate=duplicate_of is not None)
+
+    def unchanged(self, url_id, fingerprint, etag, last_modified, not_modified=False):
+        self._stats['not_modified' if not_modified else 'unchanged'] += 1
+        self._succeeded(url_id, False, fingerprint, etag, last_modified)
+
+    def failed(self, url_id, attempt, error, permanent=False):
+        self._in_flight.pop(url_id, None)
+        if permanent or attempt >= self.max_attempts:
+            self._results.append((url_id, 'failed', None, error) + (None,) * 7)
+            self._stats['failed'] += 1
+            logger.warning(f"Giving up on URL {url_id} after {attempt} attempts: {error}")
+        else:
+            delay = self.retry_backoff * (2 ** (attempt - 1))
+            self._results.append((url_id, 'pending', delay, error) + (None,) * 7)
+            self._stats['retried'] += 1
+
+    def stats(self):
+        now = time.monotonic()
+        while self._completed and now - self._completed[0] > RATE_WINDOW:
+            self._completed.popleft()
+        elapsed = now - self._started_at if self._started_at else 0
+        stats = dict(self._stats)
+        stats['in_flight'] = len(self._in_flight)
+        stats['pages_per_second'] = len(self._completed) / min(RATE_WINDOW, elapsed) if elapsed else 0.0
+        stats['overall_pages_per_second'] = self._stats['crawled'] / elapsed if elapsed else 0.0
+        return stats
+
+    def _stats_from_reactor(self):
+        # stats() trims the rate window, so scrapes from the metrics thread run it on the reactor
+        from twisted.internet import reactor
+        return threads.blockingCallFromThread(reactor, self.stats)
+
+    def _opened(self, spider):
+        self.spider = spider
+        self._started_at = time.monotonic()
+        poll_loop = task.LoopingCall(self.poll)
+        poll_loop.start(self.poll_interval)
+        stats_loop = task.LoopingCall(self._log_stats)
+        stats_loop.start(STATS_LOG_INTERVAL, now=False)
+        self._loops = [poll_loop, stats_loop]
+
+    def _closed(self, spider):
+        self._closed_spider = True
+        for loop in self._loops:
+            if loop.running:
+                loop.stop()
+        # The reactor is shutting down, so write the last outcomes synchronously
+        results, self._results = self._results, []
+        content, self._content = self._content, []
+        try:
+            _record(results, content)
+            URL.release_crawl(self._in_flight)
+        except Exception as e:
+            logger.error(f"Error saving crawl state on shutdown: {e}")
+        logger.info(f"Crawl service stopped: {self.stats()}")
+
+    def _succeeded(self, url_id, changed, fingerprint, etag, last_modified, duplicate=False):
+        row = self._in_flight.pop(url_id, None)
+        if row is None:
+            return
+        checks, changes, observed, interval = self.scheduler.observe(row, changed)
+        # Duplicates aren't due again until someone requests them
+        status, delay = ('duplicate', None) if duplicate else ('done', interval)
+        self._results.append((
+            url_id, status, delay, None, fingerprint, etag, last_modified,
+            checks, changes, observed, interval
+        ))
+        self._stats['crawled'] += 1
+        self._completed.append(time.monotonic())
+
+    def _schedule(self, rows):
+        self._claiming = False
+        if self._closed_spider:
+            # Claimed while shutting down; hand the rows straight back
+            URL.release_crawl([row['id'] for row in rows])
+            return
+        self._stats['claimed'] += len(rows)
+        for row in rows:
+            self._in_flight[row['id']] = row
+            headers = {}
+            recrawl = bool(row['content_fingerprint'])
+            if recrawl:
+                # Only pages extracted before can be answered with a 304
+                if row['http_etag']:
+                    headers['If-None-Match'] = row['http_etag']
+                if row['http_last_modified']:
+                    headers['If-Modified-Since'] = row['http_last_modified']
+            request = scrapy.Request(
+                row['url'],
+                headers=headers,
+                callback=self.spider.parse_claimed,
+                errback=self.spider.claimed_failed,
+                meta={
+                    'url_id': row['id'],
+                    'crawl_attempt': row['crawl_attempts'],
+                    'previous_fingerprint': row['content_fingerprint'],
+                    'handle_httpstatus_list': [304],
+                    # A due recrawl must reach the site rather than get a body
+                    # the metadata cache still considers fresh
+                    'skip_metadata_cache': recrawl,
+                },
+                dont_filter=True
+            )
+            _engine_crawl(self.spider.crawler.engine, request, self.spider)
+        if rows:
+            logger.info(f"Scheduled {len(rows)} URLs for crawling")
+
+    def _claim_failed(self, failure):
+        self._claiming = False
+        logger.error(f"Error claiming URLs for crawl: {failure.getErrorMessage()}")
+
+    def _load_near_duplicates(self):
+        uri, database = self.settings.get('MONGO_URI'), self.settings.get('MONGO_DATABASE')
+        if not uri or not database:
+            return
+        client = MongoClient(uri, serverSelectionTimeoutMS=5000)
+        try:
+            started = time.monotonic()
+            rebuild_from_pages(client[database]['scraped_pages'], self.hasher, self.near_duplicates)
+            logger.info(f"Near-duplicate index loaded with {len(self.near_duplicates)} pages "
+                        f"in {time.monotonic() - started:.1f}s")
+        except PyMongoError as e:
+            logger.warning(f"Near-duplicate index starts empty, scraped_pages unavailable: {e}")
+        finally:
+            client.close()
+
+    def _flush(self):
+        if self._flushing or not (self._results or self._content):
+            return
+        results, self._results = self._results, []
+        content, self._content = self._content, []
+        self._flushing = True
+
+        def done(_):
+            self._flushing = False
+
+        def failed(failure):
+            # Keep the outcomes for the next flush
+            self._results.extend(results)
+            self._content.extend(content)
+            logger.error(f"Error recording crawl results: {failure.getErrorMessage()}")
+
+        d = threads.deferToThread(_record, results, content)
+        d.addErrback(failed)
+        d.addBoth(done)
+
+    def _log_stats(self):
+        stats = self.stats()
+        logger.info(
+            f"Crawl throughput: {stats['pages_per_second']:.2f} pages/s "
+            f"(overall {stats['overall_pages_per_second']:.2f}), crawled={stats['crawled']} "
+            f"changed={stats['changed']} unchanged={stats['unchanged'] + stats['not_modified']} "
+            f"near_duplicates={stats['near_duplicates']} "
+            f"retried={stats['retried']} failed={stats['failed']} in_flight={stats['in_flight']}"
+        )
+
+def _record(results, content):
+    URL.save_page_content(content)
+    URL.record_crawl_results(results)
+
+def _header(response, name):
+    value = response.headers.get(name)
+    return value.decode('latin-1') if value is not None else None
+
+def _engine_crawl(engine, request, spider):
+    # ExecutionEngine.crawl lost its spider argument in Scrapy 2.6
+    if scrapy.version_info < (2, 6):
+        engine.crawl(request, spider)
+    else:
+        engine.crawl(request)
+
+def crawl_settings():
+    """Project settings shared by one-off crawls and the crawl service"""
+    settings = get_project_settings()
+    settings.set('ITEM_PIPELINES', {
+        'datafactory.MongoDBPipeline': 300,
+    })
+    # Serve and revalidate pages through the cache shared with clipboard ingestion
+    settings.set('DOWNLOADER_MIDDLEWARES', {
+        'Webspiders.middlewares.MetadataCacheMiddleware': 580,
+    })
+    settings.set('MONGO_URI', os.getenv('Mongo_URI'))
+    settings.set('MONGO_DATABASE', os.getenv('Mongo_Database'))
+    settings.set('ROBOTSTXT_OBEY', True)
+    settings.set('AUTOTHROTTLE_ENABLED', True)
+    # Quick in-crawl retry for transient errors; the service's backoff handles the rest
+    settings.set('RETRY_TIMES', 1)
+    return settings
@@ -1,10 +1,16 @@
 # main.py
 from scrapy.crawler import CrawlerProcess
 from datetime import datetime
-from scrapy.utils.project import get_project_settings
 from Webspiders.extractor import PageSummarizerSpider
+from crawl_service import CrawlService, crawl_settings
+from models import URL
+from pymongo import ReplaceOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
+from twisted.internet import task
+from config import MONGO_BATCH_SIZE, MONGO_FLUSH_INTERVAL, MONGO_MAX_BUFFER
+from metrics import counter, histogram
 import pymongo
-import logging, os
+import logging, os, sys, time
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -17,93 +23,182 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+MONGO_WRITE_SECONDS = histogram('edvise_mongo_write_seconds', 'scraped_pages bulk upserts by outcome', ['outcome'])
+MONGO_ITEMS = counter('edvise_mongo_items_total', 'Scraped pages written to MongoDB, by outcome', ['outcome'])
+
 def run_spider_with_mongodb(url):
-    settings = get_project_settings()
-    
-    # Configure MongoDB pipeline
-    settings.set('ITEM_PIPELINES', {
-        '__main__.MongoDBPipeline': 300,
-    })
-    
-    # MongoDB settings
-    settings.set('MONGO_URI', os.getenv('Mongo_URI'))
-    settings.set('MONGO_DATABASE', os.getenv('Mongo_Database'))
-    
-    process = CrawlerProcess(settings)
+    """Crawl a single URL in a fresh reactor; use the crawl service for anything more"""
+    process = CrawlerProcess(crawl_settings())
     process.crawl(PageSummarizerSpider, url=url)
     process.start()
 
 # MongoDB Pipeline Class (include this in the same file)
 class MongoDBPipeline:
-    def __init__(self, mongo_uri=os.getenv('Mongo_URI'), mongo_db=os.getenv('Mongo_Database')):
+    """Buffer scraped items and upsert them by URL with one unordered bulk_write per batch.
+
+    A batch is written once it holds batch_size items or is flush_interval
+    seconds old; whatever is left is written in close_spider. A unique index
+    on url makes the ReplaceOne upserts cheap and keeps one document per page.
+
+    The crawl service has already recorded a page's fingerprint by the time
+    its item is written, so a batch that fails to reach MongoDB is kept and
+    retried on the next flush (at most max_buffer items, oldest dropped first).
+    """
+
+    collection_name = 'scraped_pages'
+
+    def __init__(self, mongo_uri=os.getenv('Mongo_URI'), mongo_db=os.getenv('Mongo_Database'),
+                 batch_size=MONGO_BATCH_SIZE, flush_interval=MONGO_FLUSH_INTERVAL,
+                 max_buffer=MONGO_MAX_BUFFER, client=None):
         self.mongo_uri = mongo_uri
         self.mongo_db = mongo_db
-        self.client = None
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max(max_buffer, batch_size)
+        self.client = client
         self.db = None
+        self.collection = None
+        self._buffer = []
+        self._buffer_started = None
+        self._flush_loop = None
+        # Size-triggered flushes wait until then after a failed write
+        self._retry_after = 0.0
+        self._stats = {'items': 0, 'batches': 0, 'write_errors': 0, 'dropped': 0, 'write_seconds': 0.0}
 
     @classmethod
     def from_crawler(cls, crawler):
         return cls(
             mongo_uri=crawler.settings.get("MONGO_URI"),
             mongo_db=crawler.settings.get("MONGO_DATABASE"),
+            batch_size=crawler.settings.getint("MONGO_BATCH_SIZE", MONGO_BATCH_SIZE),
+            flush_interval=crawler.settings.getfloat("MONGO_FLUSH_INTERVAL", MONGO_FLUSH_INTERVAL),
+            max_buffer=crawler.settings.getint("MONGO_MAX_BUFFER", MONGO_MAX_BUFFER),
         )
 
     def open_spider(self, spider):
-        self.client = pymongo.MongoClient(self.mongo_uri)
+        if self.client is None:
+            self.client = pymongo.MongoClient(self.mongo_uri)
         self.db = self.client[self.mongo_db]
+        self.collection = self.db[self.collection_name]
+        self._ensure_url_index()
+        # Flush partial batches on time even when no new items arrive
+        self._flush_loop = task.LoopingCall(self._flush_if_due)
+        self._flush_loop.start(self.flush_interval, now=False)
         logger.info(f"Connected to MongoDB: {self.mongo_db}")
 
     def close_spider(self, spider):
+        if self._flush_loop is not None and self._flush_loop.running:
+            self._flush_loop.stop()
+        self.flush()
+        if self._buffer:
+            self._drop(len(self._buffer))
+        stats = self._stats
+        if stats['batches']:
+            logger.info(
+                f"MongoDB writes: {stats['items']} items in {stats['batches']} batches "
+                f"(avg {stats['items'] / stats['batches']:.1f} items, "
+                f"{stats['write_seconds'] * 1000 / stats['batches']:.1f} ms per batch), "
+                f"{stats['write_errors']} errors, {stats['dropped']} dropped"
+            )
         self.client.close()
 
     def process_item(self, item, spider):
-        
         item_dict = dict(item)
         item_dict['scraped_at'] = datetime.utcnow()
         item_dict['spider_name'] = spider.name
-        
-        # Get collection
-        collection = self.db['scraped_pages']
-        
-        # Check if URL already exists in database
-        existing_record = collection.find_one({'url': item_dict.get('url')})
-        
-        if existing_record:
-            # URL already exists, delete the existing record
-            result = collection.delete_one({'_id': existing_record['_id']})
-            logger.info(f"Deleted existing record for URL: {item_dict.get('url')} (Deleted count: {result.deleted_count})")
-        
-        # Insert new record
-        result = collection.insert_one(item_dict)
-        logger.info(f"Saved to MongoDB - ID: {result.inserted_id}")
-        
+
+        if not self._buffer:
+            self._buffer_started = time.monotonic()
+        self._buffer.append(item_dict)
+        if len(self._buffer) >= self.batch_size and time.monotonic() >= self._retry_after:
+            self.flush()
         return item
 
+    def flush(self):
+        """Write buffered items as one unordered batch of upserts keyed by url"""
+        if not self._buffer:
+            return
+        batch, self._buffer = self._buffer, []
+        # A page scraped twice in one batch keeps its latest version
+        latest = {doc.get('url'): doc for doc in batch}
+        operations = [ReplaceOne({'url': url}, doc, upsert=True) for url, doc in latest.items()]
+        started = time.monotonic()
+        try:
+            result = self.collection.bulk_write(operations, ordered=False)
+            details = f"upserted={result.upserted_count} modified={result.modified_count}"
+            errors = 0
+        except BulkWriteError as e:
+            errors = len(e.details.get('writeErrors', []))
+            self._stats['write_errors'] += errors
+            details = f"{errors} write errors"
+            logger.error(f"MongoDB bulk write had errors: {e.details.get('writeErrors', [])[:3]}")
+        except PyMongoError as e:
+            MONGO_WRITE_SECONDS.observe(time.monotonic() - started, outcome='failed')
+            self._stats['write_errors'] += len(operations)
+            logger.error(f"MongoDB bulk write of {len(operations)} items failed, keeping them for retry: {e}")
+            self._retry(list(latest.values()))
+            return
+        elapsed = time.monotonic() - started
+        MONGO_WRITE_SECONDS.observe(elapsed, outcome='partial' if errors else 'ok')
+        MONGO_ITEMS.inc(len(operations) - errors, outcome='ok')
+        if errors:
+            MONGO_ITEMS.inc(errors, outcome='failed')
+        self._stats['items'] += len(operations)
+        self._stats['batches'] += 1
+        self._stats['write_seconds'] += elapsed
+        logger.info(f"Saved {len(operations)} items to MongoDB in {elapsed * 1000:.1f} ms ({details})")
+
+    def _retry(self, batch):
+        # Ahead of anything buffered since, so a page's newer version still wins
+        self._buffer = batch + self._buffer
+        self._buffer_started = time.monotonic()
+        self._retry_after = self._buffer_started + self.flush_interval
+        if len(self._buffer) > self.max_buffer:
+            self._drop(len(self._buffer) - self.max_buffer)
+
+    def _drop(self, count):
+        dropped, self._buffer = self._buffer[:count], self._buffer[count:]
+        MONGO_ITEMS.inc(count, outcome='failed')
+        self._stats['dropped'] += count
+        logger.error(f"Dropping {count} scraped items MongoDB could not store, "
+                     f"starting with {dropped[0].get('url')}")
+
+    def _flush_if_due(self):
+        if self._buffer and time.monotonic() - self._buffer_started >= self.flush_interval:
+            self.flush()
+
+    def _ensure_url_index(self):
+        try:
+            self.collection.create_index('url', unique=True)
+        except DuplicateKeyError:
+            # Older runs could leave several documents per URL; keep the newest
+            removed = 0
+            duplicates = self.collection.aggregate([
+                {'$sort': {'scraped_at': -1}},
+                {'$group': {'_id': '$url', 'ids': {'$push': '$_id'}, 'count': {'$sum': 1}}},
+                {'$match': {'count': {'$gt': 1}}},
+            ], allowDiskUse=True)
+            for group in duplicates:
+                removed += self.collection.delete_many({'_id': {'$in': group['ids'][1:]}}).deleted_count
+            logger.info(f"Removed {removed} duplicate pages before indexing url")
+            self.collection.create_index('url', unique=True)
+
 def process_url(url):
-    """Process a URL, checking if it exists first and handling accordingly"""
+    """Queue a URL for the crawl service, resetting it to pending if it was crawled before"""
     try:
-        # Connect to MongoDB first to check if URL exists
-        client = pymongo.MongoClient("mongodb://localhost:27017")
-        db = client["page_summarizer"]
-        collection = db["scraped_pages"]
-        
-        # Check if URL exists
-        existing_record = collection.find_one({'url': url})
-        
-        if existing_record:
-            last_processed = existing_record.get('scraped_at', 'Unknown')
-            logger.info(f"URL was previously processed at {last_processed}")
-        
-        # Process the URL
-        run_spider_with_mongodb(url)
-        client.close()
-        
+        existing_record = URL.find_by_url(url)
+        if existing_record and existing_record.get('last_crawled_at'):
+            logger.info(f"URL was previously processed at {existing_record['last_crawled_at']}")
+        URL.request_crawl(url)
         return True
-        
+
     except Exception as e:
         logger.error(f"Error processing URL {url}: {str(e)}")
         return False
 
 if __name__ == '__main__':
-    target_url = "https://blog.dailydoseofds.com/p/prompting-vs-rag-vs-finetuning-e43?ref=dailydev"
-    process_url(target_url)
\ No newline at end of file
+    # Queue any URLs given on the command line, then crawl everything due until interrupted
+    URL.create_table()
+    for target_url in sys.argv[1:]:
+        process_url(target_url)
+    CrawlService().run()
@@ -0,0 +1,186 @@
+import argparse
+import csv
+import html
+import io
+import logging
+import os
+import sys
+import threading
+from datetime import timezone
+from itertools import islice
+import pymongo
+from pymongo.errors import PyMongoError
+from api_response import dumps
+from models import URL, select_fields
+from config import EXPORT_BATCH_SIZE, EXPORT_CHUNK_BYTES
+
+logger = logging.getLogger(__name__)
+
+# Format name -> (mimetype, file extension)
+EXPORT_FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'html': ('text/html; charset=utf-8', 'html'),
+}
+# URL columns exported by default; the duplicate columns cost a subquery per row
+EXPORT_FIELDS = ('id', 'url', 'title', 'thumbnail', 'created_date', 'visit')
+# scraped_pages fields joined in with pages=true by default
+EXPORT_PAGE_FIELDS = ('meta_description', 'ai_ready_text', 'content_stats', 'scraped_at')
+
+NETSCAPE_HEADER = """<!DOCTYPE NETSCAPE-Bookmark-file-1>
+<!-- This is an automatically generated file. -->
+<META HTTP-EQUIV="Content-Type" CONTENT="text/html; charset=UTF-8">
+<TITLE>Bookmarks</TITLE>
+<H1>Bookmarks</H1>
+<DL><p>
+"""
+NETSCAPE_FOOTER = "</DL><p>\n"
+
+def batched(rows, size):
+    """Lists of up to size rows"""
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+def join_pages(batches, collection, page_fields=EXPORT_PAGE_FIELDS):
+    """Attach each row's scraped_pages document as row['page'] (None if never crawled).
+
+    One $in query on the unique url index per batch, so a lookup costs a
+    round trip per batch rather than per row.
+    """
+    projection = dict.fromkeys(page_fields, 1)
+    projection.update({'_id': 0, 'url': 1})
+    for batch in batches:
+        pages = {}
+        try:
+            for page in collection.find({'url': {'$in': [row['url'] for row in batch]}}, projection):
+                pages[page.pop('url')] = page
+        except PyMongoError as e:
+            logger.warning(f"Exporting without page data for {len(batch)} URLs, scraped_pages unavailable: {e}")
+        for row in batch:
+            row['page'] = pages.get(row['url'])
+        yield batch
+
+def _cell(value):
+    """A CSV cell: JSON for nested data, the JSON formats' rendering for dates"""
+    if value is None:
+        return ''
+    if isinstance(value, (str, int, float)):
+        return value
+    if isinstance(value, (dict, list)):
+        return dumps(value).decode('utf-8')
+    return dumps(value).decode('utf-8').strip('"')
+
+def render_ndjson(batches, fields, page_fields):
+    for batch in batches:
+        yield b''.join(dumps(row) + b'\n' for row in batch)
+
+def render_csv(batches, fields, page_fields):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(list(fields) + [f'page.{field}' for field in page_fields])
+    for batch in batches:
+        for row in batch:
+            page = row.get('page') or {}
+            writer.writerow([_cell(row[field]) for field in fields] + [_cell(page.get(field)) for field in page_fields])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+def render_html(batches, fields, page_fields):
+    """Netscape bookmark file, as browsers and bulk_import read it"""
+    yield NETSCAPE_HEADER
+    for batch in batches:
+        lines = []
+        for row in batch:
+            added = row.get('created_date')
+            add_date = f' ADD_DATE="{int(added.replace(tzinfo=timezone.utc).timestamp())}"' if added else ''
+            title = html.escape(row.get('title') or row['url'], quote=False)
+            lines.append(f'    <DT><A HREF="{html.escape(row["url"])}"{add_date}>{title}</A>\n')
+            description = (row.get('page') or {}).get('meta_description')
+            if description:
+                lines.append(f'    <DD>{html.escape(description, quote=False)}\n')
+        yield ''.join(lines)
+    yield NETSCAPE_FOOTER
+
+RENDERERS = {'ndjson': render_ndjson, 'csv': render_csv, 'html': render_html}
+
+def chunked(pieces, size=EXPORT_CHUNK_BYTES):
+    """Coalesce rendered pieces into byte chunks of at least size, for fewer, larger writes"""
+    buffer = []
+    buffered = 0
+    for piece in pieces:
+        if isinstance(piece, str):
+            piece = piece.encode('utf-8')
+        buffer.append(piece)
+        buffered += len(piece)
+        if buffered >= size:
+            yield b''.join(buffer)
+            buffer = []
+            buffered = 0
+    if buffered:
+        yield b''.join(buffer)
+
+def export_urls(fmt='ndjson', fields=None, pages=None, page_fields=EXPORT_PAGE_FIELDS,
+                batch_size=EXPORT_BATCH_SIZE, visits=None):
+    """Stream every listed URL as fmt, in byte chunks.
+
+    Rows come off a server-side cursor and are rendered batch by batch, so
+    memory stays flat whatever the collection size. pages is a scraped_pages
+    collection to join page data from; visits a visit buffer whose unflushed
+    counts are added. Both are optional.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {fmt}")
+    # The bookmark file needs these whatever was asked for
+    fields = select_fields(list(fields or EXPORT_FIELDS) + (['url', 'title', 'created_date'] if fmt == 'html' else []))
+    page_fields = tuple(page_fields) if pages is not None else ()
+    batches = batched(URL.iter_export(fields, batch_size=batch_size), batch_size)
+    if visits is not None and 'visit' in fields:
+        batches = (visits.apply(batch) for batch in batches)
+    if pages is not None:
+        batches = join_pages(batches, pages, page_fields)
+    return chunked(RENDERERS[fmt](batches, fields, page_fields))
+
+_pages = None
+_pages_lock = threading.Lock()
+
+def get_scraped_pages():
+    """Return the scraped_pages collection, connecting on first use"""
+    global _pages
+    if _pages is None:
+        with _pages_lock:
+            if _pages is None:
+                uri, database = os.getenv('Mongo_URI'), os.getenv('Mongo_Database')
+                if not uri or not database:
+                    raise ValueError("Mongo_URI and Mongo_Database must be set to export page data")
+                client = pymongo.MongoClient(uri, serverSelectionTimeoutMS=5000)
+                _pages = client[database]['scraped_pages']
+    return _pages
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export every saved URL as NDJSON, CSV or a bookmarks file')
+    parser.add_argument('--format', choices=list(EXPORT_FORMATS), default='ndjson')
+    parser.add_argument('--fields', help=f"comma-separated URL fields (default {','.join(EXPORT_FIELDS)})")
+    parser.add_argument('--pages', action='store_true', help='join in page data from the scraped_pages collection')
+    parser.add_argument('--output', '-o', default='-', help='file to write (default stdout)')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    fields = args.fields.split(',') if args.fields else None
+    chunks = export_urls(args.format, fields, pages=get_scraped_pages() if args.pages else None)
+    if args.output == '-':
+        for chunk in chunks:
+            sys.stdout.buffer.write(chunk)
+    else:
+        with open(args.output, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
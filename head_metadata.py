@@ -0,0 +1,171 @@
+import codecs
+import re
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+
+# Bytes inspected for a <meta charset> declaration when the server sent none
+CHARSET_PRESCAN_BYTES = 1024
+
+_META_CHARSET = re.compile(
+    rb'<meta[^>]+charset\s*=\s*["\']?\s*([a-zA-Z0-9_.:-]+)',
+    re.IGNORECASE
+)
+
+class _EndOfHead(Exception):
+    """Raised by the parser once everything after <head> is irrelevant"""
+
+class HeadMetadataParser(HTMLParser):
+    """Incremental parser that collects cheap <head> fields and stops at </head>"""
+
+    def __init__(self, base_url=None):
+        super().__init__(convert_charrefs=True)
+        self.base_url = base_url
+        self.done = False
+        self.metadata = {
+            'title': None,
+            'description': None,
+            'canonical': None,
+            'og_title': None,
+            'og_image': None,
+            'favicon': None,
+            'charset': None,
+        }
+        self._title_parts = None
+
+    def feed(self, data):
+        if self.done:
+            return
+        try:
+            super().feed(data)
+        except _EndOfHead:
+            self._finish()
+
+    def close(self):
+        if not self.done:
+            try:
+                super().close()
+            except _EndOfHead:
+                pass
+            self._finish()
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'body':
+            raise _EndOfHead()
+        attrs = {name: (value or '') for name, value in attrs}
+        if tag == 'title' and self.metadata['title'] is None:
+            self._title_parts = []
+        elif tag == 'meta':
+            self._handle_meta(attrs)
+        elif tag == 'link':
+            self._handle_link(attrs)
+
+    handle_startendtag = handle_starttag
+
+    def handle_endtag(self, tag):
+        if tag == 'title' and self._title_parts is not None:
+            self._close_title()
+        elif tag == 'head':
+            raise _EndOfHead()
+
+    def handle_data(self, data):
+        if self._title_parts is not None:
+            self._title_parts.append(data)
+
+    def _handle_meta(self, attrs):
+        if 'charset' in attrs and not self.metadata['charset']:
+            self.metadata['charset'] = attrs['charset'].strip().lower()
+        key = (attrs.get('property') or attrs.get('name') or '').strip().lower()
+        content = attrs.get('content', '').strip()
+        if not content:
+            return
+        if key == 'description' and not self.metadata['description']:
+            self.metadata['description'] = content
+        elif key == 'og:title' and not self.metadata['og_title']:
+            self.metadata['og_title'] = content
+        elif key in ('og:image', 'og:image:url') and not self.metadata['og_image']:
+            self.metadata['og_image'] = self._absolute(content)
+
+    def _handle_link(self, attrs):
+        rel = attrs.get('rel', '').lower().split()
+        href = attrs.get('href', '').strip()
+        if not href:
+            return
+        if 'canonical' in rel and not self.metadata['canonical']:
+            self.metadata['canonical'] = self._absolute(href)
+        elif 'icon' in rel and not self.metadata['favicon']:
+            self.metadata['favicon'] = self._absolute(href)
+
+    def _close_title(self):
+        title = ' '.join(''.join(self._title_parts).split())
+        self.metadata['title'] = title or None
+        self._title_parts = None
+
+    def _absolute(self, href):
+        return urljoin(self.base_url, href) if self.base_url else href
+
+    def _finish(self):
+        if self._title_parts is not None:
+            self._close_title()
+        self.done = True
+
+def sniff_charset(prefix):
+    """Find a <meta charset> (or http-equiv content charset) in the first bytes of a document"""
+    match = _META_CHARSET.search(prefix[:CHARSET_PRESCAN_BYTES])
+    if not match:
+        return None
+    name = match.group(1).decode('ascii', 'ignore')
+    try:
+        return codecs.lookup(name).name
+    except LookupError:
+        return None
+
+def extract_head_metadata(chunks, max_bytes, base_url=None, encoding=None):
+    """Stream byte chunks into a HeadMetadataParser until </head> or the byte budget.
+
+    Returns the collected fields plus 'bytes_read' and 'truncated', which is True
+    when the budget ran out before the head was complete.
+    """
+    parser = HeadMetadataParser(base_url)
+    decoder = None
+    prefix = b''
+    bytes_read = 0
+
+    for chunk in chunks:
+        if not chunk:
+            continue
+        chunk = chunk[:max_bytes - bytes_read]
+        bytes_read += len(chunk)
+
+        if decoder is None:
+            # Hold back the first bytes until a charset can be determined
+            prefix += chunk
+            if len(prefix) < CHARSET_PRESCAN_BYTES and bytes_read < max_bytes:
+                continue
+            encoding = encoding or sniff_charset(prefix)
+            decoder = _make_decoder(encoding)
+            chunk, prefix = prefix, b''
+
+        parser.feed(decoder.decode(chunk))
+        if parser.done or bytes_read >= max_bytes:
+            break
+
+    if decoder is None:
+        encoding = encoding or sniff_charset(prefix)
+        decoder = _make_decoder(encoding)
+        parser.feed(decoder.decode(prefix))
+    truncated = not parser.done and bytes_read >= max_bytes
+    if not parser.done:
+        parser.feed(decoder.decode(b'', final=True))
+        parser.close()
+
+    metadata = dict(parser.metadata)
+    metadata['charset'] = metadata['charset'] or encoding or 'utf-8'
+    metadata['bytes_read'] = bytes_read
+    metadata['truncated'] = truncated
+    return metadata
+
+def _make_decoder(encoding):
+    try:
+        return codecs.getincrementaldecoder(encoding or 'utf-8')(errors='replace')
+    except LookupError:
+        return codecs.getincrementaldecoder('utf-8')(errors='replace')
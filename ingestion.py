@@ -0,0 +1,354 @@
+import logging
+import queue
+import threading
+import time
+from collections import deque
+import requests
+from requests.adapters import HTTPAdapter
+from head_metadata import extract_head_metadata
+from metadata_cache import get_metadata_cache
+from canonical import InvalidURL, canonical_key
+from url_index import get_url_index
+from thumbnails import get_thumbnail_cache
+from models import URL, MAX_URL_LENGTH, fit_metadata
+from metrics import histogram
+from config import (
+    INGEST_WORKERS, INGEST_QUEUE_SIZE, INGEST_BATCH_SIZE, INGEST_FLUSH_INTERVAL,
+    FETCH_CONNECT_TIMEOUT, FETCH_READ_TIMEOUT, FETCH_MAX_BYTES, FETCH_RETRIES, FETCH_BACKOFF
+)
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# Tries for a failed batch write, WRITE_RETRY_BACKOFF seconds apart and doubling, before
+# its rows are written one by one and the ones that still fail are dropped
+WRITE_ATTEMPTS = 4
+WRITE_RETRY_BACKOFF = 1.0
+
+FETCH_SECONDS = histogram('edvise_metadata_fetch_seconds', 'Page metadata lookups by outcome', ['outcome'])
+
+class MetadataFetcher:
+    """Fetch page <head> metadata over a shared keep-alive session with hard limits"""
+
+    def __init__(self, connect_timeout=FETCH_CONNECT_TIMEOUT, read_timeout=FETCH_READ_TIMEOUT,
+                 max_bytes=FETCH_MAX_BYTES, retries=FETCH_RETRIES, backoff=FETCH_BACKOFF,
+                 pool_size=INGEST_WORKERS, cache=None, use_cache=True):
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_bytes = max_bytes
+        self.chunk_size = 16384
+        self.retries = retries
+        self.backoff = backoff
+        self.cache = cache or (get_metadata_cache() if use_cache else None)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({'User-Agent': 'Edvise/1.0 (+https://github.com/codeesasi/Edvise)'})
+
+    def fetch(self, url):
+        """Return (title, thumbnail_url) sized for the url table, falling back to (url, None) on any failure"""
+        metadata = self.fetch_metadata(url)
+        if metadata is None:
+            return fit_metadata(url, None)
+        return fit_metadata(metadata['title'] or metadata['og_title'] or url, metadata['og_image'])
+
+    def fetch_metadata(self, url):
+        """Stream just enough of the page to read its <head> fields; None on failure.
+
+        Fresh cache entries are returned without a request; stale ones are
+        revalidated with If-None-Match/If-Modified-Since so an unchanged page
+        costs a 304 instead of a download and parse.
+        """
+        started = time.perf_counter()
+        metadata, outcome = self._fetch_metadata(url)
+        FETCH_SECONDS.observe(time.perf_counter() - started, outcome=outcome)
+        return metadata
+
+    def _fetch_metadata(self, url):
+        """(metadata or None, outcome) where outcome is cached, not_modified, fetched or failed"""
+        entry = self.cache.lookup(url) if self.cache else None
+        if entry is not None and entry.is_fresh():
+            return self._metadata_from_entry(url, entry), 'cached'
+        headers = entry.conditional_headers() if entry is not None else {}
+
+        for attempt in range(self.retries + 1):
+            try:
+                with self.session.get(url, headers=headers, timeout=self.timeout, stream=True) as response:
+                    if response.status_code in RETRY_STATUS_CODES and attempt < self.retries:
+                        raise requests.HTTPError(f"Retryable status {response.status_code}")
+                    if response.status_code == 304 and entry is not None:
+                        self.cache.revalidated(entry, response.headers)
+                        return self._metadata_from_entry(url, entry), 'not_modified'
+                    if response.status_code >= 400:
+                        # An error page's title is not the link's title
+                        logger.warning(f"Giving up fetching metadata for {url}: HTTP {response.status_code}")
+                        return None, 'failed'
+                    metadata = extract_head_metadata(
+                        response.iter_content(chunk_size=self.chunk_size),
+                        self.max_bytes,
+                        base_url=response.url,
+                        encoding=_declared_encoding(response)
+                    )
+                    if self.cache and response.status_code == 200:
+                        self.cache.put(url, metadata=metadata, headers=response.headers)
+                    return metadata, 'fetched'
+            except (requests.ConnectionError, requests.Timeout, requests.HTTPError) as e:
+                if attempt >= self.retries:
+                    logger.warning(f"Giving up fetching metadata for {url}: {e}")
+                    break
+                time.sleep(self.backoff * (2 ** attempt))
+            except Exception as e:
+                logger.warning(f"Failed to fetch metadata for {url}: {e}")
+                break
+        return None, 'failed'
+
+    def _metadata_from_entry(self, url, entry):
+        if entry.metadata is None and entry.body is not None:
+            # Only a crawl has stored this page so far; read the head from its body
+            entry.metadata = extract_head_metadata([entry.body], self.max_bytes, base_url=url)
+        return entry.metadata
+
+def _declared_encoding(response):
+    """Charset from the Content-Type header, ignoring requests' ISO-8859-1 default for text/*"""
+    if 'charset=' in response.headers.get('Content-Type', '').lower():
+        return response.encoding
+    return None
+
+class IngestionPipeline:
+    """Detect -> fetch -> store pipeline: bounded fetch workers feeding a batching DB writer"""
+
+    def __init__(self, fetcher=None, workers=INGEST_WORKERS, queue_size=INGEST_QUEUE_SIZE,
+                 batch_size=INGEST_BATCH_SIZE, flush_interval=INGEST_FLUSH_INTERVAL,
+                 writer=URL.add_many, exists=URL.find_by_url, index=None, thumbnails=None):
+        self.fetcher = fetcher or MetadataFetcher(pool_size=workers)
+        self.workers = workers
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._write_rows = writer
+        self._exists = exists
+        self.index = index
+        self.thumbnails = thumbnails
+        self._pending = queue.Queue(maxsize=queue_size)
+        self._results = queue.Queue()
+        self._queued = set()  # canonical hashes queued or in flight, so repeats aren't fetched twice
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+        self._in_flight = 0
+        self._latencies = deque(maxlen=1000)
+        self._stats = {
+            'submitted': 0,
+            'rejected': 0,
+            'invalid': 0,
+            'known': 0,
+            'skipped_existing': 0,
+            'fetched': 0,
+            'written': 0,
+            'batches': 0,
+            'write_errors': 0,
+            'write_failed': 0,
+        }
+
+    def start(self):
+        """Start fetch workers and the batch writer; calling it again is a no-op"""
+        with self._lock:
+            if self._threads:
+                return
+            self._stop.clear()
+            for i in range(self.workers):
+                self._threads.append(threading.Thread(target=self._fetch_loop, name=f'ingest-fetch-{i}', daemon=True))
+            self._threads.append(threading.Thread(target=self._write_loop, name='ingest-writer', daemon=True))
+            for thread in self._threads:
+                thread.start()
+
+    def stop(self, timeout=10):
+        """Let queued work drain, then stop all threads"""
+        deadline = time.monotonic() + timeout
+        while (self._queued or not self._results.empty()) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout=max(0, deadline - time.monotonic()) + 1)
+        self._threads = []
+
+    def submit(self, url):
+        """Queue a URL for ingestion without blocking; returns False if it was not accepted"""
+        return bool(self.submit_many([url]))
+
+    def submit_many(self, urls):
+        """Queue several URLs under one lock acquisition; returns the ones accepted"""
+        candidates = []
+        known = 0
+        invalid = 0
+        for url in urls:
+            if len(url) > MAX_URL_LENGTH:
+                invalid += 1
+                logger.warning(f"Not ingesting a {len(url)}-character URL, over the {MAX_URL_LENGTH} the url table holds")
+                continue
+            try:
+                key = canonical_key(url)[1]
+            except InvalidURL as e:
+                invalid += 1
+                logger.warning(f"Not ingesting {e}")
+                continue
+            if self.index is not None and self.index.contains(url):
+                # Already stored; rejected without touching Postgres
+                known += 1
+                continue
+            candidates.append((url, key))
+        accepted = []
+        with self._lock:
+            self._stats['known'] += known
+            self._stats['invalid'] += invalid
+            for url, key in candidates:
+                if key in self._queued:
+                    continue
+                try:
+                    self._pending.put_nowait(url)
+                except queue.Full:
+                    self._stats['rejected'] += 1
+                    logger.warning(f"Ingestion queue full, dropping {url}")
+                    continue
+                self._queued.add(key)
+                self._stats['submitted'] += 1
+                accepted.append(url)
+        return accepted
+
+    def stats(self):
+        """Queue depth, in-flight count, throughput counters and fetch latency percentiles"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['in_flight'] = self._in_flight
+            latencies = sorted(self._latencies)
+        stats['queue_depth'] = self._pending.qsize()
+        stats['write_backlog'] = self._results.qsize()
+        stats['fetch_latency'] = {
+            'count': len(latencies),
+            'p50': _percentile(latencies, 50),
+            'p95': _percentile(latencies, 95),
+            'max': latencies[-1] if latencies else 0.0,
+        }
+        return stats
+
+    def _fetch_loop(self):
+        while not self._stop.is_set():
+            try:
+                url = self._pending.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            with self._lock:
+                self._in_flight += 1
+            try:
+                if self._exists(url):
+                    if self.index is not None:
+                        self.index.add(url)
+                    with self._lock:
+                        self._stats['skipped_existing'] += 1
+                    continue
+                started = time.monotonic()
+                title, thumbnail = self.fetcher.fetch(url)
+                elapsed = time.monotonic() - started
+                with self._lock:
+                    self._latencies.append(elapsed)
+                    self._stats['fetched'] += 1
+                self._results.put((url, title, thumbnail))
+            except Exception as e:
+                logger.error(f"Error ingesting {url}: {e}")
+            finally:
+                with self._lock:
+                    self._in_flight -= 1
+                    self._queued.discard(canonical_key(url)[1])
+
+    def _write_loop(self):
+        batch = []
+        retry = None  # a batch whose write failed, waiting out its backoff
+        attempts = 0
+        deadline = time.monotonic() + self.flush_interval
+        while not (self._stop.is_set() and self._results.empty() and not batch and retry is None):
+            try:
+                batch.append(self._results.get(timeout=max(0.01, min(0.5, deadline - time.monotonic()))))
+            except queue.Empty:
+                pass
+            if retry is not None:
+                # New rows wait too, so an outage isn't hammered with writes
+                if time.monotonic() < deadline and not self._stop.is_set():
+                    continue
+                attempts += 1
+                if self._flush(retry):
+                    retry = None
+                elif attempts >= WRITE_ATTEMPTS or self._stop.is_set():
+                    # Still failing: row by row, so only rows that can't be stored are lost
+                    self._flush_rows(retry)
+                    retry = None
+                else:
+                    deadline = time.monotonic() + WRITE_RETRY_BACKOFF * 2 ** (attempts - 1)
+                    continue
+            if batch and (len(batch) >= self.batch_size or time.monotonic() >= deadline or self._stop.is_set()):
+                if not self._flush(batch):
+                    retry, attempts = batch, 1
+                    deadline = time.monotonic() + WRITE_RETRY_BACKOFF
+                batch = []
+            if time.monotonic() >= deadline and retry is None:
+                deadline = time.monotonic() + self.flush_interval
+
+    def _flush(self, batch):
+        """Write a batch; False if it failed and should be retried"""
+        try:
+            self._write(batch)
+            return True
+        except Exception as e:
+            with self._lock:
+                self._stats['write_errors'] += 1
+            logger.error(f"Error writing batch of {len(batch)} URLs: {e}")
+            return False
+
+    def _flush_rows(self, rows):
+        """Write rows one at a time after their batch kept failing, dropping the ones that still fail"""
+        for row in rows:
+            try:
+                self._write([row])
+            except Exception as e:
+                with self._lock:
+                    self._stats['write_failed'] += 1
+                logger.error(f"Dropping ingested URL {row[0]}, which could not be written: {e}")
+
+    def _write(self, batch):
+        inserted = self._write_rows(batch)
+        if self.index is not None:
+            for url, _, _ in batch:
+                self.index.add(url)
+        if self.thumbnails is not None:
+            self.thumbnails.prefetch(thumbnail for _, _, thumbnail in batch)
+        with self._lock:
+            self._stats['written'] += inserted
+            self._stats['batches'] += 1
+        for url, _, _ in batch:
+            logger.info(f"Ingested URL: {url}")
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+def get_ingestion_pipeline():
+    """Return the process-wide ingestion pipeline, starting it on first use"""
+    global _pipeline
+    if _pipeline is None:
+        with _pipeline_lock:
+            if _pipeline is None:
+                _pipeline = IngestionPipeline(index=get_url_index(), thumbnails=get_thumbnail_cache())
+                _pipeline.start()
+    return _pipeline
+
+_fetcher = None
+
+def get_metadata_fetcher():
+    """Shared fetcher for one-off metadata lookups outside the pipeline"""
+    global _fetcher
+    if _fetcher is None:
+        _fetcher = MetadataFetcher()
+    return _fetcher
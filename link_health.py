@@ -0,0 +1,354 @@
+import argparse
+import asyncio
+import itertools
+import logging
+import sys
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit
+from urllib.robotparser import RobotFileParser
+import aiohttp
+from models import URL, LINK_STATUSES
+from metrics import counter, histogram
+from config import (
+    LINK_CHECK_CONCURRENCY, LINK_CHECK_PER_HOST, LINK_CHECK_HOST_DELAY, LINK_CHECK_TIMEOUT,
+    LINK_CHECK_MAX_AGE, LINK_CHECK_RETRY_AGE, LINK_CHECK_BATCH_SIZE, LINK_CHECK_INTERVAL,
+    FETCH_CONNECT_TIMEOUT
+)
+
+logger = logging.getLogger(__name__)
+
+USER_AGENT = 'Edvise/1.0 (+https://github.com/codeesasi/Edvise)'
+# Name matched against robots.txt User-agent lines
+ROBOTS_AGENT = 'Edvise'
+ROBOTS_MAX_BYTES = 512 * 1024
+# robots.txt Crawl-delay is honoured up to this many seconds
+MAX_HOST_DELAY = 10
+MAX_REDIRECTS = 10
+# HEAD answers trusted as is; other errors may be a server mishandling HEAD, so GET decides
+DEFINITE_HEAD_STATUSES = frozenset([404, 410])
+# Results written per database round trip
+WRITE_BATCH_SIZE = 200
+
+LINK_CHECKS = counter('edvise_link_checks_total', 'Link-health checks by outcome', ['status'])
+LINK_CHECK_SECONDS = histogram('edvise_link_check_seconds', 'Time per link-health check, politeness waits included')
+
+def classify(status, redirected):
+    """Link status for the final HTTP status of a check"""
+    if status < 400:
+        return 'redirected' if redirected else 'ok'
+    if status == 429 or status >= 500:
+        return 'unavailable'
+    return 'broken'
+
+def interleave_by_host(rows):
+    """Rows reordered round-robin by host, so no single host holds up the workers"""
+    by_host = defaultdict(list)
+    for row in rows:
+        by_host[urlsplit(row['url']).netloc.lower()].append(row)
+    return [row for group in itertools.zip_longest(*by_host.values()) for row in group if row is not None]
+
+class _Host:
+    """Politeness state for one origin: request slots, spacing between requests, robots.txt rules"""
+    __slots__ = ('origin', 'slots', 'delay', 'next_start', 'robots', 'robots_lock')
+
+    def __init__(self, origin, per_host, delay):
+        self.origin = origin
+        self.slots = asyncio.Semaphore(per_host)
+        self.delay = delay
+        self.next_start = 0.0
+        self.robots = None
+        self.robots_lock = asyncio.Lock()
+
+    async def turn(self):
+        """Wait until this host may be sent another request"""
+        now = time.monotonic()
+        start = max(now, self.next_start)
+        self.next_start = start + self.delay
+        if start > now:
+            await asyncio.sleep(start - now)
+
+class LinkHealthChecker:
+    """Sweeps saved URLs for dead links with concurrent async HTTP.
+
+    Each sweep walks the stale rows of tbl_urlmanagement in id order and
+    checks them from concurrency worker tasks over one aiohttp session:
+    HEAD first, then GET when the HEAD answer may just be a server that
+    mishandles HEAD. Each host gets at most per_host requests at a time,
+    started host_delay seconds apart (or its robots.txt Crawl-delay), and
+    paths its robots.txt disallows are recorded as 'disallowed' rather than
+    fetched. Results go to tbl_linkhealth in batches; fresh checks are
+    skipped, so later sweeps only revisit links whose check has gone stale.
+    """
+
+    def __init__(self, concurrency=LINK_CHECK_CONCURRENCY, per_host=LINK_CHECK_PER_HOST,
+                 host_delay=LINK_CHECK_HOST_DELAY, timeout=LINK_CHECK_TIMEOUT, max_age=LINK_CHECK_MAX_AGE,
+                 retry_age=LINK_CHECK_RETRY_AGE, batch_size=LINK_CHECK_BATCH_SIZE,
+                 interval=LINK_CHECK_INTERVAL, respect_robots=True):
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.host_delay = host_delay
+        self.timeout = timeout
+        self.max_age = max_age
+        self.retry_age = retry_age
+        self.batch_size = batch_size
+        self.interval = interval
+        self.respect_robots = respect_robots
+        self._lock = threading.Lock()
+        self._sweep_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = dict.fromkeys(LINK_STATUSES, 0)
+        self._stats.update({
+            'sweeps': 0,
+            'checked': 0,
+            'get_fallbacks': 0,
+            'robots_fetched': 0,
+            'write_errors': 0,
+            'sweeping': False,
+            'last_sweep_checked': 0,
+            'last_sweep_seconds': 0.0,
+            'last_sweep_finished': None,
+        })
+
+    def sweep(self, limit=None):
+        """Check every stale link (at most limit); the number checked, or None if a sweep is already running"""
+        if not self._sweep_lock.acquire(blocking=False):
+            return None
+        started = time.monotonic()
+        with self._lock:
+            self._stats['sweeping'] = True
+        try:
+            checked = asyncio.run(self._sweep(limit))
+        finally:
+            with self._lock:
+                self._stats['sweeping'] = False
+            self._sweep_lock.release()
+        elapsed = time.monotonic() - started
+        with self._lock:
+            self._stats['sweeps'] += 1
+            self._stats['last_sweep_checked'] = checked
+            self._stats['last_sweep_seconds'] = round(elapsed, 3)
+            self._stats['last_sweep_finished'] = time.time()
+        logger.info(f"Link-health sweep checked {checked} links in {elapsed:.1f}s")
+        return checked
+
+    def sweep_in_background(self):
+        """Start a sweep on its own thread; False if one is already running"""
+        if self._sweep_lock.locked():
+            return False
+        threading.Thread(target=self._sweep_quietly, name='link-health-sweep', daemon=True).start()
+        return True
+
+    def start(self):
+        """Sweep every interval seconds on a background thread"""
+        with self._lock:
+            if self._thread is not None or not self.interval:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='link-health', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=30):
+        """Stop scheduling sweeps; a running sweep finishes the links already queued"""
+        self._stop.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout=timeout)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._sweep_quietly()
+            self._stop.wait(self.interval)
+
+    def _sweep_quietly(self):
+        try:
+            self.sweep()
+        except Exception as e:
+            logger.error(f"Link-health sweep failed: {e}")
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self._stats[key] += amount
+
+    async def _sweep(self, limit):
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=self.batch_size)
+        hosts = {}
+        results = []
+        # One write at a time, so checked_at grows in commit order and
+        # URL.link_health_version() moves with every batch
+        writing = asyncio.Lock()
+        checked = 0
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.per_host, ttl_dns_cache=300)
+        timeout = aiohttp.ClientTimeout(total=self.timeout, sock_connect=FETCH_CONNECT_TIMEOUT)
+
+        async def flush():
+            batch = results[:]
+            del results[:]
+            if not batch:
+                return
+            try:
+                async with writing:
+                    await loop.run_in_executor(None, URL.record_link_health, batch)
+            except Exception as e:
+                # Those links stay stale and are checked again next sweep
+                logger.error(f"Could not record {len(batch)} link-health results: {e}")
+                self._count('write_errors', len(batch))
+
+        async def work(session):
+            nonlocal checked
+            while True:
+                row = await queue.get()
+                if row is None:
+                    return
+                started = time.monotonic()
+                try:
+                    result = await self.check(session, hosts, row['url'])
+                except Exception as e:
+                    logger.error(f"Link-health check of {row['url']} failed: {e}")
+                    continue
+                LINK_CHECK_SECONDS.observe(time.monotonic() - started)
+                LINK_CHECKS.inc(status=result[0])
+                with self._lock:
+                    self._stats['checked'] += 1
+                    self._stats[result[0]] += 1
+                checked += 1
+                results.append((row['id'],) + result)
+                if len(results) >= WRITE_BATCH_SIZE:
+                    await flush()
+
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                         headers={'User-Agent': USER_AGENT}) as session:
+            workers = [asyncio.ensure_future(work(session)) for _ in range(self.concurrency)]
+            try:
+                queued = 0
+                after_id = 0
+                while not self._stop.is_set() and (limit is None or queued < limit):
+                    size = self.batch_size if limit is None else min(self.batch_size, limit - queued)
+                    rows = await loop.run_in_executor(
+                        None, URL.get_stale_links, after_id, size, self.max_age, self.retry_age
+                    )
+                    if not rows:
+                        break
+                    after_id = rows[-1]['id']
+                    for row in interleave_by_host(rows):
+                        await queue.put(row)
+                    queued += len(rows)
+                    if len(rows) < size:
+                        break
+            finally:
+                for _ in workers:
+                    await queue.put(None)
+                await asyncio.gather(*workers)
+                await flush()
+        return checked
+
+    async def check(self, session, hosts, url):
+        """(link_status, http_status, final_url, error) for one URL"""
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            return 'broken', None, None, 'not an http(s) URL'
+        origin = f'{parts.scheme}://{parts.netloc.lower()}'
+        host = hosts.get(origin)
+        if host is None:
+            host = hosts[origin] = _Host(origin, self.per_host, self.host_delay)
+        try:
+            if self.respect_robots and not await self._allowed(session, host, url):
+                return 'disallowed', None, None, 'disallowed by robots.txt'
+            async with host.slots:
+                await host.turn()
+                status, final_url, redirected = await self._request(session, 'HEAD', url)
+                if status >= 400 and status not in DEFINITE_HEAD_STATUSES:
+                    self._count('get_fallbacks')
+                    await host.turn()
+                    status, final_url, redirected = await self._request(session, 'GET', url)
+        except aiohttp.InvalidURL as e:
+            return 'broken', None, None, f'invalid URL: {e}'
+        except aiohttp.TooManyRedirects:
+            return 'broken', None, None, 'too many redirects'
+        except asyncio.TimeoutError:
+            return 'unavailable', None, None, 'timed out'
+        except aiohttp.ClientError as e:
+            return 'unavailable', None, None, (str(e) or type(e).__name__)[:500]
+        return classify(status, redirected), status, final_url if redirected else None, None
+
+    async def _request(self, session, method, url):
+        # The body is never read; leaving the block closes the connection if a GET sent one
+        async with session.request(method, url, allow_redirects=True, max_redirects=MAX_REDIRECTS) as response:
+            return response.status, str(response.url), bool(response.history)
+
+    async def _allowed(self, session, host, url):
+        if host.robots is None:
+            async with host.robots_lock:
+                if host.robots is None:
+                    async with host.slots:
+                        await host.turn()
+                        host.robots = await self._fetch_robots(session, host.origin)
+                    crawl_delay = host.robots.crawl_delay(ROBOTS_AGENT)
+                    if crawl_delay and float(crawl_delay) > host.delay:
+                        # Also space the first link check from the robots.txt fetch
+                        host.next_start += min(float(crawl_delay), MAX_HOST_DELAY) - host.delay
+                        host.delay = min(float(crawl_delay), MAX_HOST_DELAY)
+        return host.robots.can_fetch(ROBOTS_AGENT, url)
+
+    async def _fetch_robots(self, session, origin):
+        parser = RobotFileParser(f'{origin}/robots.txt')
+        try:
+            async with session.get(parser.url, allow_redirects=True, max_redirects=MAX_REDIRECTS) as response:
+                if response.status in (401, 403):
+                    parser.disallow_all = True
+                elif response.status >= 400:
+                    parser.allow_all = True
+                else:
+                    text = (await response.content.read(ROBOTS_MAX_BYTES)).decode('utf-8', 'replace')
+                    parser.parse(text.splitlines())
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            # No usable robots.txt; the link check itself reports an unreachable host
+            parser.allow_all = True
+        parser.modified()
+        self._count('robots_fetched')
+        return parser
+
+_checker = None
+_checker_lock = threading.Lock()
+
+def get_link_checker():
+    """Return the process-wide link-health checker"""
+    global _checker
+    if _checker is None:
+        with _checker_lock:
+            if _checker is None:
+                _checker = LinkHealthChecker()
+    return _checker
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check saved URLs for dead links')
+    parser.add_argument('--once', action='store_true', help='run one sweep and exit instead of sweeping every interval')
+    parser.add_argument('--limit', type=int, help='check at most this many links per sweep')
+    parser.add_argument('--max-age', type=float, default=LINK_CHECK_MAX_AGE,
+                        help='seconds before a check is stale (0 rechecks everything)')
+    parser.add_argument('--concurrency', type=int, default=LINK_CHECK_CONCURRENCY)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(format='%(asctime)s [%(levelname)s] %(message)s', level=logging.INFO)
+    URL.create_table()
+    checker = LinkHealthChecker(concurrency=args.concurrency, max_age=args.max_age,
+                                retry_age=min(args.max_age, LINK_CHECK_RETRY_AGE))
+    try:
+        while True:
+            checker.sweep(args.limit)
+            print(URL.link_health_summary())
+            if args.once:
+                return 0
+            time.sleep(checker.interval or LINK_CHECK_MAX_AGE)
+    except KeyboardInterrupt:
+        return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
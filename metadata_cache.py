@@ -0,0 +1,301 @@
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from canonical import InvalidURL, canonicalize_url
+from config import METADATA_CACHE_PATH, METADATA_CACHE_MAX_ENTRIES, METADATA_CACHE_TTL
+
+logger = logging.getLogger(__name__)
+
+# Entries kept in the in-memory LRU in front of the on-disk store
+MEMORY_ENTRIES = 1024
+# Response bodies bigger than this are not stored, only their metadata
+MAX_BODY_BYTES = 5 * 1024 * 1024
+# Minimum seconds between persisting an entry's LRU access time
+ACCESS_WRITE_INTERVAL = 60
+
+_MAX_AGE = re.compile(r'max-age\s*=\s*(\d+)', re.IGNORECASE)
+
+def cache_key(url):
+    """Cache entries are keyed by canonical URL, so tracking-parameter variants share one entry"""
+    try:
+        return canonicalize_url(url)
+    except InvalidURL:
+        return url.strip()
+
+class CacheEntry:
+    __slots__ = ('key', 'metadata', 'body', 'content_type', 'final_url', 'etag', 'last_modified',
+                 'fetched_at', 'expires_at', 'accessed_at')
+
+    def __init__(self, key, metadata=None, body=None, etag=None, last_modified=None,
+                 fetched_at=0.0, expires_at=0.0, content_type=None, final_url=None):
+        self.key = key
+        self.metadata = metadata
+        self.body = body
+        # How to decode body, and where the request for it ended up after redirects
+        self.content_type = content_type
+        self.final_url = final_url
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched_at = fetched_at
+        self.expires_at = expires_at
+        self.accessed_at = time.time()
+
+    def is_fresh(self, now=None):
+        return (now or time.time()) < self.expires_at
+
+    def conditional_headers(self):
+        """Validators to send so an unchanged page comes back as 304"""
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+class MetadataCache:
+    """Size-bounded LRU cache of page metadata and bodies, persisted in SQLite.
+
+    The SQLite file is shared between the web app, the clipboard monitor and
+    Scrapy crawls, so a page fetched by one is revalidated, not refetched, by
+    the others. Hit/miss/revalidation counters are per process.
+    """
+
+    def __init__(self, path=METADATA_CACHE_PATH, max_entries=METADATA_CACHE_MAX_ENTRIES,
+                 ttl=METADATA_CACHE_TTL, memory_entries=MEMORY_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'stale': 0,
+            'revalidations': 0,
+            'stores': 0,
+            'evictions': 0,
+        }
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                metadata TEXT,
+                body BLOB,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                content_type TEXT,
+                final_url TEXT
+            )
+        """)
+        # Cache files written before bodies kept their Content-Type and final URL
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(entries)")}
+        for column in ('content_type', 'final_url'):
+            if column not in columns:
+                self._db.execute(f"ALTER TABLE entries ADD COLUMN {column} TEXT")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_entries_last_access ON entries (last_access)")
+        self._db.commit()
+
+    def lookup(self, url):
+        """Return the cached entry for url (fresh or stale) and count the outcome"""
+        entry = self.get(url)
+        with self._lock:
+            if entry is None:
+                self._stats['misses'] += 1
+            elif entry.is_fresh():
+                self._stats['hits'] += 1
+            else:
+                self._stats['stale'] += 1
+        return entry
+
+    def get(self, url):
+        key = cache_key(url)
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                if now - entry.accessed_at > ACCESS_WRITE_INTERVAL:
+                    entry.accessed_at = now
+                    self._db.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+                    self._db.commit()
+                return entry
+            row = self._db.execute(
+                "SELECT metadata, body, etag, last_modified, fetched_at, expires_at, content_type, final_url "
+                "FROM entries WHERE key = ?",
+                (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            metadata, body, etag, last_modified, fetched_at, expires_at, content_type, final_url = row
+            entry = CacheEntry(
+                key,
+                metadata=json.loads(metadata) if metadata else None,
+                body=zlib.decompress(body) if body else None,
+                etag=etag,
+                last_modified=last_modified,
+                fetched_at=fetched_at,
+                expires_at=expires_at,
+                content_type=content_type,
+                final_url=final_url
+            )
+            self._remember(entry)
+            return entry
+
+    def put(self, url, metadata=None, body=None, headers=None, final_url=None):
+        """Store a fresh 200 response; headers supply validators, Cache-Control and the body's Content-Type"""
+        headers = headers or {}
+        cache_control = headers.get('Cache-Control', '') or ''
+        if 'no-store' in cache_control.lower():
+            return None
+        if body is not None and len(body) > MAX_BODY_BYTES:
+            body = None
+        now = time.time()
+        entry = CacheEntry(
+            cache_key(url),
+            metadata=metadata,
+            body=body,
+            etag=headers.get('ETag'),
+            last_modified=headers.get('Last-Modified'),
+            fetched_at=now,
+            expires_at=now + self._fresh_for(cache_control),
+            content_type=headers.get('Content-Type') if body is not None else None,
+            final_url=final_url if body is not None else None
+        )
+        with self._lock:
+            if entry.body is None and entry.metadata is None:
+                return None
+            existing = self._memory.get(entry.key)
+            if existing is not None and (existing.etag, existing.last_modified) == (entry.etag, entry.last_modified):
+                # Metadata and body may be stored by different callers for the
+                # same page; keep the other half only if it is the same version
+                entry.metadata = entry.metadata if entry.metadata is not None else existing.metadata
+                if entry.body is None:
+                    entry.body, entry.content_type, entry.final_url = (
+                        existing.body, existing.content_type, existing.final_url
+                    )
+            self._db.execute("""
+                INSERT INTO entries (key, metadata, body, etag, last_modified, fetched_at, expires_at, last_access,
+                                     content_type, final_url)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET
+                    metadata = CASE
+                        WHEN excluded.metadata IS NOT NULL THEN excluded.metadata
+                        WHEN entries.etag IS excluded.etag AND entries.last_modified IS excluded.last_modified
+                        THEN entries.metadata END,
+                    body = CASE
+                        WHEN excluded.body IS NOT NULL THEN excluded.body
+                        WHEN entries.etag IS excluded.etag AND entries.last_modified IS excluded.last_modified
+                        THEN entries.body END,
+                    content_type = CASE
+                        WHEN excluded.body IS NOT NULL THEN excluded.content_type
+                        WHEN entries.etag IS excluded.etag AND entries.last_modified IS excluded.last_modified
+                        THEN entries.content_type END,
+                    final_url = CASE
+                        WHEN excluded.body IS NOT NULL THEN excluded.final_url
+                        WHEN entries.etag IS excluded.etag AND entries.last_modified IS excluded.last_modified
+                        THEN entries.final_url END,
+                    etag = excluded.etag,
+                    last_modified = excluded.last_modified,
+                    fetched_at = excluded.fetched_at,
+                    expires_at = excluded.expires_at,
+                    last_access = excluded.last_access
+            """, (
+                entry.key,
+                json.dumps(entry.metadata) if entry.metadata is not None else None,
+                zlib.compress(entry.body) if entry.body is not None else None,
+                entry.etag,
+                entry.last_modified,
+                entry.fetched_at,
+                entry.expires_at,
+                now,
+                entry.content_type,
+                entry.final_url
+            ))
+            self._db.commit()
+            self._memory.pop(entry.key, None)
+            self._remember(entry)
+            self._stats['stores'] += 1
+            self._evict()
+        return entry
+
+    def revalidated(self, entry, headers=None):
+        """Record a 304 for entry: the stored copy is good for another freshness period"""
+        cache_control = (headers or {}).get('Cache-Control', '') or ''
+        now = time.time()
+        entry.fetched_at = now
+        entry.expires_at = now + self._fresh_for(cache_control)
+        with self._lock:
+            self._db.execute(
+                "UPDATE entries SET fetched_at = ?, expires_at = ?, last_access = ? WHERE key = ?",
+                (entry.fetched_at, entry.expires_at, now, entry.key)
+            )
+            self._db.commit()
+            self._stats['revalidations'] += 1
+        return entry
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            stats['memory_entries'] = len(self._memory)
+        lookups = stats['hits'] + stats['misses'] + stats['stale']
+        stats['hit_ratio'] = (stats['hits'] + stats['revalidations']) / lookups if lookups else 0.0
+        return stats
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _fresh_for(self, cache_control):
+        match = _MAX_AGE.search(cache_control)
+        if match:
+            return min(int(match.group(1)), self.ttl)
+        return self.ttl
+
+    def _remember(self, entry):
+        self._memory[entry.key] = entry
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self):
+        count = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        excess = count - self.max_entries
+        if excess <= 0:
+            return
+        # Evict a little extra so eviction doesn't run on every insert
+        excess += max(1, self.max_entries // 20)
+        keys = [row[0] for row in self._db.execute(
+            "SELECT key FROM entries ORDER BY last_access LIMIT ?", (excess,)
+        )]
+        self._db.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key in keys])
+        self._db.commit()
+        for key in keys:
+            self._memory.pop(key, None)
+        self._stats['evictions'] += len(keys)
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_metadata_cache():
+    """Return the process-wide metadata cache, opening it on first use"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = MetadataCache()
+    return _cache
@@ -0,0 +1,219 @@
+import bisect
+import functools
+import http.server
+import inspect
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, from a cache hit to a slow remote fetch
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            lines.extend(self._samples(key, value))
+        return lines
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self, key, value):
+        yield f'{self.name}{_labels(self.labelnames, key)} {_number(value)}'
+
+class Histogram(_Metric):
+    """Cumulative-bucket latency histogram, rendered in Prometheus text format"""
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket counts (the last one is +Inf), sum, count
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self, key, value):
+        counts, total, count = value
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+            cumulative += bucket_count
+            yield f'{self.name}_bucket{_labels(self.labelnames, key, ("le", _number(bound)))} {cumulative}'
+        yield f'{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}'
+        yield f'{self.name}_count{_labels(self.labelnames, key)} {count}'
+
+class Registry:
+    """Metrics plus collectors that turn existing stats() snapshots into gauges at scrape time"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = {}
+        self._lock = threading.Lock()
+
+    def metric(self, cls, name, help, labelnames=(), **kwargs):
+        """Get or create a metric, so modules can declare theirs at import time"""
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, labelnames, **kwargs)
+            elif not isinstance(metric, cls) or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"Metric {name} is already registered differently")
+            return metric
+
+    def add_collector(self, prefix, stats):
+        """Export the numeric fields of stats() as gauges named <prefix>_<field>"""
+        with self._lock:
+            self._collectors[prefix] = stats
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors.items())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for prefix, stats in collectors:
+            try:
+                snapshot = stats()
+            except Exception as e:
+                logger.warning(f"Metrics collector {prefix} failed: {e}")
+                continue
+            for name, value in _flatten(prefix, snapshot):
+                lines.append(f'# TYPE {name} gauge')
+                lines.append(f'{name} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+def _flatten(prefix, stats):
+    for key, value in sorted(stats.items()):
+        name = f'{prefix}_{key}'.replace('-', '_').replace('.', '_')
+        if isinstance(value, dict):
+            yield from _flatten(name, value)
+        elif isinstance(value, bool):
+            yield name, int(value)
+        elif isinstance(value, (int, float)):
+            yield name, value
+
+REGISTRY = Registry()
+
+def counter(name, help, labelnames=()):
+    return REGISTRY.metric(Counter, name, help, labelnames)
+
+def histogram(name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.metric(Histogram, name, help, labelnames, buckets=buckets)
+
+def instrument_class(cls, seconds, errors):
+    """Time every static method of cls into seconds{method=...}, counting exceptions into errors"""
+    for name, attr in list(vars(cls).items()):
+        if isinstance(attr, staticmethod):
+            setattr(cls, name, staticmethod(_timed(attr.__func__, f'{cls.__name__}.{name}', seconds, errors)))
+    return cls
+
+def _timed(func, method, seconds, errors):
+    if inspect.isgeneratorfunction(func):
+        # Streaming queries are timed from the call until the caller stops iterating
+        @functools.wraps(func)
+        def generator(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                yield from func(*args, **kwargs)
+            except Exception:
+                errors.inc(method=method)
+                raise
+            finally:
+                seconds.observe(time.perf_counter() - started, method=method)
+        return generator
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            errors.inc(method=method)
+            raise
+        finally:
+            seconds.observe(time.perf_counter() - started, method=method)
+    return wrapper
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def serve(port, host='0.0.0.0'):
+    """Serve /metrics on its own port from a daemon thread, for processes without a web app"""
+    server = http.server.ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    logger.info(f"Serving metrics on http://{host}:{server.server_port}/metrics")
+    return server
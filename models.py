@@ -1,165 +1,1271 @@
 from datetime import datetime
+import base64
+import html
+import json
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
+from config import db_connection
+from canonical import InvalidURL, canonical_key, url_hash
+from metrics import counter, histogram, instrument_class
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Sort keys accepted by URL.get_page: (SQL expression, direction)
+URL_SORT_KEYS = {
+    'date_desc': ("um.created_date", 'DESC'),
+    'date_asc': ("um.created_date", 'ASC'),
+    'title': ("COALESCE(LOWER(um.title), '')", 'ASC'),
+}
+
+MAX_PAGE_SIZE = 100
+# Widths of the url table's url, title and thumbnail columns
+MAX_URL_LENGTH = 500
+MAX_TITLE_LENGTH = 200
+MAX_THUMBNAIL_LENGTH = 500
+
+# Text the trigram index covers; queries must repeat it exactly to use the index
+SEARCH_DOCUMENT = "(COALESCE(um.title, '') || ' ' || um.url)"
+# Columns URL.get_page can select for a dashboard row um, by name. The duplicate
+# subqueries (the page um duplicates and how many listed pages duplicate it) are
+# the costly ones, so list views that don't show them should project them away
+URL_FIELDS = {
+    'id': "um.id",
+    'url': "um.url",
+    'title': "um.title",
+    'thumbnail': "um.thumbnail",
+    'created_date': "um.created_date",
+    'visit': "mv.visit",
+    'duplicate_of': "(SELECT c.duplicate_of FROM tbl_urlcontent c WHERE c.url = um.url)",
+    'duplicate_count': """(SELECT count(*) FROM tbl_urlcontent d
+        JOIN tbl_urlmanagement du ON du.url = d.url AND du.enable = 1
+        WHERE d.duplicate_of = um.url)""",
+    'link_status': "(SELECT h.link_status FROM tbl_linkhealth h WHERE h.url_id = um.id)",
+    'http_status': "(SELECT h.http_status FROM tbl_linkhealth h WHERE h.url_id = um.id)",
+    'final_url': "(SELECT h.final_url FROM tbl_linkhealth h WHERE h.url_id = um.id)",
+    'link_checked_at': "(SELECT h.checked_at FROM tbl_linkhealth h WHERE h.url_id = um.id)",
+}
+# Outcomes of a link-health check; 'unchecked' filters for rows never checked
+LINK_STATUSES = ('ok', 'redirected', 'broken', 'unavailable', 'disallowed')
+# Rows whose content duplicates another listed row
+IS_LISTED_DUPLICATE = """EXISTS (
+    SELECT 1 FROM tbl_urlcontent c
+    JOIN tbl_urlmanagement cu ON cu.url = c.duplicate_of AND cu.enable = 1
+    WHERE c.url = um.url
+)"""
+# ts_headline markers, swapped for <mark> tags once the text is HTML-escaped
+HIGHLIGHT_START, HIGHLIGHT_STOP = '\x02', '\x03'
+HEADLINE_OPTIONS = f"StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_STOP}"
+
+# Postgres channel settings changes are announced on
+SETTINGS_CHANNEL = 'settings_changes'
+# NOTIFY payloads are capped at 8000 bytes by Postgres
+SETTINGS_NOTIFY_MAX_BYTES = 7000
+
+def encode_cursor(sort, value, id):
+    """Encode the last row of a page into an opaque keyset cursor"""
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    payload = json.dumps([sort, value, id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor, sort):
+    """Decode a keyset cursor, raising ValueError if it is malformed or was issued for another sort"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        cursor_sort, value, id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {e}")
+    if cursor_sort != sort:
+        raise ValueError("Cursor does not match the requested sort")
+    return value, int(id)
+
+def select_fields(fields):
+    """Validate a fields projection against URL_FIELDS, keeping its order and putting id first"""
+    if not fields:
+        return list(URL_FIELDS)
+    unknown = [field for field in fields if field not in URL_FIELDS]
+    if unknown:
+        raise ValueError(f"Unsupported fields: {', '.join(unknown)}")
+    return ['id'] + [field for field in dict.fromkeys(fields) if field != 'id']
+
+def like_pattern(search):
+    """Substring ILIKE pattern for search with its wildcard characters escaped"""
+    return '%' + search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+def highlight_html(text):
+    """HTML-escape a ts_headline result and turn its match markers into <mark> tags"""
+    if text is None:
+        return None
+    return (html.escape(text)
+            .replace(HIGHLIGHT_START, '<mark>')
+            .replace(HIGHLIGHT_STOP, '</mark>'))
+
+_trigram_available = None
+
+def trigram_available(conn):
+    """Whether pg_trgm is installed, checked once per process"""
+    global _trigram_available
+    if _trigram_available is None:
+        with conn.cursor() as cur:
+            cur.execute("SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')")
+            _trigram_available = cur.fetchone()[0]
+    return _trigram_available
+
+def fit_metadata(title, thumbnail):
+    """(title, thumbnail) that fit the url table: the title clipped, a thumbnail URL too long to store dropped"""
+    if title is not None and len(title) > MAX_TITLE_LENGTH:
+        title = title[:MAX_TITLE_LENGTH - 3].rstrip() + '...'
+    if thumbnail is not None and len(thumbnail) > MAX_THUMBNAIL_LENGTH:
+        thumbnail = None
+    return title, thumbnail
+
+def _stored_key(url):
+    """canonical_key for a stored row; one without a canonical form is keyed by itself"""
+    try:
+        return canonical_key(url)
+    except InvalidURL:
+        return url, url_hash(url)
+
 class URL:
     @staticmethod
-    def create_table(conn):
+    def create_table():
         """Create the URL table if it doesn't exist"""
-        try:
-            with conn.cursor() as cur:
-                # Create URLs table
-                cur.execute("""
-                    CREATE TABLE IF NOT EXISTS url (
-                        id SERIAL PRIMARY KEY,
-                        url VARCHAR(500) UNIQUE NOT NULL,
-                        title VARCHAR(200),
-                        thumbnail VARCHAR(500),
-                        visit INT DEFAULT 0,
-                        created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                """)
+        with db_connection() as conn:
+            try:
+                with conn.cursor() as cur:
+                    # Create URLs table
+                    cur.execute("""
+                        CREATE TABLE IF NOT EXISTS url (
+                            id SERIAL PRIMARY KEY,
+                            url VARCHAR(500) UNIQUE NOT NULL,
+                            title VARCHAR(200),
+                            thumbnail VARCHAR(500),
+                            visit INT DEFAULT 0,
+                            created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                        )
+                    """)
+
+                    # Canonical form for deduplication, looked up by its 64-bit hash
+                    cur.execute("""
+                        ALTER TABLE url
+                        ADD COLUMN IF NOT EXISTS canonical_url TEXT,
+                        ADD COLUMN IF NOT EXISTS url_hash BIGINT
+                    """)
+                    cur.execute("CREATE INDEX IF NOT EXISTS idx_url_url_hash ON url (url_hash)")
+
+                    # Crawl queue state for the batch crawl service
+                    cur.execute("""
+                        ALTER TABLE url
+                        ADD COLUMN IF NOT EXISTS crawl_status VARCHAR(16) NOT NULL DEFAULT 'pending',
+                        ADD COLUMN IF NOT EXISTS crawl_attempts INT NOT NULL DEFAULT 0,
+                        ADD COLUMN IF NOT EXISTS crawl_started_at TIMESTAMP,
+                        ADD COLUMN IF NOT EXISTS next_crawl_at TIMESTAMP,
+                        ADD COLUMN IF NOT EXISTS last_crawled_at TIMESTAMP,
+                        ADD COLUMN IF NOT EXISTS crawl_error TEXT
+                    """)
+                    # Incremental recrawl: last content fingerprint and validators,
+                    # plus the change history the recrawl scheduler learns from
+                    cur.execute("""
+                        ALTER TABLE url
+                        ADD COLUMN IF NOT EXISTS content_fingerprint VARCHAR(40),
+                        ADD COLUMN IF NOT EXISTS http_etag TEXT,
+                        ADD COLUMN IF NOT EXISTS http_last_modified TEXT,
+                        ADD COLUMN IF NOT EXISTS crawl_checks INT NOT NULL DEFAULT 0,
+                        ADD COLUMN IF NOT EXISTS crawl_changes INT NOT NULL DEFAULT 0,
+                        ADD COLUMN IF NOT EXISTS crawl_observed_seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+                        ADD COLUMN IF NOT EXISTS recrawl_interval DOUBLE PRECISION
+                    """)
+                    cur.execute("""
+                        CREATE INDEX IF NOT EXISTS idx_url_crawl_queue
+                        ON url (crawl_status, next_crawl_at, id)
+                    """)
                 
-                # Create settings table
-                cur.execute("""
-                    CREATE TABLE IF NOT EXISTS tbl_settings (
-                    Settings_id UUID DEFAULT gen_random_uuid(),
-                    refreshInterval INTEGER DEFAULT 30000 NOT NULL,
-                    itemsPerPage INTEGER DEFAULT 5 NOT NULL,
-                    UImode TEXT DEFAULT 'DARK',
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                );
-                """)
-            conn.commit()
-        except psycopg2.Error as e:
-            logger.error(f"Database error creating tables: {e}")
-            conn.rollback()
-            raise
-
-    @staticmethod
-    def add(conn, url, title, thumbnail):
+                    # Keyset pagination indexes for URL.get_page
+                    cur.execute("""
+                        CREATE INDEX IF NOT EXISTS idx_urlmanagement_created
+                        ON tbl_urlmanagement (created_date, id) WHERE enable = 1
+                    """)
+                    cur.execute("""
+                        CREATE INDEX IF NOT EXISTS idx_urlmanagement_title
+                        ON tbl_urlmanagement ((COALESCE(LOWER(title), '')), id) WHERE enable = 1
+                    """)
+                    cur.execute("""
+                        CREATE INDEX IF NOT EXISTS idx_maintainvisit_url_id
+                        ON tbl_maintainvisit (url_id)
+                    """)
+
+                    # Full-text search: title and URL words on the dashboard row,
+                    # extracted page text in tbl_urlcontent. Both tsvectors are
+                    # generated columns, so every write keeps the GIN indexes current.
+                    cur.execute("""
+                        ALTER TABLE tbl_urlmanagement
+                        ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+                            setweight(to_tsvector('english', COALESCE(title, '')), 'A') ||
+                            setweight(to_tsvector('simple', regexp_replace(COALESCE(url, ''), '[^[:alnum:]]+', ' ', 'g')), 'B')
+                        ) STORED
+                    """)
+                    cur.execute("""
+                        CREATE INDEX IF NOT EXISTS idx_urlmanagement_search
+                        ON tbl_urlmanagement USING GIN (search_vector) WHERE enable = 1
+                    """)
+                    cur.execute("CREATE INDEX IF NOT EXISTS idx_urlmanagement_url ON tbl_urlmanagement (url)")
+                    cur.execute("""
+                        CREATE TABLE IF NOT EXISTS tbl_urlcontent (
+                            url VARCHAR(500) PRIMARY KEY,
+                            meta_description TEXT,
+                            ai_ready_text TEXT,
+                            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                            search_vector tsvector GENERATED ALWAYS AS (
+                                setweight(to_tsvector('english', COALESCE(meta_description, '')), 'C') ||
+                                setweight(to_tsvector('english', COALESCE(ai_ready_text, '')), 'D')
+                            ) STORED
+                        )
+                    """)
+                    cur.execute("""
+                        CREATE INDEX IF NOT EXISTS idx_urlcontent_search
+                        ON tbl_urlcontent USING GIN (search_vector)
+                    """)
+                    # Near-duplicate pages point at the first page with the same content
+                    cur.execute("ALTER TABLE tbl_urlcontent ADD COLUMN IF NOT EXISTS duplicate_of VARCHAR(500)")
+                    cur.execute("""
+                        CREATE INDEX IF NOT EXISTS idx_urlcontent_duplicate_of
+                        ON tbl_urlcontent (duplicate_of) WHERE duplicate_of IS NOT NULL
+                    """)
+                    # Trigram index for partial and misspelled words; pg_trgm is a
+                    # contrib extension, so search falls back to ILIKE without it
+                    cur.execute("SAVEPOINT trigram")
+                    try:
+                        cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+                        cur.execute(f"""
+                            CREATE INDEX IF NOT EXISTS idx_urlmanagement_trgm
+                            ON tbl_urlmanagement USING GIN ({SEARCH_DOCUMENT.replace('um.', '')} gin_trgm_ops)
+                            WHERE enable = 1
+                        """)
+                        cur.execute("RELEASE SAVEPOINT trigram")
+                    except psycopg2.Error as e:
+                        logger.warning(f"pg_trgm unavailable, fuzzy search disabled: {e}")
+                        cur.execute("ROLLBACK TO SAVEPOINT trigram")
+
+                    # Change feed: every insert/update of a URL row (including soft
+                    # deletes and visit count changes) takes a new row_version.
+                    # Versions are drawn at write time, not commit time, so each
+                    # writing transaction holds a shared advisory lock keyed at the
+                    # sequence position it started from; see _feed_version
+                    cur.execute("CREATE SEQUENCE IF NOT EXISTS url_change_seq")
+                    cur.execute("""
+                        ALTER TABLE tbl_urlmanagement
+                        ADD COLUMN IF NOT EXISTS row_version BIGINT NOT NULL DEFAULT nextval('url_change_seq')
+                    """)
+                    cur.execute("""
+                        CREATE INDEX IF NOT EXISTS idx_urlmanagement_row_version
+                        ON tbl_urlmanagement (row_version)
+                    """)
+                    cur.execute("""
+                        CREATE OR REPLACE FUNCTION fn_url_bump_version() RETURNS trigger AS $$
+                        DECLARE
+                            position BIGINT;
+                        BEGIN
+                            IF current_setting('edvise.change_writer', true) IS DISTINCT FROM txid_current()::text THEN
+                                SELECT CASE WHEN is_called THEN last_value ELSE last_value - 1 END
+                                INTO position FROM url_change_seq;
+                                PERFORM pg_advisory_xact_lock_shared(position);
+                                PERFORM set_config('edvise.change_writer', txid_current()::text, true);
+                            END IF;
+                            NEW.row_version := nextval('url_change_seq');
+                            RETURN NEW;
+                        END;
+                        $$ LANGUAGE plpgsql
+                    """)
+                    cur.execute("""
+                        CREATE OR REPLACE FUNCTION fn_visit_bump_version() RETURNS trigger AS $$
+                        BEGIN
+                            UPDATE tbl_urlmanagement SET row_version = nextval('url_change_seq')
+                            WHERE id = NEW.url_id;
+                            RETURN NULL;
+                        END;
+                        $$ LANGUAGE plpgsql
+                    """)
+                    cur.execute("""
+                        CREATE OR REPLACE FUNCTION fn_url_notify_change() RETURNS trigger AS $$
+                        BEGIN
+                            PERFORM pg_notify('url_changes', '');
+                            RETURN NULL;
+                        END;
+                        $$ LANGUAGE plpgsql
+                    """)
+                    cur.execute("""
+                        DROP TRIGGER IF EXISTS trg_url_bump_version ON tbl_urlmanagement;
+                        CREATE TRIGGER trg_url_bump_version
+                        BEFORE INSERT OR UPDATE ON tbl_urlmanagement
+                        FOR EACH ROW EXECUTE FUNCTION fn_url_bump_version();
+
+                        DROP TRIGGER IF EXISTS trg_visit_bump_version ON tbl_maintainvisit;
+                        CREATE TRIGGER trg_visit_bump_version
+                        AFTER UPDATE OF visit ON tbl_maintainvisit
+                        FOR EACH ROW EXECUTE FUNCTION fn_visit_bump_version();
+
+                        DROP TRIGGER IF EXISTS trg_url_notify_change ON tbl_urlmanagement;
+                        CREATE TRIGGER trg_url_notify_change
+                        AFTER INSERT OR UPDATE ON tbl_urlmanagement
+                        FOR EACH STATEMENT EXECUTE FUNCTION fn_url_notify_change();
+                    """)
+
+                    # Link health, kept apart from tbl_urlmanagement so checks don't
+                    # bump row versions or wake the change feed
+                    cur.execute("""
+                        CREATE TABLE IF NOT EXISTS tbl_linkhealth (
+                            url_id INT PRIMARY KEY REFERENCES tbl_urlmanagement(id) ON DELETE CASCADE,
+                            link_status VARCHAR(16) NOT NULL,
+                            http_status INT,
+                            final_url TEXT,
+                            error TEXT,
+                            checked_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+                        )
+                    """)
+                    cur.execute("""
+                        CREATE INDEX IF NOT EXISTS idx_linkhealth_status
+                        ON tbl_linkhealth (link_status, url_id)
+                    """)
+                    cur.execute("CREATE INDEX IF NOT EXISTS idx_linkhealth_checked ON tbl_linkhealth (checked_at)")
+
+                    # Create settings table
+                    cur.execute("""
+                        CREATE TABLE IF NOT EXISTS tbl_settings (
+                        Settings_id UUID DEFAULT gen_random_uuid(),
+                        refreshInterval INTEGER DEFAULT 30000 NOT NULL,
+                        itemsPerPage INTEGER DEFAULT 5 NOT NULL,
+                        UImode TEXT DEFAULT 'DARK',
+                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    );
+                    """)
+                conn.commit()
+            except psycopg2.Error as e:
+                logger.error(f"Database error creating tables: {e}")
+                conn.rollback()
+                raise
+
+    @staticmethod
+    def add(url, title, thumbnail):
         """Add a new URL to the database"""
-        try:
-            with conn.cursor() as cur:
-                cur.execute(
-                    "INSERT INTO url (url, title, thumbnail) VALUES (%s, %s, %s)",
-                    (url, title, thumbnail)
-                )
-            conn.commit()
-        except psycopg2.Error as e:
-            logger.error(f"Database error adding URL: {e}")
-            conn.rollback()
-            raise
-
-    @staticmethod
-    def get_all(conn):
+        canonical, hashed = canonical_key(url)
+        with db_connection() as conn:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        "INSERT INTO url (url, title, thumbnail, canonical_url, url_hash) VALUES (%s, %s, %s, %s, %s)",
+                        (url, title, thumbnail, canonical, hashed)
+                    )
+                conn.commit()
+            except psycopg2.Error as e:
+                logger.error(f"Database error adding URL: {e}")
+                conn.rollback()
+                raise
+
+    @staticmethod
+    def add_many(rows, returning=False):
+        """Add (url, title, thumbnail) rows in one transaction, skipping URLs already stored.
+
+        Returns the number of rows inserted, or the inserted URLs when returning is set.
+        """
+        values = []
+        seen = set()
+        for url, title, thumbnail in rows:
+            try:
+                canonical, hashed = canonical_key(url)
+            except InvalidURL as e:
+                logger.warning(f"Skipping {e}")
+                continue
+            if hashed not in seen:
+                seen.add(hashed)
+                values.append((url, title, thumbnail, canonical, hashed))
+        if not values:
+            return [] if returning else 0
+        with db_connection() as conn:
+            try:
+                with conn.cursor() as cur:
+                    result = execute_values(
+                        cur,
+                        """
+                        INSERT INTO url (url, title, thumbnail, canonical_url, url_hash)
+                        SELECT v.url, v.title, v.thumbnail, v.canonical_url, v.url_hash
+                        FROM (VALUES %s) AS v (url, title, thumbnail, canonical_url, url_hash)
+                        WHERE NOT EXISTS (
+                            SELECT 1 FROM url u
+                            WHERE u.url_hash = v.url_hash AND u.canonical_url = v.canonical_url
+                        )
+                        ON CONFLICT (url) DO NOTHING
+                        """ + (" RETURNING url" if returning else ""),
+                        values,
+                        page_size=len(values),
+                        fetch=returning
+                    )
+                    inserted = [row[0] for row in result] if returning else cur.rowcount
+                conn.commit()
+                return inserted
+            except psycopg2.Error as e:
+                logger.error(f"Database error adding URLs: {e}")
+                conn.rollback()
+                raise
+
+    @staticmethod
+    def update_metadata_many(rows):
+        """Set title and thumbnail for (url, title, thumbnail) rows in a single UPDATE"""
+        if not rows:
+            return 0
+        with db_connection() as conn:
+            try:
+                with conn.cursor() as cur:
+                    execute_values(cur, """
+                        UPDATE url SET title = v.title, thumbnail = v.thumbnail
+                        FROM (VALUES %s) AS v(url, title, thumbnail)
+                        WHERE url.url = v.url
+                    """, rows, page_size=len(rows))
+                    rows_affected = cur.rowcount
+                conn.commit()
+                return rows_affected
+            except psycopg2.Error as e:
+                logger.error(f"Database error updating URL metadata: {e}")
+                conn.rollback()
+                raise
+
+    @staticmethod
+    def get_all():
         """Get all URLs from the database"""
-        try:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute("""
-                    select um.id,um.url,um.title,um.thumbnail,mv.visit from tbl_urlmanagement um 
-                    join tbl_maintainvisit mv ON um.id = mv.url_id 
-                    WHERE um.enable = 1 order by um.created_date DESC;
-                """)
-                return cur.fetchall()
-        except psycopg2.Error as e:
-            logger.error(f"Database error fetching URLs: {e}")
-            raise
-
-    @staticmethod
-    def find_by_url(conn, url):
-        """Find a URL by its address"""
-        try:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute("SELECT * FROM url WHERE url = %s", (url,))
-                return cur.fetchone()
-        except psycopg2.Error as e:
-            logger.error(f"Database error finding URL: {e}")
-            raise
-
-    @staticmethod
-    def delete(conn, id):
+        with db_connection() as conn:
+            try:
+                with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                    cur.execute("""
+                        select um.id,um.url,um.title,um.thumbnail,mv.visit from tbl_urlmanagement um 
+                        join tbl_maintainvisit mv ON um.id = mv.url_id 
+                        WHERE um.enable = 1 order by um.created_date DESC;
+                    """)
+                    return cur.fetchall()
+            except psycopg2.Error as e:
+                logger.error(f"Database error fetching URLs: {e}")
+                raise
+
+    @staticmethod
+    def get_page(search=None, sort='date_desc', date_from=None, date_to=None,
+                 page_size=20, cursor=None, group_duplicates=False, fields=None, link_status=None):
+        """Get one page of URLs filtered, sorted and paginated in SQL using a keyset cursor.
+
+        With group_duplicates, near-duplicates of another listed URL are left
+        out; each row's duplicate_count says how many it stands for. fields
+        limits the selected columns to those URL_FIELDS names; id is always
+        included, since it identifies rows and continues the cursor.
+        link_status keeps rows whose last health check had one of the given
+        LINK_STATUSES ('unchecked' for rows never checked).
+        """
+        if sort not in URL_SORT_KEYS:
+            raise ValueError(f"Unsupported sort key: {sort}")
+        fields = select_fields(fields)
+        page_size = max(1, min(int(page_size), MAX_PAGE_SIZE))
+        sort_expr, direction = URL_SORT_KEYS[sort]
+
+        where = ["um.enable = 1"]
+        params = []
+        if search:
+            # Same expression as the trigram index, so substring search can use it
+            where.append(f"{SEARCH_DOCUMENT} ILIKE %s")
+            params.append(like_pattern(search))
+        if date_from:
+            where.append("um.created_date >= %s")
+            params.append(date_from)
+        if date_to:
+            where.append("um.created_date <= %s")
+            params.append(date_to)
+        if group_duplicates:
+            where.append(f"NOT {IS_LISTED_DUPLICATE}")
+        if link_status:
+            unknown = set(link_status) - set(LINK_STATUSES) - {'unchecked'}
+            if unknown:
+                raise ValueError(f"Unsupported link status: {', '.join(sorted(unknown))}")
+            checked = [status for status in link_status if status != 'unchecked']
+            conditions = []
+            if checked:
+                conditions.append("EXISTS (SELECT 1 FROM tbl_linkhealth h WHERE h.url_id = um.id AND h.link_status = ANY(%s))")
+                params.append(checked)
+            if 'unchecked' in link_status:
+                conditions.append("NOT EXISTS (SELECT 1 FROM tbl_linkhealth h WHERE h.url_id = um.id)")
+            where.append(f"({' OR '.join(conditions)})")
+
+        page_where = list(where)
+        page_params = list(params)
+        if cursor:
+            value, last_id = decode_cursor(cursor, sort)
+            comparison = '<' if direction == 'DESC' else '>'
+            cast = '::timestamp' if sort.startswith('date') else ''
+            page_where.append(f"({sort_expr}, um.id) {comparison} (%s{cast}, %s)")
+            page_params.extend([value, last_id])
+
+        with db_connection() as conn:
+            try:
+                with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                    cur.execute(f"""
+                        select {', '.join(f'{URL_FIELDS[field]} AS {field}' for field in fields)},
+                               {sort_expr} AS sort_value
+                        from tbl_urlmanagement um
+                        join tbl_maintainvisit mv ON um.id = mv.url_id
+                        WHERE {' AND '.join(page_where)}
+                        order by {sort_expr} {direction}, um.id {direction}
+                        limit %s
+                    """, page_params + [page_size + 1])
+                    rows = cur.fetchall()
+
+                    cur.execute(f"""
+                        select count(*) AS total from tbl_urlmanagement um
+                        join tbl_maintainvisit mv ON um.id = mv.url_id
+                        WHERE {' AND '.join(where)}
+                    """, params)
+                    total = cur.fetchone()['total']
+            except psycopg2.Error as e:
+                logger.error(f"Database error fetching URL page: {e}")
+                conn.rollback()
+                raise
+
+        next_cursor = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            last = rows[-1]
+            next_cursor = encode_cursor(sort, last['sort_value'], last['id'])
+        for row in rows:
+            del row['sort_value']
+
+        return {'items': rows, 'next_cursor': next_cursor, 'total': total, 'page_size': page_size}
+
+    @staticmethod
+    def search(query, date_from=None, date_to=None, page_size=20, cursor=None):
+        """Rank URLs matching query by title, URL, meta description and extracted text.
+
+        Candidates come from the full-text GIN indexes on tbl_urlmanagement and
+        tbl_urlcontent plus the trigram index (substring and fuzzy matches), and
+        are ordered by ts_rank_cd plus trigram word similarity. Pages are keyset
+        paginated on (rank, id); titles and snippets come back highlighted.
+        """
+        page_size = max(1, min(int(page_size), MAX_PAGE_SIZE))
+        params = {'query': query, 'pattern': like_pattern(query)}
+
+        filters = []
+        if date_from:
+            filters.append("um.created_date >= %(date_from)s")
+            params['date_from'] = date_from
+        if date_to:
+            filters.append("um.created_date <= %(date_to)s")
+            params['date_to'] = date_to
+        page_filter = "TRUE"
+        if cursor:
+            params['last_rank'], params['last_id'] = decode_cursor(cursor, 'relevance')
+            page_filter = "(rank, id) < (%(last_rank)s::real, %(last_id)s)"
+        params['limit'] = page_size + 1
+
+        with db_connection() as conn:
+            try:
+                with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                    if trigram_available(conn):
+                        substring_match = f"({SEARCH_DOCUMENT} ILIKE %(pattern)s OR %(query)s <%% {SEARCH_DOCUMENT})"
+                        similarity = f"word_similarity(%(query)s, {SEARCH_DOCUMENT})"
+                    else:
+                        substring_match = f"{SEARCH_DOCUMENT} ILIKE %(pattern)s"
+                        similarity = f"CASE WHEN {substring_match} THEN 0.5 ELSE 0 END"
+                    matched = f"""
+                        WITH q AS (SELECT websearch_to_tsquery('english', %(query)s) AS query),
+                        matches AS (
+                            SELECT um.id FROM tbl_urlmanagement um, q
+                            WHERE um.enable = 1 AND um.search_vector @@ q.query
+                            UNION
+                            SELECT um.id FROM tbl_urlcontent c
+                            JOIN tbl_urlmanagement um ON um.url = c.url, q
+                            WHERE um.enable = 1 AND c.search_vector @@ q.query
+                            UNION
+                            SELECT um.id FROM tbl_urlmanagement um
+                            WHERE um.enable = 1 AND {substring_match}
+                        ),
+                        ranked AS (
+                            SELECT um.id, um.url, um.title, um.thumbnail, um.created_date, mv.visit,
+                                   (ts_rank_cd(um.search_vector || COALESCE(c.search_vector, ''::tsvector), q.query, 32)
+                                    + {similarity})::real AS rank,
+                                   count(*) OVER () AS total
+                            FROM matches m
+                            JOIN tbl_urlmanagement um ON um.id = m.id
+                            JOIN tbl_maintainvisit mv ON um.id = mv.url_id
+                            LEFT JOIN tbl_urlcontent c ON c.url = um.url, q
+                            WHERE {' AND '.join(filters) or 'TRUE'}
+                        )
+                    """
+                    cur.execute(matched + f""",
+                        page AS (
+                            SELECT * FROM ranked WHERE {page_filter}
+                            ORDER BY rank DESC, id DESC
+                            LIMIT %(limit)s
+                        )
+                        -- Headlines only for the rows on this page
+                        SELECT page.*,
+                               ts_headline('english', COALESCE(page.title, ''), q.query,
+                                           '{HEADLINE_OPTIONS}, HighlightAll=true') AS title_highlight,
+                               ts_headline('english', concat_ws(' ', c.meta_description, c.ai_ready_text), q.query,
+                                           '{HEADLINE_OPTIONS}, MaxWords=35, MinWords=15, MaxFragments=2') AS snippet
+                        FROM page
+                        LEFT JOIN tbl_urlcontent c ON c.url = page.url, q
+                        ORDER BY page.rank DESC, page.id DESC
+                    """, params)
+                    rows = cur.fetchall()
+                    if rows or not cursor:
+                        total = rows[0]['total'] if rows else 0
+                    else:
+                        # Past the last match, the count isn't on any row
+                        cur.execute(matched + "SELECT count(*) AS total FROM ranked", params)
+                        total = cur.fetchone()['total']
+            except psycopg2.Error as e:
+                logger.error(f"Database error searching URLs: {e}")
+                conn.rollback()
+                raise
+
+        next_cursor = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            last = rows[-1]
+            next_cursor = encode_cursor('relevance', last['rank'], last['id'])
+        for row in rows:
+            del row['total']
+            row['title_highlight'] = highlight_html(row['title_highlight'])
+            row['snippet'] = highlight_html(row['snippet']) if row['snippet'] else None
+
+        return {'items': rows, 'next_cursor': next_cursor, 'total': total, 'page_size': page_size}
+
+    @staticmethod
+    def save_page_content(rows):
+        """Store (url, meta_description, ai_ready_text, duplicate_of) from crawled pages"""
+        if not rows:
+            return 0
+        with db_connection() as conn:
+            try:
+                with conn.cursor() as cur:
+                    execute_values(cur, """
+                        INSERT INTO tbl_urlcontent (url, meta_description, ai_ready_text, duplicate_of)
+                        VALUES %s
+                        ON CONFLICT (url) DO UPDATE SET
+                            meta_description = EXCLUDED.meta_description,
+                            ai_ready_text = EXCLUDED.ai_ready_text,
+                            duplicate_of = EXCLUDED.duplicate_of,
+                            updated_at = CURRENT_TIMESTAMP
+                    """, rows, page_size=len(rows))
+                    rows_affected = cur.rowcount
+                    URL._touch_duplicate_groups(cur, [(url, duplicate_of) for url, _, _, duplicate_of in rows])
+                conn.commit()
+                return rows_affected
+            except psycopg2.Error as e:
+                logger.error(f"Database error saving page content: {e}")
+                conn.rollback()
+                raise
+
+    @staticmethod
+    def set_duplicates(pairs):
+        """Record (url, duplicate_of) near-duplicate results, duplicate_of None for distinct pages.
+
+        Duplicates leave the crawl queue (status 'duplicate') until they are
+        requested again; pages no longer duplicating anything rejoin it.
+        """
+        if not pairs:
+            return 0
+        with db_connection() as conn:
+            try:
+                with conn.cursor() as cur:
+                    execute_values(cur, """
+                        INSERT INTO tbl_urlcontent (url, duplicate_of) VALUES %s
+                        ON CONFLICT (url) DO UPDATE SET duplicate_of = EXCLUDED.duplicate_of
+                        WHERE tbl_urlcontent.duplicate_of IS DISTINCT FROM EXCLUDED.duplicate_of
+                    """, pairs, page_size=1000)
+                    execute_values(cur, """
+                        UPDATE url SET
+                            crawl_status = CASE WHEN v.duplicate_of IS NULL THEN 'done' ELSE 'duplicate' END,
+                            next_crawl_at = CASE WHEN v.duplicate_of IS NULL THEN NOW() ELSE NULL END
+                        FROM (VALUES %s) AS v(url, duplicate_of)
+                        WHERE url.url = v.url
+                          AND (url.crawl_status = 'duplicate') <> (v.duplicate_of IS NOT NULL)
+                          AND url.crawl_status IN ('done', 'duplicate')
+                    """, pairs, page_size=1000)
+                    URL._touch_duplicate_groups(cur, pairs)
+                    rows_affected = sum(1 for _, duplicate_of in pairs if duplicate_of)
+                conn.commit()
+                return rows_affected
+            except psycopg2.Error as e:
+                logger.error(f"Database error recording near-duplicates: {e}")
+                conn.rollback()
+                raise
+
+    @staticmethod
+    def _touch_duplicate_groups(cur, pairs):
+        # Bump the change feed for duplicates and the pages they point at, since
+        # their duplicate fields in get_page changed without a row update
+        urls = {url for pair in pairs if pair[1] for url in pair}
+        if urls:
+            cur.execute(
+                "UPDATE tbl_urlmanagement SET row_version = nextval('url_change_seq') WHERE url = ANY(%s)",
+                (list(urls),)
+            )
+
+    @staticmethod
+    def get_duplicates(id):
+        """Get the listed URLs whose content near-duplicates the URL with this id"""
+        with db_connection() as conn:
+            try:
+                with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                    cur.execute("""
+                        select du.id,du.url,du.title,du.thumbnail,du.created_date,mv.visit
+                        from tbl_urlmanagement um
+                        join tbl_urlcontent c ON c.duplicate_of = um.url
+                        join tbl_urlmanagement du ON du.url = c.url AND du.enable = 1
+                        join tbl_maintainvisit mv ON du.id = mv.url_id
+                        WHERE um.id = %s
+                        order by du.created_date, du.id
+                    """, (id,))
+                    return cur.fetchall()
+            except psycopg2.Error as e:
+                logger.error(f"Database error fetching duplicate URLs: {e}")
+                raise
+
+    @staticmethod
+    def current_version():
+        """Get the latest row_version and the change-feed version a page read after this can resume from"""
+        with db_connection() as conn:
+            try:
+                with conn.cursor() as cur:
+                    version = URL._feed_version(cur)
+                    cur.execute("SELECT COALESCE(MAX(row_version), 0) FROM tbl_urlmanagement")
+                    return cur.fetchone()[0], version
+            except psycopg2.Error as e:
+                logger.error(f"Database error fetching URL version: {e}")
+                raise
+
+    @staticmethod
+    def _feed_version(cur):
+        # Highest version below which every row is already committed: the sequence
+        # position, lowered to the oldest position an open writer started from.
+        # Read before the rows, each in its own statement, so a version still in
+        # flight when the rows are read is above it (READ COMMITTED)
+        cur.execute("SELECT CASE WHEN is_called THEN last_value ELSE last_value - 1 END FROM url_change_seq")
+        drawn = cur.fetchone()[0]
+        cur.execute("""
+            SELECT MIN((classid::bigint << 32) | objid::bigint) FROM pg_locks
+            WHERE locktype = 'advisory' AND objsubid = 1
+              AND database = (SELECT oid FROM pg_database WHERE datname = current_database())
+        """)
+        writing = cur.fetchone()[0]
+        return drawn if writing is None else min(drawn, writing)
+
+    @staticmethod
+    def link_health_version():
+        """Time of the latest link-health result, which row_version doesn't cover; None before any check"""
+        with db_connection() as conn:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT MAX(checked_at) FROM tbl_linkhealth")
+                    return cur.fetchone()[0]
+            except psycopg2.Error as e:
+                logger.error(f"Database error fetching link-health version: {e}")
+                raise
+
+    @staticmethod
+    def get_changes(since, limit=500):
+        """Get URL rows inserted, updated or soft-deleted after the given version
+
+        Rows are returned only up to the feed version, so a transaction that
+        took its versions earlier but commits later is not skipped; its
+        changes, and those after it, wait until it commits.
+        """
+        with db_connection() as conn:
+            try:
+                with conn.cursor() as cur:
+                    latest = URL._feed_version(cur)
+                with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                    cur.execute("""
+                        select um.id,um.url,um.title,um.thumbnail,um.created_date,mv.visit,
+                               um.enable <> 1 AS deleted, um.row_version
+                        from tbl_urlmanagement um
+                        left join tbl_maintainvisit mv ON um.id = mv.url_id
+                        WHERE um.row_version > %s AND um.row_version <= %s
+                        order by um.row_version
+                        limit %s
+                    """, (since, latest, limit + 1))
+                    rows = cur.fetchall()
+            except psycopg2.Error as e:
+                logger.error(f"Database error fetching URL changes: {e}")
+                raise
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        # Caught up: resume from the feed version, which may be past the last row
+        version = rows[-1]['row_version'] if has_more else max(since, latest)
+        return {'changes': rows, 'version': version, 'has_more': has_more}
+
+    @staticmethod
+    def find_by_url(url):
+        """Find a URL by its address or any address with the same canonical form"""
+        canonical, hashed = canonical_key(url)
+        with db_connection() as conn:
+            try:
+                with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                    cur.execute(
+                        """
+                        SELECT * FROM url
+                        WHERE (url_hash = %s AND canonical_url = %s) OR url = %s
+                        LIMIT 1
+                        """,
+                        (hashed, canonical, url)
+                    )
+                    return cur.fetchone()
+            except psycopg2.Error as e:
+                logger.error(f"Database error finding URL: {e}")
+                raise
+
+    @staticmethod
+    def claim_for_crawl(limit, lease_seconds):
+        """Claim up to limit due URLs for crawling, including ones whose previous claim expired.
+
+        Due means never crawled, waiting for a retry, or past its scheduled
+        recrawl. SKIP LOCKED lets several crawl services share the table without
+        handing out the same row twice. Returns each row's crawl state, with
+        seconds_since_crawl measured by the database clock.
+        """
+        with db_connection() as conn:
+            try:
+                with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                    cur.execute("""
+                        UPDATE url SET crawl_status = 'crawling', crawl_started_at = NOW(),
+                                       crawl_attempts = url.crawl_attempts + 1
+                        WHERE id IN (
+                            SELECT id FROM url
+                            WHERE (crawl_status IN ('pending', 'done') AND (next_crawl_at IS NULL OR next_crawl_at <= NOW()))
+                               OR (crawl_status = 'crawling' AND crawl_started_at < NOW() - make_interval(secs => %s))
+                            ORDER BY next_crawl_at NULLS FIRST, id
+                            LIMIT %s
+                            FOR UPDATE SKIP LOCKED
+                        )
+                        RETURNING id, url, crawl_attempts, content_fingerprint, http_etag, http_last_modified,
+                                  crawl_checks, crawl_changes, crawl_observed_seconds,
+                                  EXTRACT(EPOCH FROM NOW() - last_crawled_at)::float AS seconds_since_crawl
+                    """, (lease_seconds, limit))
+                    rows = cur.fetchall()
+                conn.commit()
+                return rows
+            except psycopg2.Error as e:
+                logger.error(f"Database error claiming URLs for crawl: {e}")
+                conn.rollback()
+                raise
+
+    @staticmethod
+    def record_crawl_results(results):
+        """Store crawl outcomes in a single UPDATE.
+
+        Each result is (id, status, delay, error, content_fingerprint, etag,
+        last_modified, checks, changes, observed_seconds, recrawl_interval):
+        the row is due again delay seconds from now (never, if delay is None),
+        and None leaves any of the last seven fields unchanged.
+        """
+        if not results:
+            return 0
+        with db_connection() as conn:
+            try:
+                with conn.cursor() as cur:
+                    execute_values(cur, """
+                        UPDATE url SET
+                            crawl_status = v.status,
+                            next_crawl_at = NOW() + make_interval(secs => v.delay),
+                            crawl_error = v.error,
+                            last_crawled_at = CASE WHEN v.status IN ('done', 'duplicate') THEN NOW() ELSE url.last_crawled_at END,
+                            crawl_attempts = CASE WHEN v.status IN ('done', 'duplicate') THEN 0 ELSE url.crawl_attempts END,
+                            content_fingerprint = COALESCE(v.fingerprint, url.content_fingerprint),
+                            http_etag = COALESCE(v.etag, url.http_etag),
+                            http_last_modified = COALESCE(v.last_modified, url.http_last_modified),
+                            crawl_checks = COALESCE(v.checks, url.crawl_checks),
+                            crawl_changes = COALESCE(v.changes, url.crawl_changes),
+                            crawl_observed_seconds = COALESCE(v.observed, url.crawl_observed_seconds),
+                            recrawl_interval = COALESCE(v.interval, url.recrawl_interval)
+                        FROM (VALUES %s) AS v(id, status, delay, error, fingerprint, etag, last_modified,
+                                              checks, changes, observed, interval)
+                        WHERE url.id = v.id
+                    """, results, page_size=len(results),
+                        template="(%s::int, %s, %s::float8, %s, %s, %s, %s, %s::int, %s::int, %s::float8, %s::float8)")
+                    rows_affected = cur.rowcount
+                conn.commit()
+                return rows_affected
+            except psycopg2.Error as e:
+                logger.error(f"Database error recording crawl results: {e}")
+                conn.rollback()
+                raise
+
+    @staticmethod
+    def release_crawl(ids):
+        """Hand claimed but unfinished URLs back to the queue without spending an attempt"""
+        if not ids:
+            return 0
+        with db_connection() as conn:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        UPDATE url SET crawl_status = 'pending', crawl_attempts = GREATEST(crawl_attempts - 1, 0)
+                        WHERE id = ANY(%s) AND crawl_status = 'crawling'
+                    """, (list(ids),))
+                    rows_affected = cur.rowcount
+                conn.commit()
+                return rows_affected
+            except psycopg2.Error as e:
+                logger.error(f"Database error releasing crawl claims: {e}")
+                conn.rollback()
+                raise
+
+    @staticmethod
+    def request_crawl(url):
+        """Queue a URL for (re)crawling now, adding it if it isn't stored yet"""
+        canonical, hashed = canonical_key(url)
+        with db_connection() as conn:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        UPDATE url SET crawl_status = 'pending', next_crawl_at = NULL, crawl_attempts = 0
+                        WHERE (url_hash = %s AND canonical_url = %s) OR url = %s
+                    """, (hashed, canonical, url))
+                    if cur.rowcount == 0:
+                        cur.execute("""
+                            INSERT INTO url (url, title, canonical_url, url_hash) VALUES (%s, %s, %s, %s)
+                            ON CONFLICT (url) DO NOTHING
+                        """, (url, url, canonical, hashed))
+                conn.commit()
+            except psycopg2.Error as e:
+                logger.error(f"Database error queueing URL for crawl: {e}")
+                conn.rollback()
+                raise
+
+    @staticmethod
+    def iter_url_hashes(batch_size=10000):
+        """Yield the canonical hash of every stored URL without loading them all at once"""
+        with db_connection() as conn:
+            try:
+                with conn.cursor(name='url_hashes') as cur:
+                    cur.itersize = batch_size
+                    cur.execute("SELECT url_hash FROM url WHERE url_hash IS NOT NULL")
+                    for (hashed,) in cur:
+                        yield hashed
+            except psycopg2.Error as e:
+                logger.error(f"Database error reading URL hashes: {e}")
+                raise
+
+    @staticmethod
+    def iter_export(fields=None, batch_size=5000):
+        """Yield every listed URL as a dict of the given URL_FIELDS, in id order.
+
+        A server-side cursor fetches batch_size rows per round trip, so memory
+        stays flat however many rows there are; the pooled connection is held
+        until the caller stops iterating.
+        """
+        fields = select_fields(fields)
+        with db_connection() as conn:
+            try:
+                with conn.cursor(name='url_export', cursor_factory=RealDictCursor) as cur:
+                    cur.itersize = batch_size
+                    cur.execute(f"""
+                        SELECT {', '.join(f'{URL_FIELDS[field]} AS {field}' for field in fields)}
+                        FROM tbl_urlmanagement um
+                        JOIN tbl_maintainvisit mv ON um.id = mv.url_id
+                        WHERE um.enable = 1
+                        ORDER BY um.id
+                    """)
+                    for row in cur:
+                        yield row
+            except psycopg2.Error as e:
+                logger.error(f"Database error exporting URLs: {e}")
+                raise
+
+    @staticmethod
+    def get_stale_links(after_id, limit, max_age, retry_age):
+        """Up to limit listed URLs due a health check with ids above after_id, in id order.
+
+        A check is stale after max_age seconds, or retry_age seconds when the
+        link was unavailable last time, so transient failures are confirmed
+        sooner than healthy links are rechecked. Never-checked links are due.
+        """
+        with db_connection() as conn:
+            try:
+                with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                    cur.execute("""
+                        SELECT um.id, um.url
+                        FROM tbl_urlmanagement um
+                        LEFT JOIN tbl_linkhealth h ON h.url_id = um.id
+                        WHERE um.enable = 1 AND um.id > %s
+                          AND (h.checked_at IS NULL OR h.checked_at < NOW() - make_interval(secs =>
+                               CASE WHEN h.link_status = 'unavailable' THEN %s ELSE %s END))
+                        ORDER BY um.id
+                        LIMIT %s
+                    """, (after_id, retry_age, max_age, limit))
+                    return cur.fetchall()
+            except psycopg2.Error as e:
+                logger.error(f"Database error fetching links to check: {e}")
+                raise
+
+    @staticmethod
+    def record_link_health(results):
+        """Store (url_id, link_status, http_status, final_url, error) check results in one upsert"""
+        if not results:
+            return 0
+        with db_connection() as conn:
+            try:
+                with conn.cursor() as cur:
+                    execute_values(cur, """
+                        INSERT INTO tbl_linkhealth (url_id, link_status, http_status, final_url, error)
+                        SELECT v.url_id, v.link_status, v.http_status, v.final_url, v.error
+                        FROM (VALUES %s) AS v(url_id, link_status, http_status, final_url, error)
+                        JOIN tbl_urlmanagement um ON um.id = v.url_id
+                        ON CONFLICT (url_id) DO UPDATE SET
+                            link_status = excluded.link_status,
+                            http_status = excluded.http_status,
+                            final_url = excluded.final_url,
+                            error = excluded.error,
+                            checked_at = CURRENT_TIMESTAMP
+                    """, results, page_size=len(results), template="(%s::int, %s, %s::int, %s, %s)")
+                    rows_affected = cur.rowcount
+                conn.commit()
+                return rows_affected
+            except psycopg2.Error as e:
+                logger.error(f"Database error recording link health: {e}")
+                conn.rollback()
+                raise
+
+    @staticmethod
+    def link_health_summary():
+        """Count of listed URLs by link status, 'unchecked' included"""
+        with db_connection() as conn:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        SELECT COALESCE(h.link_status, 'unchecked'), count(*)
+                        FROM tbl_urlmanagement um
+                        LEFT JOIN tbl_linkhealth h ON h.url_id = um.id
+                        WHERE um.enable = 1
+                        GROUP BY 1
+                    """)
+                    return dict(cur.fetchall())
+            except psycopg2.Error as e:
+                logger.error(f"Database error summarizing link health: {e}")
+                raise
+
+    @staticmethod
+    def iter_page_texts(since=None, batch_size=5000):
+        """Yield (id, title, ai_ready_text, updated_at) for listed URLs with crawled text.
+
+        With since, only pages whose text was stored after it, oldest first.
+        """
+        with db_connection() as conn:
+            try:
+                with conn.cursor(name='page_texts') as cur:
+                    cur.itersize = batch_size
+                    cur.execute("""
+                        SELECT um.id, um.title, c.ai_ready_text, c.updated_at
+                        FROM tbl_urlcontent c
+                        JOIN tbl_urlmanagement um ON um.url = c.url AND um.enable = 1
+                        WHERE c.ai_ready_text IS NOT NULL AND (%s::timestamp IS NULL OR c.updated_at > %s)
+                        ORDER BY c.updated_at, um.id
+                    """, (since, since))
+                    for row in cur:
+                        yield row
+            except psycopg2.Error as e:
+                logger.error(f"Database error reading page texts: {e}")
+                raise
+
+    @staticmethod
+    def get_by_ids(ids):
+        """Get listed URLs by id, in the order the ids are given"""
+        if not ids:
+            return []
+        with db_connection() as conn:
+            try:
+                with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                    cur.execute("""
+                        select um.id,um.url,um.title,um.thumbnail,um.created_date,mv.visit
+                        from tbl_urlmanagement um
+                        join tbl_maintainvisit mv ON um.id = mv.url_id
+                        WHERE um.id = ANY(%s) AND um.enable = 1
+                    """, (list(ids),))
+                    rows = {row['id']: row for row in cur.fetchall()}
+            except psycopg2.Error as e:
+                logger.error(f"Database error fetching URLs by id: {e}")
+                raise
+        return [rows[id] for id in ids if id in rows]
+
+    @staticmethod
+    def backfill_canonical(batch_size=1000):
+        """Fill canonical_url/url_hash for rows stored before canonicalization existed"""
+        total = 0
+        while True:
+            with db_connection() as conn:
+                try:
+                    with conn.cursor() as cur:
+                        cur.execute(
+                            "SELECT id, url FROM url WHERE url_hash IS NULL ORDER BY id LIMIT %s",
+                            (batch_size,)
+                        )
+                        rows = cur.fetchall()
+                        if not rows:
+                            return total
+                        execute_values(
+                            cur,
+                            """
+                            UPDATE url SET canonical_url = v.canonical_url, url_hash = v.url_hash
+                            FROM (VALUES %s) AS v (id, canonical_url, url_hash)
+                            WHERE url.id = v.id
+                            """,
+                            [(id, *_stored_key(url)) for id, url in rows],
+                            page_size=batch_size
+                        )
+                    conn.commit()
+                    total += len(rows)
+                except psycopg2.Error as e:
+                    logger.error(f"Database error backfilling canonical URLs: {e}")
+                    conn.rollback()
+                    raise
+
+    @staticmethod
+    def delete(id):
         """Delete a URL from the database"""
-        try:
-            with conn.cursor() as cur:
-                cur.execute("UPDATE tbl_urlmanagement SET enable = 0 WHERE id = %s", (id,))
-                rows_affected = cur.rowcount
-            conn.commit()
-            return rows_affected > 0
-        except psycopg2.Error as e:
-            logger.error(f"Database error deleting URL: {e}")
-            conn.rollback()
-            raise
-
-    @staticmethod
-    def update(conn, id, title, thumbnail):
+        with db_connection() as conn:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("UPDATE tbl_urlmanagement SET enable = 0 WHERE id = %s", (id,))
+                    rows_affected = cur.rowcount
+                conn.commit()
+                return rows_affected > 0
+            except psycopg2.Error as e:
+                logger.error(f"Database error deleting URL: {e}")
+                conn.rollback()
+                raise
+
+    @staticmethod
+    def get_thumbnail(id):
+        """Get the thumbnail image URL of a listed URL, or None"""
+        with db_connection() as conn:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT thumbnail FROM tbl_urlmanagement WHERE id = %s AND enable = 1", (id,))
+                    row = cur.fetchone()
+                    return row[0] if row else None
+            except psycopg2.Error as e:
+                logger.error(f"Database error fetching thumbnail: {e}")
+                raise
+
+    @staticmethod
+    def update(id, title, thumbnail):
         """Update URL metadata"""
-        try:
-            with conn.cursor() as cur:
-                cur.execute(
-                    "UPDATE tbl_urlmanagement SET title = %s, thumbnail = %s WHERE id = %s",
-                    (title, thumbnail, id)
-                )
-                rows_affected = cur.rowcount
-            conn.commit()
-            return rows_affected > 0
-        except psycopg2.Error as e:
-            logger.error(f"Database error updating URL: {e}")
-            conn.rollback()
-            raise
-
-    @staticmethod
-    def update_visit(conn, id):
+        with db_connection() as conn:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        "UPDATE tbl_urlmanagement SET title = %s, thumbnail = %s WHERE id = %s",
+                        (title, thumbnail, id)
+                    )
+                    rows_affected = cur.rowcount
+                conn.commit()
+                return rows_affected > 0
+            except psycopg2.Error as e:
+                logger.error(f"Database error updating URL: {e}")
+                conn.rollback()
+                raise
+
+    @staticmethod
+    def update_visit(id):
         """Increment visit count for a URL"""
-        try:
-            with conn.cursor() as cur:
-                cur.execute(
-                    "UPDATE tbl_maintainvisit SET visit = visit + 1 WHERE id = %s",
-                    (id,)
-                )
-                rows_affected = cur.rowcount
-            conn.commit()
-            return rows_affected > 0
-        except psycopg2.Error as e:
-            logger.error(f"Database error updating URL visit: {e}")
-            conn.rollback()
-            raise
+        return URL.add_visits({id: 1}) > 0
+
+    @staticmethod
+    def add_visits(counts):
+        """Apply a batch of visit increments keyed by URL id in a single UPDATE"""
+        if not counts:
+            return 0
+        with db_connection() as conn:
+            try:
+                with conn.cursor() as cur:
+                    # Sorted ids keep row lock order stable across concurrent flushes
+                    execute_values(cur, """
+                        UPDATE tbl_maintainvisit mv SET visit = mv.visit + v.delta
+                        FROM (VALUES %s) AS v(url_id, delta)
+                        WHERE mv.url_id = v.url_id
+                    """, sorted(counts.items()), template="(%s::int, %s::int)")
+                    rows_affected = cur.rowcount
+                conn.commit()
+                return rows_affected
+            except psycopg2.Error as e:
+                logger.error(f"Database error updating URL visits: {e}")
+                conn.rollback()
+                raise
 
 class Settings:
     @staticmethod
-    def get_all(conn):
+    def get_all():
         """Get all settings from the database"""
-        try:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute("SELECT key, value FROM settings")
-                settings = cur.fetchall()
-                # Convert list of dicts to single dict for easier consumption
-                return {item['key']: item['value'] for item in settings}
-        except psycopg2.Error as e:
-            logger.error(f"Database error fetching settings: {e}")
-            raise
-
-    @staticmethod
-    def update(conn, key, value):
+        with db_connection() as conn:
+            try:
+                with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                    cur.execute("SELECT key, value FROM settings")
+                    settings = cur.fetchall()
+                    # Convert list of dicts to single dict for easier consumption
+                    return {item['key']: item['value'] for item in settings}
+            except psycopg2.Error as e:
+                logger.error(f"Database error fetching settings: {e}")
+                raise
+
+    @staticmethod
+    def update(key, value):
         """Update a setting"""
-        try:
-            with conn.cursor() as cur:
-                cur.execute(
-                    """
-                    INSERT INTO settings (key, value, updated_at) 
-                    VALUES (%s, %s, NOW()) 
-                    ON CONFLICT (key) DO UPDATE 
-                    SET value = %s, updated_at = NOW()
-                    """,
-                    (key, value, value)
-                )
-                rows_affected = cur.rowcount
-            conn.commit()
-            return rows_affected > 0
-        except psycopg2.Error as e:
-            logger.error(f"Database error updating setting {key}: {e}")
-            conn.rollback()
-            raise
\ No newline at end of file
+        with db_connection() as conn:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        """
+                        INSERT INTO settings (key, value, updated_at) 
+                        VALUES (%s, %s, NOW()) 
+                        ON CONFLICT (key) DO UPDATE 
+                        SET value = %s, updated_at = NOW()
+                        """,
+                        (key, value, value)
+                    )
+                    rows_affected = cur.rowcount
+                conn.commit()
+                return rows_affected > 0
+            except psycopg2.Error as e:
+                logger.error(f"Database error updating setting {key}: {e}")
+                conn.rollback()
+                raise
+
+    @staticmethod
+    def update_many(values):
+        """Upsert several settings in one transaction and notify other processes of the change"""
+        if not values:
+            return 0
+        rows = [(key, str(value)) for key, value in values.items()]
+        payload = json.dumps(dict(rows), separators=(',', ':'))
+        if len(payload.encode('utf-8')) > SETTINGS_NOTIFY_MAX_BYTES:
+            # Too big for a NOTIFY payload; listeners reload from the table instead
+            payload = ''
+        with db_connection() as conn:
+            try:
+                with conn.cursor() as cur:
+                    execute_values(cur, """
+                        INSERT INTO settings (key, value, updated_at)
+                        VALUES %s
+                        ON CONFLICT (key) DO UPDATE
+                        SET value = EXCLUDED.value, updated_at = EXCLUDED.updated_at
+                    """, rows, template="(%s, %s, NOW())")
+                    rows_affected = cur.rowcount
+                    # Delivered on commit, so listeners never see a half-applied save
+                    cur.execute("SELECT pg_notify(%s, %s)", (SETTINGS_CHANNEL, payload))
+                conn.commit()
+                return rows_affected
+            except psycopg2.Error as e:
+                logger.error(f"Database error updating settings: {e}")
+                conn.rollback()
+                raise
+
+# Every model method is timed per call, so slow queries show up in /metrics by name
+QUERY_SECONDS = histogram('edvise_db_query_seconds', 'Time spent in each model method, including pool checkout', ['method'])
+QUERY_ERRORS = counter('edvise_db_query_errors_total', 'Model method calls that raised', ['method'])
+instrument_class(URL, QUERY_SECONDS, QUERY_ERRORS)
+instrument_class(Settings, QUERY_SECONDS, QUERY_ERRORS)
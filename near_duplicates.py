@@ -0,0 +1,209 @@
+"""Near-duplicate page detection with MinHash signatures and a banded LSH index.
+
+Syndicated copies, AMP pages and reposts have different URLs but nearly the
+same main text. Each page's main_content is reduced to a MinHash signature of
+its word shingles; the LSH index buckets signatures band by band, so a lookup
+only compares against pages sharing at least one band instead of every page.
+"""
+import argparse
+import logging
+import os
+import threading
+import zlib
+import numpy as np
+import pymongo
+from pymongo import UpdateOne
+from models import URL
+from config import NEAR_DUP_SHINGLE_SIZE, NEAR_DUP_NUM_PERM, NEAR_DUP_BANDS, NEAR_DUP_THRESHOLD
+
+logger = logging.getLogger(__name__)
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+def shingle_hashes(text, size=NEAR_DUP_SHINGLE_SIZE):
+    """32-bit hashes of the distinct word size-grams of text, ignoring case and spacing"""
+    words = (text or '').lower().split()
+    if not words:
+        return np.empty(0, dtype=np.uint64)
+    if len(words) < size:
+        # Short pages still get a signature, from the whole text
+        grams = [' '.join(words)]
+    else:
+        grams = {' '.join(words[i:i + size]) for i in range(len(words) - size + 1)}
+    return np.fromiter((zlib.crc32(gram.encode('utf-8')) for gram in grams), dtype=np.uint64, count=len(grams))
+
+class MinHasher:
+    """MinHash signatures from num_perm universal hash permutations (seeded, so reproducible)"""
+
+    def __init__(self, num_perm=NEAR_DUP_NUM_PERM, shingle_size=NEAR_DUP_SHINGLE_SIZE, seed=1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        generator = np.random.RandomState(seed)
+        self._a = generator.randint(1, int(_MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+        self._b = generator.randint(0, int(_MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+
+    def signature(self, text):
+        """Signature of text as a uint32 array, or None when it has no words"""
+        hashes = shingle_hashes(text, self.shingle_size)
+        if not len(hashes):
+            return None
+        # (a * x + b) mod p for every shingle and permutation at once; the
+        # uint64 product wraps, which only reshuffles the permutation
+        permuted = (np.outer(hashes, self._a) + self._b) % _MERSENNE_PRIME & _MAX_HASH
+        return permuted.min(axis=0).astype(np.uint32)
+
+    def from_bytes(self, data):
+        """Signature stored with signature.tobytes(), or None if it came from another configuration"""
+        if not data or len(data) != self.num_perm * 4:
+            return None
+        return np.frombuffer(data, dtype=np.uint32)
+
+class NearDuplicateIndex:
+    """LSH index of MinHash signatures keyed by URL.
+
+    Signatures are split into bands of rows; two pages become candidates when
+    any band matches exactly, which happens with probability
+    1 - (1 - s**rows)**bands for Jaccard similarity s. Candidates are then
+    checked against threshold using the estimated similarity, so a lookup
+    costs a few dict probes and a handful of vector comparisons.
+    """
+
+    def __init__(self, num_perm=NEAR_DUP_NUM_PERM, bands=NEAR_DUP_BANDS, threshold=NEAR_DUP_THRESHOLD):
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be divisible by bands ({bands})")
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self._buckets = [{} for _ in range(bands)]
+        self._signatures = {}
+        self._lock = threading.Lock()
+        self._stats = {'lookups': 0, 'candidates': 0, 'matches': 0}
+
+    def _band_keys(self, signature):
+        rows = self.rows
+        return [signature[band * rows:(band + 1) * rows].tobytes() for band in range(self.bands)]
+
+    def add(self, key, signature):
+        """Index signature under key, replacing any signature key had before"""
+        with self._lock:
+            self._remove(key)
+            self._signatures[key] = signature
+            for bucket, band_key in zip(self._buckets, self._band_keys(signature)):
+                bucket.setdefault(band_key, set()).add(key)
+
+    def remove(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key):
+        signature = self._signatures.pop(key, None)
+        if signature is None:
+            return
+        for bucket, band_key in zip(self._buckets, self._band_keys(signature)):
+            keys = bucket.get(band_key)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del bucket[band_key]
+
+    def query(self, signature, exclude=None):
+        """Keys whose estimated similarity to signature reaches threshold, best first, as (key, similarity)"""
+        band_keys = self._band_keys(signature)
+        with self._lock:
+            candidates = set()
+            for bucket, band_key in zip(self._buckets, band_keys):
+                keys = bucket.get(band_key)
+                if keys:
+                    candidates |= keys
+            candidates.discard(exclude)
+            matches = []
+            for key in candidates:
+                similarity = float(np.count_nonzero(self._signatures[key] == signature)) / len(signature)
+                if similarity >= self.threshold:
+                    matches.append((key, similarity))
+            self._stats['lookups'] += 1
+            self._stats['candidates'] += len(candidates)
+            self._stats['matches'] += bool(matches)
+        matches.sort(key=lambda match: (-match[1], match[0]))
+        return matches
+
+    def best_match(self, signature, exclude=None):
+        matches = self.query(signature, exclude)
+        return matches[0][0] if matches else None
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._signatures)
+        stats['bands'] = self.bands
+        stats['rows'] = self.rows
+        stats['threshold'] = self.threshold
+        return stats
+
+    def __len__(self):
+        return len(self._signatures)
+
+def rebuild_from_pages(collection, hasher, index, batch_size=1000):
+    """Index every page in the scraped_pages collection, oldest first.
+
+    Stored minhash fields are reused when they match hasher; missing ones are
+    computed from main_content. A page whose content matches an earlier page
+    is not indexed but marked as its duplicate, so each group is represented
+    by its first page. New signatures and changed duplicate_of fields are
+    written back to the collection. Returns (url, duplicate_of) for every
+    page, with duplicate_of None for pages that were indexed.
+    """
+    results = []
+    updates = []
+    cursor = collection.find(
+        {}, {'url': 1, 'main_content': 1, 'minhash': 1, 'duplicate_of': 1}
+    ).sort([('scraped_at', 1), ('_id', 1)]).batch_size(batch_size)
+    for page in cursor:
+        url = page.get('url')
+        if not url:
+            continue
+        changes = {}
+        signature = hasher.from_bytes(page.get('minhash'))
+        if signature is None:
+            signature = hasher.signature(page.get('main_content'))
+            if signature is None:
+                continue
+            changes['minhash'] = signature.tobytes()
+        duplicate_of = index.best_match(signature, exclude=url)
+        if duplicate_of is None:
+            index.add(url, signature)
+        if page.get('duplicate_of') != duplicate_of:
+            changes['duplicate_of'] = duplicate_of
+        if changes:
+            updates.append(UpdateOne({'_id': page['_id']}, {'$set': changes}))
+        results.append((url, duplicate_of))
+        if len(updates) >= batch_size:
+            collection.bulk_write(updates, ordered=False)
+            updates = []
+    if updates:
+        collection.bulk_write(updates, ordered=False)
+    return results
+
+def main():
+    """Rebuild near-duplicate groups from scraped_pages and store them"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--mongo-uri', default=None, help='defaults to the Mongo_URI environment variable')
+    parser.add_argument('--mongo-db', default=None, help='defaults to the Mongo_Database environment variable')
+    args = parser.parse_args()
+    logging.basicConfig(format='%(asctime)s [%(levelname)s] %(message)s', level=logging.INFO)
+
+    client = pymongo.MongoClient(args.mongo_uri or os.getenv('Mongo_URI'))
+    try:
+        collection = client[args.mongo_db or os.getenv('Mongo_Database')]['scraped_pages']
+        index = NearDuplicateIndex()
+        results = rebuild_from_pages(collection, MinHasher(), index)
+        URL.create_table()
+        URL.set_duplicates(results)
+    finally:
+        client.close()
+    duplicates = sum(1 for _, duplicate_of in results if duplicate_of)
+    logger.info(f"Indexed {len(index)} pages, {duplicates} near-duplicates: {index.stats()}")
+
+if __name__ == '__main__':
+    main()
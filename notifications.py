@@ -0,0 +1,128 @@
+import logging
+import queue
+import select
+import threading
+import time
+import psycopg2
+import psycopg2.extensions
+from config import get_db_connection
+from models import SETTINGS_CHANNEL
+
+logger = logging.getLogger(__name__)
+
+# Postgres channel the tbl_urlmanagement triggers notify on
+URL_CHANGES_CHANNEL = 'url_changes'
+
+class ChangeNotifier:
+    """Fan Postgres LISTEN/NOTIFY messages out to in-process subscribers"""
+
+    def __init__(self, channels, connect=get_db_connection, poll_timeout=5.0, retry_delay=2.0):
+        self.channels = list(channels)
+        self._connect = connect
+        self.poll_timeout = poll_timeout
+        self.retry_delay = retry_delay
+        self._subscribers = {}  # queue -> set of channels
+        self._callbacks = []  # (channel, callback)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the background listener thread if it isn't running"""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='change-notifier', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=self.poll_timeout + 1)
+
+    def subscribe(self, channels=None, maxsize=16):
+        """Register a queue that receives (channel, payload) tuples"""
+        events = queue.Queue(maxsize=maxsize)
+        with self._lock:
+            self._subscribers[events] = set(channels or self.channels)
+        return events
+
+    def unsubscribe(self, events):
+        with self._lock:
+            self._subscribers.pop(events, None)
+
+    def add_callback(self, channel, callback):
+        """Call callback(payload) from the listener thread for every notification on channel"""
+        with self._lock:
+            self._callbacks.append((channel, callback))
+
+    def publish(self, channel, payload=''):
+        """Deliver a notification to local subscribers without a database round trip"""
+        with self._lock:
+            subscribers = [q for q, channels in self._subscribers.items() if channel in channels]
+            callbacks = [cb for ch, cb in self._callbacks if ch == channel]
+        for events in subscribers:
+            try:
+                events.put_nowait((channel, payload))
+            except queue.Full:
+                # Slow consumer; notifications only say "something changed",
+                # so the ones already queued are enough for it to catch up
+                pass
+        for callback in callbacks:
+            try:
+                callback(payload)
+            except Exception as e:
+                logger.error(f"Change notification callback failed on {channel}: {e}")
+
+    def _run(self):
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = self._connect()
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cur:
+                    for channel in self.channels:
+                        cur.execute(f'LISTEN "{channel}"')
+                logger.info(f"Listening for notifications on {', '.join(self.channels)}")
+                # Anything sent before LISTEN took effect (at startup, or while
+                # disconnected) was missed, even by subscribers that loaded
+                # before this; an empty payload tells them to resync from the database
+                for channel in self.channels:
+                    self.publish(channel, '')
+
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], self.poll_timeout) == ([], [], []):
+                        continue
+                    conn.poll()
+                    # Collapse bursts: one delivery per channel/payload per poll
+                    pending = []
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        key = (notify.channel, notify.payload)
+                        if key not in pending:
+                            pending.append(key)
+                    for channel, payload in pending:
+                        self.publish(channel, payload)
+            except (psycopg2.Error, OSError) as e:
+                logger.error(f"Change notifier connection failed, retrying: {e}")
+                time.sleep(self.retry_delay)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except psycopg2.Error:
+                        pass
+
+_notifier = None
+_notifier_lock = threading.Lock()
+
+def get_change_notifier():
+    """Return the process-wide change notifier, starting it on first use"""
+    global _notifier
+    if _notifier is None:
+        with _notifier_lock:
+            if _notifier is None:
+                _notifier = ChangeNotifier([URL_CHANGES_CHANNEL, SETTINGS_CHANNEL])
+                _notifier.start()
+    return _notifier
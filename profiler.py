@@ -0,0 +1,149 @@
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from config import PROFILE_DIR, PROFILE_SLOW_REQUEST_SECONDS, PROFILE_SAMPLE_INTERVAL, PROFILE_MAX_FILES
+
+logger = logging.getLogger(__name__)
+
+_UNSAFE = re.compile(r'[^A-Za-z0-9_.-]+')
+
+def collapse(frame):
+    """One stack in collapsed flame graph format: root-first frames joined by ';'"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+class SlowRequestProfiler:
+    """Sampling profiler for slow requests.
+
+    While enabled, a background thread samples the stack of every thread
+    between begin() and end() each interval seconds. Requests that take at
+    least threshold seconds have their samples written to directory as
+    collapsed stacks (one 'frame;frame;frame count' line each), which
+    flamegraph.pl, speedscope and similar tools read directly. Only the
+    newest max_files dumps are kept.
+    """
+
+    def __init__(self, directory=PROFILE_DIR, threshold=PROFILE_SLOW_REQUEST_SECONDS,
+                 interval=PROFILE_SAMPLE_INTERVAL, max_files=PROFILE_MAX_FILES):
+        self.directory = directory
+        self.threshold = threshold
+        self.interval = interval
+        self.max_files = max_files
+        self._active = {}  # thread id -> Counter of collapsed stacks
+        self._cond = threading.Condition()
+        self._sampler = None
+        self._stats = {'profiled': 0, 'dumped': 0, 'samples': 0}
+
+    @property
+    def enabled(self):
+        return bool(self.threshold and self.threshold > 0)
+
+    def configure(self, threshold=None, interval=None):
+        """Turn profiling on (threshold in seconds) or off (threshold 0) at runtime"""
+        with self._cond:
+            if threshold is not None:
+                self.threshold = float(threshold)
+            if interval is not None:
+                self.interval = float(interval)
+
+    def begin(self):
+        """Start sampling the calling thread; returns a token for end(), or None when disabled"""
+        if not self.enabled:
+            return None
+        token = threading.get_ident()
+        with self._cond:
+            self._active[token] = Counter()
+            if self._sampler is None or not self._sampler.is_alive():
+                self._sampler = threading.Thread(target=self._sample_loop, name='request-profiler', daemon=True)
+                self._sampler.start()
+            self._cond.notify()
+        return token
+
+    def end(self, token, label, duration):
+        """Stop sampling; dump the stacks if the request took at least threshold seconds"""
+        if token is None:
+            return None
+        with self._cond:
+            samples = self._active.pop(token, None)
+            self._stats['profiled'] += 1
+        if not samples or not self.enabled or duration < self.threshold:
+            return None
+        try:
+            return self._dump(samples, label, duration)
+        except OSError as e:
+            logger.error(f"Could not write profile for {label}: {e}")
+            return None
+
+    def dumps(self):
+        """Profile files, newest first"""
+        try:
+            names = [name for name in os.listdir(self.directory) if name.endswith('.folded')]
+        except FileNotFoundError:
+            return []
+        return sorted(names, reverse=True)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats['active'] = len(self._active)
+        stats['enabled'] = self.enabled
+        stats['threshold'] = self.threshold
+        stats['interval'] = self.interval
+        return stats
+
+    def _sample_loop(self):
+        own = threading.get_ident()
+        while True:
+            with self._cond:
+                while not self._active:
+                    self._cond.wait()
+                targets = list(self._active)
+                interval = self.interval
+            frames = sys._current_frames()
+            stacks = [(token, collapse(frames[token])) for token in targets if token in frames and token != own]
+            del frames
+            with self._cond:
+                for token, stack in stacks:
+                    samples = self._active.get(token)
+                    if samples is not None:
+                        samples[stack] += 1
+                        self._stats['samples'] += 1
+            time.sleep(interval)
+
+    def _dump(self, samples, label, duration):
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        name = f"{stamp}-{int(time.time() * 1000) % 1000:03d}-{_UNSAFE.sub('_', label).strip('_')[:60]}-{duration * 1000:.0f}ms.folded"
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            for stack, count in samples.most_common():
+                f.write(f'{stack} {count}\n')
+        with self._cond:
+            self._stats['dumped'] += 1
+        logger.info(f"Slow request {label} took {duration * 1000:.0f} ms; stacks written to {path}")
+        for old in self.dumps()[self.max_files:]:
+            try:
+                os.remove(os.path.join(self.directory, old))
+            except FileNotFoundError:
+                pass
+        return path
+
+_profiler = None
+_profiler_lock = threading.Lock()
+
+def get_profiler():
+    """Return the process-wide slow request profiler"""
+    global _profiler
+    if _profiler is None:
+        with _profiler_lock:
+            if _profiler is None:
+                _profiler = SlowRequestProfiler()
+    return _profiler
@@ -0,0 +1,60 @@
+import hashlib
+import math
+from config import RECRAWL_MIN_INTERVAL, RECRAWL_MAX_INTERVAL, RECRAWL_DEFAULT_INTERVAL
+
+def content_fingerprint(main_content):
+    """Fingerprint of a page's main text, insensitive to case and whitespace changes"""
+    normalized = ' '.join((main_content or '').lower().split())
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+
+def estimate_change_rate(checks, changes, observed_seconds):
+    """Estimated changes per second from periodic checks, or None without data.
+
+    Uses Cho & Garcia-Molina's estimator, which unlike changes/time accounts
+    for several changes between two checks looking like one.
+    """
+    if checks <= 0 or observed_seconds <= 0:
+        return None
+    mean_interval = observed_seconds / checks
+    return -math.log((checks - changes + 0.5) / (checks + 0.5)) / mean_interval
+
+class RecrawlScheduler:
+    """Space out recrawls by each URL's observed change rate.
+
+    A page is revisited about once per expected change, clamped between
+    min_interval and max_interval. Pages never seen to change back off
+    geometrically, so static pages end up at max_interval.
+    """
+
+    def __init__(self, min_interval=RECRAWL_MIN_INTERVAL, max_interval=RECRAWL_MAX_INTERVAL,
+                 default_interval=RECRAWL_DEFAULT_INTERVAL):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.default_interval = default_interval
+
+    def observe(self, row, changed):
+        """Fold one crawl outcome into a claimed url row's history.
+
+        row needs crawl_checks, crawl_changes, crawl_observed_seconds and
+        seconds_since_crawl (None on the first crawl). Returns the updated
+        (checks, changes, observed_seconds, interval).
+        """
+        checks = row['crawl_checks'] or 0
+        changes = row['crawl_changes'] or 0
+        observed = row['crawl_observed_seconds'] or 0.0
+        if row['seconds_since_crawl'] is not None:
+            # The first crawl has nothing to compare against, so it isn't a check
+            checks += 1
+            changes += 1 if changed else 0
+            observed += row['seconds_since_crawl']
+        return checks, changes, observed, self.interval(checks, changes, observed)
+
+    def interval(self, checks, changes, observed_seconds):
+        rate = estimate_change_rate(checks, changes, observed_seconds)
+        if rate is None:
+            interval = self.default_interval
+        elif changes == 0:
+            interval = max(self.default_interval, observed_seconds) * 2
+        else:
+            interval = 1 / rate
+        return min(self.max_interval, max(self.min_interval, interval))
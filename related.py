@@ -0,0 +1,387 @@
+"""Related links from TF-IDF vectors of crawled page text.
+
+Every listed URL with crawled text gets a sparse TF-IDF vector over a hashed
+term space, built from its title and ai_ready_text (which carries the page's
+main headings). A build writes the vectors to a directory of .npy files that
+queries memory-map: rows (CSR) hold each page's own vector, and the transposed
+postings (CSC) list, per term, the pages containing it. A top-k cosine query
+therefore only reads the posting lists of the page's own terms instead of
+comparing against every page.
+
+Pages crawled after a build are vectorized with the build's IDF weights and
+kept in a small in-memory delta; the index is rebuilt from scratch once it is
+old or the delta has grown past a share of the build.
+
+    python related.py    # rebuild now, e.g. from cron
+"""
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+import zlib
+from collections import Counter
+from datetime import datetime
+import numpy as np
+from models import URL
+from config import (
+    RELATED_INDEX_DIR, RELATED_FEATURES, RELATED_MAX_DF, RELATED_REFRESH_INTERVAL,
+    RELATED_REBUILD_INTERVAL, RELATED_REBUILD_GROWTH
+)
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]{2,}')
+# Below this many pages, max_df would discard most shared vocabulary
+MIN_PAGES_FOR_MAX_DF = 100
+CURRENT_FILE = 'current.json'
+
+def term_counts(title, text, features=RELATED_FEATURES):
+    """Hashed term ids and their counts for a page; title terms count twice"""
+    title = title or ''
+    counts = Counter(TOKEN_PATTERN.findall(f"{title} {title} {text or ''}".lower()))
+    if not counts:
+        return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+    # crc32 rather than hash(), which is salted per process
+    hashed = np.fromiter((zlib.crc32(term.encode('utf-8')) % features for term in counts),
+                         dtype=np.int64, count=len(counts))
+    tf = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+    terms, inverse = np.unique(hashed, return_inverse=True)
+    return terms.astype(np.int32), np.bincount(inverse, weights=tf).astype(np.float32)
+
+def tfidf(terms, tf, idf):
+    """L2-normalized sublinear TF-IDF weights, dropping terms with no IDF weight"""
+    weights = (1 + np.log(tf)) * idf[terms]
+    keep = weights > 0
+    terms, weights = terms[keep], weights[keep]
+    norm = np.linalg.norm(weights)
+    return terms, (weights / norm if norm else weights).astype(np.float32)
+
+def build_index(pages, directory, features=RELATED_FEATURES, max_df=RELATED_MAX_DF):
+    """Vectorize (id, title, ai_ready_text, updated_at) pages into a new index directory.
+
+    Returns the build's metadata, which is also written to meta.json.
+    """
+    started = time.monotonic()
+    ids, updated, term_chunks, tf_chunks = [], [], [], []
+    watermark = None
+    for id, title, text, updated_at in pages:
+        terms, tf = term_counts(title, text, features)
+        ids.append(id)
+        updated.append(updated_at.timestamp())
+        term_chunks.append(terms)
+        tf_chunks.append(tf)
+        watermark = updated_at if watermark is None else max(watermark, updated_at)
+    vectorized = time.monotonic()
+
+    count = len(ids)
+    lengths = np.fromiter(map(len, term_chunks), dtype=np.int64, count=count)
+    terms = np.concatenate(term_chunks) if count else np.empty(0, dtype=np.int32)
+    tf = np.concatenate(tf_chunks) if count else np.empty(0, dtype=np.float32)
+    rows = np.repeat(np.arange(count, dtype=np.int32), lengths)
+
+    df = np.bincount(terms, minlength=features)
+    idf = (np.log((1 + count) / (1 + df)) + 1).astype(np.float32)
+    if count >= MIN_PAGES_FOR_MAX_DF:
+        idf[df > max_df * count] = 0
+
+    weights = (1 + np.log(tf)) * idf[terms]
+    keep = weights > 0
+    terms, rows, weights = terms[keep], rows[keep], weights[keep]
+    norms = np.sqrt(np.bincount(rows, weights=weights * weights, minlength=count))
+    weights = (weights / norms[rows]).astype(np.float32)
+
+    doc_indptr = np.zeros(count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=count), out=doc_indptr[1:])
+    # Postings: the same entries ordered by term (rows stay sorted within a term)
+    order = np.argsort(terms, kind='stable')
+    post_indptr = np.zeros(features + 1, dtype=np.int64)
+    np.cumsum(np.bincount(terms, minlength=features), out=post_indptr[1:])
+
+    os.makedirs(directory, exist_ok=True)
+    arrays = {
+        'ids': np.asarray(ids, dtype=np.int64),
+        'updated': np.asarray(updated, dtype=np.float64),
+        'doc_indptr': doc_indptr,
+        'doc_terms': terms,
+        'doc_weights': weights,
+        'post_indptr': post_indptr,
+        'post_rows': rows[order],
+        'post_weights': weights[order],
+        'idf': idf,
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(directory, f'{name}.npy'), array)
+    meta = {
+        'pages': count,
+        'features': features,
+        'entries': int(len(terms)),
+        'built_at': time.time(),
+        'watermark': watermark.isoformat() if watermark else None,
+        'vectorize_seconds': round(vectorized - started, 3),
+        'build_seconds': round(time.monotonic() - started, 3),
+    }
+    with open(os.path.join(directory, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    return meta
+
+def top_k(ids, scores, k):
+    """(id, score) pairs for the k highest positive scores, best first"""
+    if len(scores) > k:
+        best = np.argpartition(-scores, k)[:k]
+    else:
+        best = np.arange(len(scores))
+    best = best[scores[best] > 0]
+    best = best[np.lexsort((ids[best], -scores[best]))]
+    return [(int(ids[i]), float(scores[i])) for i in best]
+
+class _Build:
+    """A built index directory, memory-mapped read-only"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, 'meta.json')) as f:
+            self.meta = json.load(f)
+
+        def load(name):
+            return np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r')
+
+        self.ids = np.load(os.path.join(directory, 'ids.npy'))
+        self.updated = np.load(os.path.join(directory, 'updated.npy'))
+        self.doc_indptr = load('doc_indptr')
+        self.doc_terms = load('doc_terms')
+        self.doc_weights = load('doc_weights')
+        self.post_indptr = load('post_indptr')
+        self.post_rows = load('post_rows')
+        self.post_weights = load('post_weights')
+        self.idf = np.load(os.path.join(directory, 'idf.npy'))
+        self.row_of = {int(id): row for row, id in enumerate(self.ids)}
+        watermark = self.meta['watermark']
+        self.watermark = datetime.fromisoformat(watermark) if watermark else None
+
+    def vector(self, id):
+        row = self.row_of.get(id)
+        if row is None:
+            return None
+        start, end = self.doc_indptr[row], self.doc_indptr[row + 1]
+        return np.asarray(self.doc_terms[start:end]), np.asarray(self.doc_weights[start:end])
+
+    def scores(self, terms, weights):
+        """Cosine similarity of every page with a query vector, from the query terms' postings"""
+        starts = self.post_indptr[terms]
+        lengths = self.post_indptr[terms + 1] - starts
+        total = int(lengths.sum())
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        if not total:
+            return scores
+        # Positions of all the postings, one run per query term
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(total)
+        contributions = self.post_weights[offsets] * np.repeat(weights, lengths)
+        scores += np.bincount(self.post_rows[offsets], weights=contributions,
+                              minlength=len(self.ids)).astype(np.float32)
+        return scores
+
+class _Delta:
+    """Pages added since the build, packed for scoring; replaced, never mutated"""
+
+    def __init__(self, vectors=None, build=None):
+        self.vectors = vectors or {}  # id -> (terms, weights, updated timestamp)
+        ids = list(self.vectors)
+        self.ids = np.asarray(ids, dtype=np.int64)
+        entries = [self.vectors[id] for id in ids]
+        lengths = np.fromiter((len(terms) for terms, _, _ in entries), dtype=np.int64, count=len(entries))
+        self.rows = np.repeat(np.arange(len(ids), dtype=np.int32), lengths)
+        self.terms = np.concatenate([terms for terms, _, _ in entries]) if entries else np.empty(0, dtype=np.int32)
+        self.weights = np.concatenate([weights for _, weights, _ in entries]) if entries else np.empty(0, dtype=np.float32)
+        # Build rows superseded by a newer version in the delta
+        self.stale_rows = np.asarray(
+            [build.row_of[id] for id in ids if build is not None and id in build.row_of], dtype=np.int64
+        )
+
+    def scores(self, query):
+        """Cosine similarity of every delta page with a dense query vector"""
+        return np.bincount(self.rows, weights=query[self.terms] * self.weights,
+                           minlength=len(self.ids)).astype(np.float32)
+
+class RelatedIndex:
+    """Top-k related pages by TF-IDF cosine similarity.
+
+    Queries use the current build plus the delta of pages crawled since,
+    which is topped up from Postgres at most every refresh_interval seconds.
+    A background rebuild starts when the build is older than
+    rebuild_interval or the delta exceeds rebuild_growth of its size, and
+    builds written by other processes are picked up through current.json.
+    """
+
+    def __init__(self, directory=RELATED_INDEX_DIR, refresh_interval=RELATED_REFRESH_INTERVAL,
+                 rebuild_interval=RELATED_REBUILD_INTERVAL, rebuild_growth=RELATED_REBUILD_GROWTH):
+        self.directory = directory
+        self.refresh_interval = refresh_interval
+        self.rebuild_interval = rebuild_interval
+        self.rebuild_growth = rebuild_growth
+        self._build = None
+        self._build_stamp = None
+        self._delta = _Delta()
+        self._lock = threading.Lock()
+        self._rebuild_thread = None
+        self._last_refresh = 0.0
+        self._stats = {'queries': 0, 'refreshes': 0, 'added': 0, 'rebuilds': 0, 'query_seconds': 0.0}
+
+    def related(self, id, k=10):
+        """(id, score) pairs for the k pages most similar to id, or None if id isn't indexed"""
+        self.maintain()
+        started = time.monotonic()
+        build, delta = self._build, self._delta
+        if build is None:
+            return None
+        entry = delta.vectors.get(id)
+        vector = entry[:2] if entry else build.vector(id)
+        if vector is None:
+            return None
+        terms, weights = vector
+
+        build_scores = build.scores(terms, weights)
+        build_scores[delta.stale_rows] = 0
+        row = build.row_of.get(id)
+        if row is not None:
+            build_scores[row] = 0
+        query = np.zeros(build.meta['features'], dtype=np.float32)
+        query[terms] = weights
+        delta_scores = delta.scores(query)
+        delta_scores[delta.ids == id] = 0
+
+        results = top_k(build.ids, build_scores, k) + top_k(delta.ids, delta_scores, k)
+        results.sort(key=lambda result: (-result[1], result[0]))
+        with self._lock:
+            self._stats['queries'] += 1
+            self._stats['query_seconds'] += time.monotonic() - started
+        return results[:k]
+
+    def maintain(self):
+        """Load a newer build, add newly crawled pages, and start a rebuild when one is due"""
+        now = time.monotonic()
+        if now - self._last_refresh < self.refresh_interval and self._build is not None:
+            return
+        self._last_refresh = now
+        try:
+            self._load_current()
+            if self._build is not None:
+                self.refresh()
+        except Exception as e:
+            logger.error(f"Error refreshing related-links index: {e}")
+        build = self._build
+        if build is None:
+            due = True
+        else:
+            age = time.time() - build.meta['built_at']
+            growth = len(self._delta.vectors) / max(build.meta['pages'], 1)
+            due = age >= self.rebuild_interval or (len(self._delta.vectors) and growth >= self.rebuild_growth)
+        if due:
+            self.rebuild_in_background()
+
+    def refresh(self):
+        """Vectorize pages stored since the build's watermark into the delta"""
+        build = self._build
+        vectors = dict(self._delta.vectors)
+        since = max((datetime.fromtimestamp(updated) for _, _, updated in vectors.values()),
+                    default=build.watermark)
+        added = 0
+        for id, title, text, updated_at in URL.iter_page_texts(since):
+            terms, weights = tfidf(*term_counts(title, text, build.meta['features']), build.idf)
+            vectors[id] = (terms, weights, updated_at.timestamp())
+            added += 1
+        if added:
+            delta = _Delta(vectors, build)
+            with self._lock:
+                if self._build is build:
+                    self._delta = delta
+                self._stats['added'] += added
+        with self._lock:
+            self._stats['refreshes'] += 1
+        return added
+
+    def rebuild(self):
+        """Build a new index from every crawled page and switch to it"""
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"build-{time.strftime('%Y%m%d%H%M%S')}-{os.getpid()}"
+        meta = build_index(URL.iter_page_texts(), os.path.join(self.directory, name))
+        current = os.path.join(self.directory, CURRENT_FILE)
+        with open(current + '.tmp', 'w') as f:
+            json.dump({'build': name}, f)
+        os.replace(current + '.tmp', current)
+        self._load_current()
+        with self._lock:
+            self._stats['rebuilds'] += 1
+        self._remove_old_builds(name)
+        logger.info(f"Related-links index rebuilt: {meta['pages']} pages in {meta['build_seconds']}s")
+        return meta
+
+    def rebuild_in_background(self):
+        with self._lock:
+            if self._rebuild_thread is not None and self._rebuild_thread.is_alive():
+                return
+            self._rebuild_thread = threading.Thread(target=self._rebuild_quietly, daemon=True,
+                                                    name='related-rebuild')
+            self._rebuild_thread.start()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        build = self._build
+        stats['pages'] = build.meta['pages'] if build else 0
+        stats['delta_pages'] = len(self._delta.vectors)
+        stats['built_at'] = build.meta['built_at'] if build else None
+        stats['rebuilding'] = self._rebuild_thread is not None and self._rebuild_thread.is_alive()
+        stats['avg_query_ms'] = stats['query_seconds'] * 1000 / stats['queries'] if stats['queries'] else 0.0
+        return stats
+
+    def _rebuild_quietly(self):
+        try:
+            self.rebuild()
+        except Exception as e:
+            logger.error(f"Error rebuilding related-links index: {e}")
+
+    def _load_current(self):
+        current = os.path.join(self.directory, CURRENT_FILE)
+        try:
+            stamp = os.stat(current).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if stamp == self._build_stamp:
+            return
+        with open(current) as f:
+            name = json.load(f)['build']
+        build = _Build(os.path.join(self.directory, name))
+        with self._lock:
+            self._build = build
+            self._build_stamp = stamp
+            self._delta = _Delta()
+        # Pages stored since this build started go back into the delta
+        self.refresh()
+
+    def _remove_old_builds(self, keep):
+        for name in os.listdir(self.directory):
+            if name.startswith('build-') and name != keep:
+                try:
+                    shutil.rmtree(os.path.join(self.directory, name))
+                except OSError:
+                    # Still mapped by another process on some platforms; next rebuild retries
+                    pass
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_related_index():
+    """Return the process-wide related-links index"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = RelatedIndex()
+    return _index
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s [%(levelname)s] %(message)s', level=logging.INFO)
+    print(json.dumps(RelatedIndex().rebuild(), indent=2))
@@ -0,0 +1,94 @@
+import json
+import logging
+import threading
+from models import Settings, SETTINGS_CHANNEL
+from notifications import get_change_notifier
+
+logger = logging.getLogger(__name__)
+
+class SettingsCache:
+    """In-process copy of the settings table, kept current through LISTEN/NOTIFY.
+
+    Reads return a snapshot without touching the database. Saves go through
+    Settings.update_many, whose NOTIFY carries the changed values, so every
+    process serving the app patches its copy from the notification. The
+    snapshot dict is replaced, never mutated, so readers always see either
+    the old or the new settings as a whole.
+    """
+
+    def __init__(self, notifier=None):
+        self._settings = None
+        self._generation = 0  # bumped by every change, so a slow reload can't overwrite a newer one
+        self._lock = threading.Lock()
+        self._stats = {'reads': 0, 'loads': 0, 'notifications': 0}
+        if notifier is not None:
+            notifier.add_callback(SETTINGS_CHANNEL, self._on_notify)
+
+    def get_all(self):
+        """Return a copy of all settings, loading them on first use or after an invalidation"""
+        settings = self._settings
+        if settings is None:
+            settings = self.reload()
+        with self._lock:
+            self._stats['reads'] += 1
+        return dict(settings)
+
+    def get(self, key, default=None):
+        return self.get_all().get(key, default)
+
+    def update(self, values):
+        """Save several settings in one transaction and apply them locally once committed"""
+        Settings.update_many(values)
+        self._merge({key: str(value) for key, value in values.items()})
+
+    def reload(self):
+        with self._lock:
+            generation = self._generation
+        settings = Settings.get_all()
+        with self._lock:
+            if generation == self._generation:
+                self._settings = settings
+            self._stats['loads'] += 1
+        return settings
+
+    def invalidate(self):
+        with self._lock:
+            self._settings = None
+            self._generation += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['loaded'] = self._settings is not None
+        return stats
+
+    def _merge(self, changes):
+        with self._lock:
+            if self._settings is not None:
+                self._settings = dict(self._settings, **changes)
+            self._generation += 1
+
+    def _on_notify(self, payload):
+        with self._lock:
+            self._stats['notifications'] += 1
+        try:
+            changes = json.loads(payload) if payload else None
+        except ValueError:
+            changes = None
+        if changes is None:
+            # No usable payload (oversized save or a listener reconnect)
+            self.invalidate()
+        else:
+            self._merge(changes)
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_settings_cache():
+    """Return the process-wide settings cache, subscribed to settings change notifications"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = SettingsCache(get_change_notifier())
+    return _cache
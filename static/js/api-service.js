@@ -3,26 +3,44 @@ class UrlApiService {
         this.baseUrl = baseUrl;
         this.endpoints = {
             urls: '/api/urls',
+            changes: '/api/urls/changes',
+            search: '/api/search',
+            events: '/api/events',
             visit: '/api/updateVisit',
             settings: '/api/settings'
         };
         this.defaultHeaders = {
             'Content-Type': 'application/json'
         };
+        // Columns the dashboard list renders; the rest aren't selected or sent
+        this.listFields = ['id', 'url', 'title', 'thumbnail', 'created_date', 'visit'];
     }
     
-    async fetchUrls() {
+    /**
+     * Fetch one page of URLs; filtering, sorting and pagination run on the server
+     * @param {Object} params - search, sort, date_from, date_to, page_size, cursor
+     * @returns {Promise<{items: Array, next_cursor: ?string, total: number}>} Page of URLs
+     */
+    async fetchUrls(params = {}) {
         try {
-            console.log('API Service: Fetching URLs');
-            const data = await this.sendRequest(this.endpoints.urls);
+            const query = new URLSearchParams({ fields: this.listFields.join(','), format: 'columns' });
+            for (const [key, value] of Object.entries(params)) {
+                if (value !== null && value !== undefined && value !== '') {
+                    query.append(key, value);
+                }
+            }
+            const endpoint = `${this.endpoints.urls}?${query.toString()}`;
             
-            // Ensure we have an array response, even if empty
-            if (Array.isArray(data)) {
-                console.log(`API Service: Successfully fetched ${data.length} URLs`);
+            console.log('API Service: Fetching URLs', params);
+            const data = this.rowsFromColumns(await this.sendRequest(endpoint));
+            
+            // Ensure we have a page response, even if empty
+            if (data && Array.isArray(data.items)) {
+                console.log(`API Service: Successfully fetched ${data.items.length} of ${data.total} URLs`);
                 return data;
             } else {
                 console.error('API Service: Unexpected response format:', data);
-                return [];
+                return { items: [], next_cursor: null, total: 0 };
             }
         } catch (error) {
             console.error('API Service: Error fetching URLs:', error);
@@ -30,6 +48,52 @@ class UrlApiService {
         }
     }
     
+    /**
+     * Turn a columnar page ({fields, columns: {field: [values]}}) back into row objects
+     * @param {Object} data - Page response
+     * @returns {Object} The page with an items array
+     */
+    rowsFromColumns(data) {
+        if (!data || !data.columns) {
+            return data;
+        }
+        const { fields, columns, ...page } = data;
+        const count = fields.length ? columns[fields[0]].length : 0;
+        page.items = Array.from({ length: count }, (_, i) => {
+            const row = {};
+            for (const field of fields) {
+                row[field] = columns[field][i];
+            }
+            return row;
+        });
+        return page;
+    }
+    
+    /**
+     * Full-text search over titles, URLs and extracted page content, best matches first
+     * @param {Object} params - q, date_from, date_to, page_size, cursor
+     * @returns {Promise<{items: Array, next_cursor: ?string, total: number}>} Page of ranked URLs
+     * with HTML-escaped title_highlight and snippet fields
+     */
+    async searchUrls(params = {}) {
+        const query = new URLSearchParams();
+        for (const [key, value] of Object.entries(params)) {
+            if (value !== null && value !== undefined && value !== '') {
+                query.append(key, value);
+            }
+        }
+        return this.sendRequest(`${this.endpoints.search}?${query.toString()}`);
+    }
+    
+    /**
+     * Fetch rows inserted, updated or soft-deleted after a change-feed version
+     * @param {number} since - Last version the caller has applied
+     * @returns {Promise<{changes: Array, version: number, has_more: boolean}>} Delta
+     */
+    async fetchChanges(since) {
+        return this.sendRequest(`${this.endpoints.changes}?since=${encodeURIComponent(since)}`);
+    }
+    
     async deleteUrl(id) {
         return this.sendRequest(
             this.endpoints.urls,
@@ -5,20 +5,29 @@ class UrlManager {
         this.ui = new UIManager();
         this.api = new UrlApiService();
         
-        // Url data storage
+        // Url data storage (current page only; filtering happens server-side)
         this.urls = [];
-        this.totalUrls = [];
+        this.totalItems = 0;
         
-        // Pagination state
+        // Active server-side query
+        this.query = { sort: 'date_desc' };
+        
+        // Pagination state; pageCursors[i] is the keyset cursor for page i + 1
         this.currentPage = 1;
         this.totalPages = 1;
+        this.pageCursors = [null];
+        // Rows per page as served; the server caps what was asked for
+        this.pageSize = null;
         
         // Modal references
         this.editModal = null;
         this.filterModal = null;
         
-        // Polling
+        // Polling and push updates; version is the change-feed position of this.urls
         this.pollingInterval = null;
+        this.eventSource = null;
+        this.version = null;
+        this.syncing = false;
     }
 
     async initialize() {
@@ -58,8 +67,9 @@ class UrlManager {
             // Start fetching data - await to ensure data is loaded
             await this.fetchUrls();
             
-            // Start polling for regular updates
+            // Start polling for regular updates and listen for pushed changes
             this.startPolling();
+            this.connectEvents();
             
             // Dispatch event that app is initialized
             window.dispatchEvent(new Event('app-initialized'));
@@ -179,9 +189,9 @@ class UrlManager {
     // Settings methods
     showSettings() {
         this.settings.showSettingsModal((newSettings) => {
-            // Handle settings changes
+            // Handle settings changes; page size may have changed so cursors are stale
+            this.resetPagination();
             this.restartPolling();
-            this.renderUrls(this.totalUrls);
             this.ui.showToast('Settings saved successfully', 'success');
         });
     }
@@ -199,7 +209,7 @@ class UrlManager {
         // Start a new interval with the current refresh interval from settings
         const refreshInterval = this.settings.getSetting('refreshInterval');
         console.log(`Starting polling with interval: ${refreshInterval}ms`);
-        this.pollingInterval = setInterval(() => this.fetchUrls(), refreshInterval);
+        this.pollingInterval = setInterval(() => this.syncChanges(), refreshInterval);
     }
     
     restartPolling() {
@@ -212,27 +222,46 @@ class UrlManager {
         
         // Start a new interval with the current refresh interval
         const refreshInterval = this.settings.getSetting('refreshInterval');
-        this.pollingInterval = setInterval(() => this.fetchUrls(), refreshInterval);
+        this.pollingInterval = setInterval(() => this.syncChanges(), refreshInterval);
     }
     
     // URL manipulation methods
+    resetPagination() {
+        this.currentPage = 1;
+        this.pageCursors = [null];
+    }
+    
     async fetchUrls() {
         this.ui.showLoader();
         try {
             console.log('Fetching URLs from server...');
-            const urls = await this.api.fetchUrls();
+            const { search, sort, ...filters } = this.query;
+            const paging = {
+                page_size: this.settings.getSetting('itemsPerPage'),
+                cursor: this.pageCursors[this.currentPage - 1]
+            };
+            // Searches are ranked by relevance on the server instead of sorted
+            const page = search
+                ? await this.api.searchUrls({ q: search, ...filters, ...paging })
+                : await this.api.fetchUrls({ ...this.query, ...paging });
             
             // Debug the response
-            console.log('URLs fetched:', urls && urls.length ? urls.length : 0);
+            console.log('URLs fetched:', page.items.length, 'of', page.total);
             
-            // Ensure we have a valid array to work with
-            this.urls = Array.isArray(urls) ? urls : [];
+            this.urls = page.items;
+            this.totalItems = page.total;
+            this.pageSize = page.page_size || paging.page_size;
+            this.version = page.version;
+            // Remember where the next page starts so it can be requested directly
+            this.pageCursors[this.currentPage] = page.next_cursor;
+            this.pageCursors.length = this.currentPage + 1;
             this.renderUrls(this.urls);
             return this.urls;
         } catch (error) {
             console.error('Error fetching URLs:', error);
             this.ui.showToast('Failed to load URLs', 'error');
             this.urls = [];
+            this.totalItems = 0;
             this.renderUrls([]);
             return [];
         } finally {
@@ -240,22 +269,82 @@ class UrlManager {
         }
     }
     
+    // Subscribe to server-sent change notifications; polling remains as a fallback
+    connectEvents() {
+        if (!window.EventSource || this.eventSource) return;
+        
+        this.eventSource = new EventSource(this.api.endpoints.events);
+        this.eventSource.addEventListener('url_changes', () => this.syncChanges());
+        // EventSource reconnects on its own; catch up on anything missed meanwhile
+        this.eventSource.addEventListener('open', () => this.syncChanges());
+    }
+    
+    // Apply rows changed since this.version instead of downloading the page again
+    async syncChanges() {
+        if (this.syncing) return;
+        if (this.version === null) {
+            await this.fetchUrls();
+            return;
+        }
+        
+        this.syncing = true;
+        try {
+            const changes = [];
+            let version = this.version;
+            let hasMore = true;
+            while (hasMore) {
+                const delta = await this.api.fetchChanges(version);
+                changes.push(...delta.changes);
+                version = delta.version;
+                hasMore = delta.has_more;
+            }
+            if (changes.length === 0) return;
+            
+            // Edits to rows already on screen can be patched in place; inserts,
+            // deletes and rows that may now match the filter need the page again
+            const visible = new Map(this.urls.map(url => [url.id, url]));
+            const patchable = changes.every(change => !change.deleted && visible.has(change.id));
+            if (!patchable) {
+                await this.fetchUrls();
+                return;
+            }
+            
+            for (const change of changes) {
+                const url = visible.get(change.id);
+                if (url.title_highlight && url.title !== change.title) {
+                    // The highlight was computed for the old title
+                    url.title_highlight = null;
+                }
+                Object.assign(url, {
+                    title: change.title,
+                    thumbnail: change.thumbnail,
+                    visit: change.visit
+                });
+            }
+            this.version = version;
+            this.renderUrls(this.urls);
+        } catch (error) {
+            console.error('Error syncing URL changes:', error);
+        } finally {
+            this.syncing = false;
+        }
+    }
+    
     renderUrls(urls) {
-        // Ensure we're working with an array
-        this.totalUrls = Array.isArray(urls) ? urls : [];
+        // Ensure we're working with an array; this is already the current page
+        const currentPageItems = Array.isArray(urls) ? urls : [];
         
         // Debug the rendering process
-        console.log('Rendering URLs:', this.totalUrls.length);
+        console.log('Rendering URLs:', currentPageItems.length);
         
-        const itemsPerPage = this.settings.getSetting('itemsPerPage');
-        this.totalPages = Math.ceil(this.totalUrls.length / itemsPerPage);
+        const itemsPerPage = this.pageSize || this.settings.getSetting('itemsPerPage');
+        this.totalPages = Math.ceil(this.totalItems / itemsPerPage);
         
-        // Reset to page 1 if we have no pages or are beyond the last page
-        if (this.totalPages === 0 || this.currentPage > this.totalPages) {
-            this.currentPage = Math.max(1, this.totalPages);
-        }
+        // Only pages whose starting cursor we already know can be jumped to
+        const maxReachablePage = this.pageCursors[this.currentPage] ? this.currentPage + 1 : this.currentPage;
+        const goToPageFunc = (page) => this.goToPage(page);
         
-        if (this.totalUrls.length === 0) {
+        if (currentPageItems.length === 0) {
             if (this.ui.container) {
                 this.ui.container.innerHTML = '';
             }
@@ -263,12 +352,9 @@ class UrlManager {
                 this.ui.noData.style.display = 'block';
             }
             
-            // FIX: Use local function instead of bind which was causing errors
-            const goToPageFunc = (page) => this.goToPage(page);
-            
             // Only call renderPagination if it exists
             if (this.ui && typeof this.ui.renderPagination === 'function') {
-                this.ui.renderPagination(this.currentPage, this.totalPages, 0, goToPageFunc);
+                this.ui.renderPagination(this.currentPage, this.totalPages, 0, goToPageFunc, maxReachablePage);
             }
             return;
         }
@@ -277,11 +363,6 @@ class UrlManager {
             this.ui.noData.style.display = 'none';
         }
         
-        // Get current page items
-        const startIndex = (this.currentPage - 1) * itemsPerPage;
-        const endIndex = Math.min(startIndex + itemsPerPage, this.totalUrls.length);
-        const currentPageItems = this.totalUrls.slice(startIndex, endIndex);
-        
         // Ensure we have handlers
         const handlers = {
             edit: (url, title, thumbnail) => this.editUrl(url, title, thumbnail),
@@ -295,25 +376,25 @@ class UrlManager {
                 .join('');
         }
         
-        // FIX: Use local function instead of bind which was causing errors
-        const goToPageFunc = (page) => this.goToPage(page);
-        
         // Only call renderPagination if it exists
         if (this.ui && typeof this.ui.renderPagination === 'function') {
             this.ui.renderPagination(
                 this.currentPage, 
                 this.totalPages, 
-                this.totalUrls.length, 
-                goToPageFunc
+                this.totalItems, 
+                goToPageFunc,
+                maxReachablePage
             );
         }
     }
     
     goToPage(page) {
         if (page < 1 || page > this.totalPages) return;
+        // Keyset pagination can only reach pages whose cursor is known
+        if (page > 1 && !this.pageCursors[page - 1]) return;
         
         this.currentPage = page;
-        this.renderUrls(this.totalUrls);
+        this.fetchUrls();
         window.scrollTo(0, 0); // Scroll to top when changing pages
     }
 
@@ -358,12 +439,15 @@ class UrlManager {
         return `
             <tr>
                 <td class="thumbnail-cell">
-                    ${url.thumbnail ? `<img src="${url.thumbnail}" alt="${url.title}" class="img-fluid rounded">` : '<i class="bi bi-link-45deg fs-2 text-primary"></i>'}
+                    ${url.thumbnail
+                        ? `<img src="/thumb/${url.id}" alt="${url.title}" class="img-fluid rounded" loading="lazy" onerror="this.hidden = true; this.nextElementSibling.hidden = false"><i class="bi bi-link-45deg fs-2 text-primary" hidden></i>`
+                        : '<i class="bi bi-link-45deg fs-2 text-primary"></i>'}
                 </td>
                 <td>
                     <div>
-                        <h5 class="mb-1 text-truncate" style="max-width: 300px;" title="${url.title}">${url.title}</h5>
+                        <h5 class="mb-1 text-truncate" style="max-width: 300px;" title="${url.title}">${url.title_highlight || url.title}</h5>
                         <small class="text-muted d-block mb-1">${this.extractDomain(url.url)}</small>
+                        ${url.snippet ? `<small class="d-block mb-1 search-snippet">${url.snippet}</small>` : ''}
                         <small class="text-muted">${this.formatDate(url.created_date)}</small>
                     </div>
                 </td>
@@ -438,7 +522,8 @@ class UrlManager {
             case 'custom':
                 return {
                     from: this.dateFrom.value ? new Date(this.dateFrom.value) : null,
-                    to: this.dateTo.value ? new Date(this.dateTo.value) : null
+                    // Include the whole "to" day
+                    to: this.dateTo.value ? new Date(new Date(this.dateTo.value).getTime() + 86399999) : null
                 };
             default:
                 return { from: null, to: null };
@@ -446,50 +531,25 @@ class UrlManager {
     }
 
     filterUrls() {
-        const searchTerm = this.searchInput.value.toLowerCase();
         const { from, to } = this.getDateRange();
-        const sortBy = this.sortFilter.value;
-
-        let filtered = this.urls.filter(url => {
-            const matchesSearch = !searchTerm || 
-                url.title.toLowerCase().includes(searchTerm) || 
-                url.url.toLowerCase().includes(searchTerm);
-
-            if (!matchesSearch) return false;
-
-            if (from && to) {
-                const urlDate = new Date(url.created_date);
-                return urlDate >= from && urlDate <= to;
-            }
-
-            return true;
-        });
-
-        // Sort filtered results
-        filtered.sort((a, b) => {
-            switch (sortBy) {
-                case 'date_desc':
-                    return new Date(b.created_date) - new Date(a.created_date);
-                case 'date_asc':
-                    return new Date(a.created_date) - new Date(b.created_date);
-                case 'title':
-                    return a.title.localeCompare(b.title);
-                default:
-                    return 0;
-            }
-        });
-
-        this.renderUrls(filtered);
+        
+        this.query = {
+            search: this.searchInput ? this.searchInput.value.trim() : '',
+            sort: this.sortFilter ? this.sortFilter.value : 'date_desc',
+            date_from: from ? from.toISOString() : null,
+            date_to: to ? to.toISOString() : null
+        };
+        
+        // A new query invalidates all known cursors
+        this.resetPagination();
+        return this.fetchUrls();
     }
 
     sortUrls(by) {
-        const sorted = [...this.urls].sort((a, b) => {
-            if (by === 'date') {
-                return new Date(b.created_date) - new Date(a.created_date);
-            }
-            return a.title.localeCompare(b.title);
-        });
-        this.renderUrls(sorted);
+        if (this.sortFilter) {
+            this.sortFilter.value = by === 'date' ? 'date_desc' : 'title';
+        }
+        return this.filterUrls();
     }
 
     // Make sure we have the startPolling method defined
@@ -505,7 +565,7 @@ class UrlManager {
         // Start a new interval with the current refresh interval from settings
         const refreshInterval = this.settings.getSetting('refreshInterval');
         console.log(`Starting polling with interval: ${refreshInterval}ms`);
-        this.pollingInterval = setInterval(() => this.fetchUrls(), refreshInterval);
+        this.pollingInterval = setInterval(() => this.syncChanges(), refreshInterval);
     }
 
     editUrl(id, url, title, thumbnail) {
@@ -84,7 +84,9 @@ class UIManager {
         return `
             <tr>
                 <td class="thumbnail-cell">
-                    ${url.thumbnail ? `<img src="${url.thumbnail}" alt="${url.title}" class="img-fluid rounded">` : '<i class="bi bi-link-45deg fs-2 text-primary"></i>'}
+                    ${url.thumbnail
+                        ? `<img src="/thumb/${url.id}" alt="${url.title}" class="img-fluid rounded" loading="lazy" onerror="this.hidden = true; this.nextElementSibling.hidden = false"><i class="bi bi-link-45deg fs-2 text-primary" hidden></i>`
+                        : '<i class="bi bi-link-45deg fs-2 text-primary"></i>'}
                 </td>
                 <td>
                     <div>
@@ -137,7 +139,7 @@ class UIManager {
         }
     }
 
-    renderPagination(currentPage, totalPages, totalItems, goToPageCallback) {
+    renderPagination(currentPage, totalPages, totalItems, goToPageCallback, maxReachablePage = totalPages) {
         const paginationElement = document.getElementById('pagination');
         if (!paginationElement) return;
         
@@ -178,8 +180,9 @@ class UIManager {
         
         // Page numbers
         for (let i = startPage; i <= endPage; i++) {
+            // Pages past the last known keyset cursor cannot be jumped to directly
             paginationHTML += `
-                <li class="page-item ${i === currentPage ? 'active' : ''}">
+                <li class="page-item ${i === currentPage ? 'active' : ''} ${i > maxReachablePage ? 'disabled' : ''}">
                     <a class="page-link" href="#" data-page="${i}">${i}</a>
                 </li>
             `;
@@ -191,14 +194,14 @@ class UIManager {
                 paginationHTML += `<li class="page-item disabled"><span class="page-link">...</span></li>`;
             }
             paginationHTML += `
-                <li class="page-item">
+                <li class="page-item ${totalPages > maxReachablePage ? 'disabled' : ''}">
                     <a class="page-link" href="#" data-page="${totalPages}">${totalPages}</a>
                 </li>
             `;
         }
         
         paginationHTML += `
-                    <li class="page-item ${currentPage === totalPages ? 'disabled' : ''}">
+                    <li class="page-item ${currentPage === totalPages || currentPage >= maxReachablePage ? 'disabled' : ''}">
                         <a class="page-link" href="#" data-page="${currentPage + 1}">Next</a>
                     </li>
                 </ul>
@@ -0,0 +1,120 @@
+import time
+from types import SimpleNamespace
+from pymongo.errors import AutoReconnect
+from datafactory import MongoDBPipeline
+
+class FakeCollection:
+    def __init__(self):
+        self.docs = {}
+        self.batches = []
+        self.failures = 0
+
+    def create_index(self, key, unique=False):
+        pass
+
+    def bulk_write(self, operations, ordered=True):
+        if self.failures:
+            self.failures -= 1
+            raise AutoReconnect('connection refused')
+        upserted = 0
+        for op in operations:
+            url = op._filter['url']
+            upserted += url not in self.docs
+            self.docs[url] = op._doc
+        self.batches.append(len(operations))
+        return SimpleNamespace(upserted_count=upserted, modified_count=len(operations) - upserted)
+
+class FakeClient:
+    def __init__(self):
+        self.collection = FakeCollection()
+        self.closed = False
+
+    def __getitem__(self, name):
+        return {MongoDBPipeline.collection_name: self.collection}
+
+    def close(self):
+        self.closed = True
+
+SPIDER = SimpleNamespace(name='page_summarizer')
+
+def open_pipeline(**kwargs):
+    client = FakeClient()
+    pipeline = MongoDBPipeline(mongo_db='edvise', client=client, **kwargs)
+    pipeline.open_spider(SPIDER)
+    return pipeline, client.collection
+
+def page(url, title='Title'):
+    return {'url': url, 'title': title}
+
+def test_items_are_upserted_in_batches():
+    pipeline, collection = open_pipeline(batch_size=3, flush_interval=60)
+    for i in range(4):
+        pipeline.process_item(page(f'https://example.com/{i}'), SPIDER)
+    assert collection.batches == [3]
+
+    pipeline.process_item(page('https://example.com/0', 'Updated'), SPIDER)
+    pipeline.close_spider(SPIDER)
+    assert collection.batches == [3, 2]
+    assert len(collection.docs) == 4
+    assert collection.docs['https://example.com/0']['title'] == 'Updated'
+    assert collection.docs['https://example.com/0']['spider_name'] == 'page_summarizer'
+
+def test_latest_version_wins_within_a_batch():
+    pipeline, collection = open_pipeline(batch_size=10, flush_interval=60)
+    pipeline.process_item(page('https://example.com/a', 'Old'), SPIDER)
+    pipeline.process_item(page('https://example.com/a', 'New'), SPIDER)
+    pipeline.close_spider(SPIDER)
+    assert collection.batches == [1]
+    assert collection.docs['https://example.com/a']['title'] == 'New'
+
+def test_partial_batch_is_flushed_once_due():
+    pipeline, collection = open_pipeline(batch_size=10, flush_interval=0.05)
+    pipeline.process_item(page('https://example.com/a'), SPIDER)
+    pipeline._flush_if_due()
+    assert collection.batches == []
+    time.sleep(0.06)
+    pipeline._flush_if_due()
+    assert collection.batches == [1]
+    pipeline.close_spider(SPIDER)
+
+def test_failed_batch_is_kept_and_retried():
+    pipeline, collection = open_pipeline(batch_size=2, flush_interval=0.05)
+    collection.failures = 1
+    pipeline.process_item(page('https://example.com/a'), SPIDER)
+    pipeline.process_item(page('https://example.com/b'), SPIDER)
+    assert collection.docs == {}
+    # A newer version scraped meanwhile replaces the kept one
+    pipeline.process_item(page('https://example.com/a', 'Newer'), SPIDER)
+    # Full again, but the retry waits out the flush interval
+    assert collection.batches == []
+    time.sleep(0.06)
+    pipeline._flush_if_due()
+    assert collection.batches == [2]
+    assert collection.docs['https://example.com/a']['title'] == 'Newer'
+    pipeline.close_spider(SPIDER)
+    assert pipeline._stats['dropped'] == 0
+
+def test_close_retries_kept_items():
+    pipeline, collection = open_pipeline(batch_size=1, flush_interval=60)
+    collection.failures = 1
+    pipeline.process_item(page('https://example.com/a'), SPIDER)
+    assert collection.docs == {}
+    pipeline.close_spider(SPIDER)
+    assert list(collection.docs) == ['https://example.com/a']
+
+def test_kept_items_are_capped_oldest_first():
+    pipeline, collection = open_pipeline(batch_size=2, flush_interval=60, max_buffer=3)
+    collection.failures = 2
+    for i in range(2):
+        pipeline.process_item(page(f'https://example.com/{i}'), SPIDER)
+    pipeline.process_item(page('https://example.com/2'), SPIDER)
+    pipeline.process_item(page('https://example.com/3'), SPIDER)
+    pipeline.flush()
+    assert [doc['url'] for doc in pipeline._buffer] == [f'https://example.com/{i}' for i in (1, 2, 3)]
+    assert pipeline._stats['dropped'] == 1
+
+    collection.failures = 1
+    pipeline.close_spider(SPIDER)
+    assert collection.docs == {}
+    assert pipeline._stats['dropped'] == 4
+    assert pipeline._buffer == []
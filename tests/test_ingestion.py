@@ -0,0 +1,79 @@
+import ingestion
+from ingestion import IngestionPipeline, MetadataFetcher
+from models import MAX_TITLE_LENGTH, MAX_THUMBNAIL_LENGTH, MAX_URL_LENGTH
+
+class FakeFetcher:
+    def __init__(self, titles):
+        self.titles = titles
+
+    def fetch(self, url):
+        return self.titles.get(url, url), None
+
+class VarcharWriter:
+    """Stands in for URL.add_many, failing a whole batch the way Postgres does on an overlong title"""
+
+    def __init__(self):
+        self.rows = []
+        self.calls = 0
+
+    def __call__(self, rows):
+        self.calls += 1
+        if any(title and len(title) > MAX_TITLE_LENGTH for _, title, _ in rows):
+            raise ValueError('value too long for type character varying(200)')
+        self.rows.extend(rows)
+        return len(rows)
+
+def run_pipeline(urls, titles, writer):
+    pipeline = IngestionPipeline(fetcher=FakeFetcher(titles), workers=2, writer=writer,
+                                 exists=lambda url: False, batch_size=len(urls), flush_interval=0.05)
+    pipeline.start()
+    accepted = pipeline.submit_many(urls)
+    pipeline.stop()
+    return pipeline, accepted
+
+def test_overlong_title_fails_only_its_row(monkeypatch):
+    monkeypatch.setattr(ingestion, 'WRITE_RETRY_BACKOFF', 0.01)
+    urls = [f'https://example.com/{i}' for i in range(5)]
+    writer = VarcharWriter()
+    pipeline, _ = run_pipeline(urls, {urls[2]: 'x' * 300}, writer)
+
+    stats = pipeline.stats()
+    assert sorted(url for url, _, _ in writer.rows) == sorted(urls[:2] + urls[3:])
+    assert stats['written'] == 4
+    assert stats['write_failed'] == 1
+    # One batch plus its retries, then a write per row
+    assert writer.calls == ingestion.WRITE_ATTEMPTS + len(urls)
+
+def test_later_batches_are_written_after_a_bad_row(monkeypatch):
+    monkeypatch.setattr(ingestion, 'WRITE_RETRY_BACKOFF', 0.01)
+    writer = VarcharWriter()
+    pipeline = IngestionPipeline(fetcher=FakeFetcher({'https://example.com/bad': 'x' * 300}), workers=1,
+                                 writer=writer, exists=lambda url: False, batch_size=1, flush_interval=0.05)
+    pipeline.start()
+    pipeline.submit_many(['https://example.com/bad'])
+    pipeline.submit_many(['https://example.com/good'])
+    pipeline.stop()
+    assert [url for url, _, _ in writer.rows] == ['https://example.com/good']
+
+def test_fetcher_fits_metadata_to_the_url_table(monkeypatch):
+    fetcher = MetadataFetcher(use_cache=False)
+    metadata = {'title': 't' * 500, 'og_title': None, 'og_image': 'https://example.com/' + 'i' * MAX_THUMBNAIL_LENGTH}
+    monkeypatch.setattr(fetcher, 'fetch_metadata', lambda url: metadata)
+    title, thumbnail = fetcher.fetch('https://example.com/')
+    assert len(title) <= MAX_TITLE_LENGTH
+    assert thumbnail is None
+
+    monkeypatch.setattr(fetcher, 'fetch_metadata', lambda url: None)
+    long_url = 'https://example.com/' + 'p' * 300
+    title, _ = fetcher.fetch(long_url)
+    assert len(title) <= MAX_TITLE_LENGTH
+
+def test_overlong_and_invalid_urls_are_not_accepted():
+    pipeline = IngestionPipeline(fetcher=FakeFetcher({}), writer=VarcharWriter(), exists=lambda url: False)
+    accepted = pipeline.submit_many([
+        'https://example.com/' + 'p' * MAX_URL_LENGTH,
+        'http://example.com:99999/path',
+        'https://example.com/ok',
+    ])
+    assert accepted == ['https://example.com/ok']
+    assert pipeline.stats()['invalid'] == 2
@@ -0,0 +1,300 @@
+import hashlib
+import io
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+import requests
+from PIL import Image, ImageOps
+from config import (
+    THUMB_CACHE_DIR, THUMB_CACHE_MAX_BYTES, THUMB_WIDTH, THUMB_HEIGHT, THUMB_QUALITY,
+    THUMB_SOURCE_MAX_BYTES, THUMB_FAILURE_TTL, THUMB_PREFETCH_WORKERS,
+    FETCH_CONNECT_TIMEOUT, FETCH_READ_TIMEOUT
+)
+
+logger = logging.getLogger(__name__)
+
+# Minimum seconds between persisting a file's LRU access time
+ACCESS_WRITE_INTERVAL = 60
+# Sources decoded at more pixels than this (after JPEG draft scaling) are rejected
+MAX_SOURCE_PIXELS = 40 * 1000 * 1000
+# Prefetches waiting beyond this are dropped; those images are fetched on first view instead
+MAX_PENDING_PREFETCHES = 1000
+# Eviction frees space down to this fraction of max_bytes, so it doesn't run on every store
+EVICT_LOW_WATER = 0.9
+
+_DIGEST = re.compile(r'^[0-9a-f]{64}$')
+
+class ThumbnailCache:
+    """Downscaled og:image thumbnails in a content-addressed, size-bounded disk cache.
+
+    Each thumbnail is stored once as <dir>/<aa>/<sha256>.webp, named by the
+    hash of its own bytes, so a file's URL never changes content and can be
+    cached by browsers forever. A SQLite index maps source image URLs to
+    digests (or to a recent failure, so dead images aren't refetched on every
+    render) and tracks file sizes and access times for LRU eviction.
+    """
+
+    def __init__(self, directory=THUMB_CACHE_DIR, max_bytes=THUMB_CACHE_MAX_BYTES,
+                 width=THUMB_WIDTH, height=THUMB_HEIGHT, quality=THUMB_QUALITY,
+                 max_source_bytes=THUMB_SOURCE_MAX_BYTES, failure_ttl=THUMB_FAILURE_TTL,
+                 workers=THUMB_PREFETCH_WORKERS):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.size = (width, height)
+        self.quality = quality
+        self.max_source_bytes = max_source_bytes
+        self.failure_ttl = failure_ttl
+        self.timeout = (FETCH_CONNECT_TIMEOUT, FETCH_READ_TIMEOUT)
+        self.session = requests.Session()
+        self.session.headers.update({'User-Agent': 'Edvise/1.0 (+https://github.com/codeesasi/Edvise)'})
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='thumb-prefetch')
+        self._lock = threading.Lock()
+        self._fetching = {}  # source URL -> Event set once its fetch is recorded
+        self._prefetching = set()
+        self._accessed = {}  # digest -> last persisted access time
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'negative_hits': 0,
+            'fetched': 0,
+            'failed': 0,
+            'prefetched': 0,
+            'prefetch_dropped': 0,
+            'evictions': 0,
+        }
+        os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(directory, 'index.sqlite3'), check_same_thread=False, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS sources (
+                source_url TEXT PRIMARY KEY,
+                digest TEXT,
+                error TEXT,
+                fetched_at REAL NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_sources_digest ON sources (digest)")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                digest TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_files_last_access ON files (last_access)")
+        self._db.commit()
+        self._total_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM files").fetchone()[0]
+
+    def path(self, digest):
+        """File path for a digest, or None if it isn't one"""
+        if not _DIGEST.match(digest or ''):
+            return None
+        return os.path.join(self.directory, digest[:2], f'{digest}.webp')
+
+    def get(self, source_url, fetch=True):
+        """Digest of the thumbnail for an image URL, fetched and stored on a miss; None if unavailable"""
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT digest, fetched_at FROM sources WHERE source_url = ?", (source_url,)
+            ).fetchone()
+            if row is not None:
+                digest, fetched_at = row
+                if digest is not None and os.path.exists(self.path(digest)):
+                    self._stats['hits'] += 1
+                    self._touch(digest, now)
+                    return digest
+                if digest is None and now - fetched_at < self.failure_ttl:
+                    self._stats['negative_hits'] += 1
+                    return None
+            if not fetch:
+                return None
+            event = self._fetching.get(source_url)
+            if event is None:
+                event = self._fetching[source_url] = threading.Event()
+                self._stats['misses'] += 1
+                owner = True
+            else:
+                owner = False
+        if not owner:
+            # Another request or a prefetch is already fetching this image
+            event.wait(sum(self.timeout) * 2)
+            return self.get(source_url, fetch=False)
+        try:
+            return self._fetch(source_url)
+        finally:
+            with self._lock:
+                self._fetching.pop(source_url).set()
+
+    def touch(self, digest):
+        """Note that a stored thumbnail was served, for LRU eviction"""
+        with self._lock:
+            self._touch(digest, time.time())
+
+    def prefetch(self, source_urls):
+        """Fetch thumbnails for these image URLs in the background, skipping empty and queued ones"""
+        for source_url in source_urls:
+            if not source_url:
+                continue
+            with self._lock:
+                if source_url in self._prefetching:
+                    continue
+                if len(self._prefetching) >= MAX_PENDING_PREFETCHES:
+                    self._stats['prefetch_dropped'] += 1
+                    continue
+                self._prefetching.add(source_url)
+            self._executor.submit(self._prefetch, source_url)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['files'] = self._db.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+            stats['failed_sources'] = self._db.execute(
+                "SELECT COUNT(*) FROM sources WHERE digest IS NULL"
+            ).fetchone()[0]
+            stats['bytes'] = self._total_bytes
+            stats['max_bytes'] = self.max_bytes
+            stats['prefetch_pending'] = len(self._prefetching)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+    def _prefetch(self, source_url):
+        try:
+            if self.get(source_url) is not None:
+                with self._lock:
+                    self._stats['prefetched'] += 1
+        except Exception as e:
+            logger.error(f"Error prefetching thumbnail {source_url}: {e}")
+        finally:
+            with self._lock:
+                self._prefetching.discard(source_url)
+
+    def _fetch(self, source_url):
+        try:
+            thumbnail = self._render(self._download(source_url))
+        except Exception as e:
+            logger.info(f"No thumbnail for {source_url}: {e}")
+            self._record(source_url, None, error=str(e)[:500])
+            return None
+        digest = hashlib.sha256(thumbnail).hexdigest()
+        path = self.path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            partial = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(partial, 'wb') as f:
+                f.write(thumbnail)
+            os.replace(partial, path)
+        self._record(source_url, digest, size=len(thumbnail))
+        return digest
+
+    def _download(self, source_url):
+        """Image bytes, refusing anything over max_source_bytes before reading it all"""
+        if urlsplit(source_url).scheme not in ('http', 'https'):
+            raise ValueError("not an http(s) URL")
+        with self.session.get(source_url, timeout=self.timeout, stream=True) as response:
+            response.raise_for_status()
+            length = response.headers.get('Content-Length', '')
+            if length.isdigit() and int(length) > self.max_source_bytes:
+                raise ValueError(f"image is {length} bytes")
+            data = bytearray()
+            for chunk in response.iter_content(chunk_size=65536):
+                data += chunk
+                if len(data) > self.max_source_bytes:
+                    raise ValueError(f"image exceeds {self.max_source_bytes} bytes")
+        return bytes(data)
+
+    def _render(self, data):
+        """Crop-fill the image to the thumbnail box (like CSS object-fit: cover) as WebP"""
+        with Image.open(io.BytesIO(data)) as image:
+            # JPEGs decode straight at a fraction of full size, still covering the box
+            image.draft('RGB', self.size)
+            if image.width * image.height > MAX_SOURCE_PIXELS:
+                raise ValueError(f"image is {image.width}x{image.height}")
+            image = ImageOps.exif_transpose(image)
+            if image.mode not in ('RGB', 'RGBA'):
+                transparent = image.mode in ('LA', 'PA') or 'transparency' in image.info
+                image = image.convert('RGBA' if transparent else 'RGB')
+            thumbnail = ImageOps.fit(image, self.size, Image.LANCZOS)
+        out = io.BytesIO()
+        thumbnail.save(out, 'WEBP', quality=self.quality, method=4)
+        return out.getvalue()
+
+    def _record(self, source_url, digest, size=0, error=None):
+        now = time.time()
+        with self._lock:
+            self._db.execute("""
+                INSERT INTO sources (source_url, digest, error, fetched_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(source_url) DO UPDATE SET
+                    digest = excluded.digest, error = excluded.error, fetched_at = excluded.fetched_at
+            """, (source_url, digest, error, now))
+            if digest is None:
+                self._stats['failed'] += 1
+            else:
+                # Identical images from different sources share one file
+                added = self._db.execute(
+                    "INSERT INTO files (digest, size, last_access) VALUES (?, ?, ?) ON CONFLICT(digest) DO NOTHING",
+                    (digest, size, now)
+                ).rowcount
+                if added:
+                    self._total_bytes += size
+                else:
+                    self._touch(digest, now, commit=False)
+                self._accessed[digest] = now
+                self._stats['fetched'] += 1
+            self._db.commit()
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _touch(self, digest, now, commit=True):
+        if now - self._accessed.get(digest, 0) <= ACCESS_WRITE_INTERVAL:
+            return
+        self._accessed[digest] = now
+        self._db.execute("UPDATE files SET last_access = ? WHERE digest = ?", (now, digest))
+        if commit:
+            self._db.commit()
+
+    def _evict(self):
+        """Delete least recently served files until the cache is under its low-water mark"""
+        # Other processes share the index, so recount before deleting anything
+        self._total_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM files").fetchone()[0]
+        target = self.max_bytes * EVICT_LOW_WATER
+        while self._total_bytes > target:
+            victims = self._db.execute(
+                "SELECT digest, size FROM files ORDER BY last_access LIMIT 100"
+            ).fetchall()
+            if not victims:
+                break
+            evicted = []
+            for digest, size in victims:
+                if self._total_bytes <= target:
+                    break
+                try:
+                    os.remove(self.path(digest))
+                except FileNotFoundError:
+                    pass
+                self._accessed.pop(digest, None)
+                self._total_bytes -= size
+                self._stats['evictions'] += 1
+                evicted.append((digest,))
+            self._db.executemany("DELETE FROM files WHERE digest = ?", evicted)
+            # Their sources are fetched again on next view
+            self._db.executemany("DELETE FROM sources WHERE digest = ?", evicted)
+            self._db.commit()
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_thumbnail_cache():
+    """Return the process-wide thumbnail cache, opening it on first use"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ThumbnailCache()
+    return _cache
@@ -0,0 +1,83 @@
+import logging
+import threading
+from canonical import InvalidURL, canonical_key
+from models import URL
+
+logger = logging.getLogger(__name__)
+
+class KnownUrlIndex:
+    """In-process set of canonical URL hashes already stored in the url table.
+
+    Lets ingestion reject URLs it has seen without a database round trip. The
+    set holds 64-bit hashes only (~60 bytes per URL in CPython), and is warmed
+    from Postgres once at startup and then kept current by the ingestion writer.
+    A miss is not authoritative, since another process may have inserted the
+    URL, so callers still fall back to the database for unknown URLs.
+    """
+
+    def __init__(self):
+        self._hashes = set()
+        self._lock = threading.Lock()
+        self.warmed = False
+        self._stats = {'hits': 0, 'misses': 0}
+
+    def warm(self):
+        """Backfill missing canonical columns, then load every stored hash"""
+        backfilled = URL.backfill_canonical()
+        if backfilled:
+            logger.info(f"Backfilled canonical URLs for {backfilled} rows")
+        hashes = set(URL.iter_url_hashes())
+        with self._lock:
+            self._hashes |= hashes
+            self.warmed = True
+        logger.info(f"Known URL index warmed with {len(hashes)} entries")
+
+    def contains(self, url):
+        try:
+            _, hashed = canonical_key(url)
+        except InvalidURL:
+            return False
+        with self._lock:
+            found = hashed in self._hashes
+            self._stats['hits' if found else 'misses'] += 1
+        return found
+
+    def add(self, url):
+        try:
+            _, hashed = canonical_key(url)
+        except InvalidURL:
+            return
+        with self._lock:
+            self._hashes.add(hashed)
+
+    def add_hashes(self, hashes):
+        with self._lock:
+            self._hashes.update(hashes)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._hashes)
+            stats['warmed'] = self.warmed
+        return stats
+
+    def __len__(self):
+        return len(self._hashes)
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_url_index():
+    """Return the process-wide known-URL index, warming it from the database on first use"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                index = KnownUrlIndex()
+                try:
+                    index.warm()
+                except Exception as e:
+                    # An unwarmed index only costs extra database lookups
+                    logger.error(f"Could not warm known URL index: {e}")
+                _index = index
+    return _index
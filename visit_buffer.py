@@ -0,0 +1,134 @@
+import atexit
+import logging
+import threading
+from collections import Counter
+from models import URL
+from config import VISIT_FLUSH_INTERVAL, VISIT_FLUSH_THRESHOLD
+
+logger = logging.getLogger(__name__)
+
+class VisitBuffer:
+    """Write-behind buffer for visit counters.
+
+    Clicks are counted in memory and applied to tbl_maintainvisit as one
+    batched UPDATE per flush, either every flush_interval seconds or as soon
+    as threshold clicks are pending. Counts being written are kept visible
+    until the UPDATE commits, so effective counts never dip during a flush.
+    """
+
+    def __init__(self, flush_interval=VISIT_FLUSH_INTERVAL, threshold=VISIT_FLUSH_THRESHOLD,
+                 writer=URL.add_visits):
+        self.flush_interval = flush_interval
+        self.threshold = threshold
+        self._writer = writer
+        self._pending = Counter()
+        self._in_flight = Counter()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        # Bumped on every click so cached responses can tell pending counts changed
+        self.generation = 0
+        self._stats = {
+            'recorded': 0,
+            'flushed': 0,
+            'flushes': 0,
+            'flush_errors': 0,
+        }
+
+    def start(self):
+        """Start the background flusher and flush whatever is left at interpreter exit"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='visit-flusher', daemon=True)
+            self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self, timeout=10):
+        """Stop the flusher and write out pending counts"""
+        self._stop.set()
+        self._wake.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout=timeout)
+        self.flush()
+
+    def record(self, url_id, count=1):
+        """Count a visit; returns the number of visits for url_id not yet in the database"""
+        with self._lock:
+            self._pending[url_id] += count
+            self.generation += 1
+            self._stats['recorded'] += count
+            pending = self._pending[url_id] + self._in_flight[url_id]
+            if sum(self._pending.values()) >= self.threshold:
+                self._wake.set()
+        return pending
+
+    def pending(self, url_id):
+        with self._lock:
+            return self._pending[url_id] + self._in_flight[url_id]
+
+    def apply(self, rows):
+        """Add unflushed visits to the 'visit' field of URL rows that have one, in place"""
+        with self._lock:
+            if not self._pending and not self._in_flight:
+                return rows
+            for row in rows:
+                extra = self._pending[row['id']] + self._in_flight[row['id']]
+                if extra and 'visit' in row:
+                    row['visit'] = (row['visit'] or 0) + extra
+        return rows
+
+    def flush(self):
+        """Write all pending counts in one batch; failed batches are kept for the next flush"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                batch, self._pending = self._pending, Counter()
+                self._in_flight = batch
+            try:
+                self._writer(dict(batch))
+            except Exception as e:
+                logger.error(f"Failed to flush {sum(batch.values())} visits: {e}")
+                with self._lock:
+                    self._pending.update(batch)
+                    self._in_flight = Counter()
+                    self._stats['flush_errors'] += 1
+                return 0
+            with self._lock:
+                self._in_flight = Counter()
+                flushed = sum(batch.values())
+                self._stats['flushed'] += flushed
+                self._stats['flushes'] += 1
+            return flushed
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['pending'] = sum(self._pending.values()) + sum(self._in_flight.values())
+            stats['pending_urls'] = len(self._pending.keys() | self._in_flight.keys())
+        return stats
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+def get_visit_buffer():
+    """Return the process-wide visit buffer, starting its flusher on first use"""
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                visit_buffer = VisitBuffer()
+                visit_buffer.start()
+                _buffer = visit_buffer
+    return _buffer